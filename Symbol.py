@@ -1,5 +1,5 @@
-import pandas as pd
-import logging
+import threading
+from typing import Optional
 
 
 class Symbol:
@@ -8,10 +8,45 @@ class Symbol:
     id: What the api expects. ie tsla or bitcoin
     name: Human readable. ie Tesla or Bitcoin
     tag: Uppercase tag to call the symbol. ie $TSLA or $$BTC
+
+    Instances are immutable and interned, use intern to get the shared instance.
     """
 
-    def __init__(self, symbol) -> None:
-        self.symbol = symbol
+    __slots__ = ("symbol", "id", "name", "tag")
+
+    _instances = {}
+    _lock = threading.Lock()
+
+    def __init__(
+        self, symbol: str, id: Optional[str] = None, name: Optional[str] = None
+    ) -> None:
+        set_ = object.__setattr__
+        set_(self, "symbol", symbol)
+        set_(self, "id", id or symbol)
+        set_(self, "name", name or symbol)
+        set_(self, "tag", "$" + symbol.upper())
+
+    @classmethod
+    def intern(cls, symbol: str, *args):
+        """Returns the shared instance for these arguments, creating it once."""
+        key = (cls, symbol, *args)
+        if (instance := cls._instances.get(key)) is None:
+            with cls._lock:
+                instance = cls._instances.setdefault(key, cls(symbol, *args))
+        return instance
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self):
+        # Unpickled copies resolve to the shared instance of their process.
+        return self.__class__.intern, self._key()
+
+    def _key(self) -> tuple:
+        return (self.symbol, self.id, self.name)
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} instance of {self.symbol} at {id(self)}>"
@@ -21,14 +56,28 @@ class Symbol:
 
 
 class Coin(Symbol):
-    """Cryptocurrency Object. Gets data from CoinGecko."""
+    """Cryptocurrency Object. Gets data from ByBit.
+
+    quote: Currency the coin is priced in. ie USDT
+    pair: Market name the api expects. ie BTCUSDT
+    """
+
+    __slots__ = ("quote", "pair")
+
+    def __init__(self, symbol: str, quote: str = "USDT") -> None:
+        pair = symbol + quote
+        super().__init__(symbol, pair)
+        set_ = object.__setattr__
+        set_(self, "tag", "$$" + symbol.upper())
+        set_(self, "quote", quote)
+        set_(self, "pair", pair)
 
-    def __init__(self, symbol: pd.DataFrame) -> None:
-        if len(symbol) > 1:
-            logging.info(f"Crypto with shared id:\n\t{symbol.baseCurrency}")
-            symbol = symbol.head(1)
+    @classmethod
+    def intern(cls, symbol: str, quote: str = "USDT") -> "Coin":
+        return super().intern(symbol, quote)
 
-        self.symbol = symbol.baseCurrency.values[0]
+    def _key(self) -> tuple:
+        return (self.symbol, self.quote)
 
 
 # ToDo: implement NFT subclass and add floor price commands
@@ -2,30 +2,70 @@
 Functions and Info specific to the Telegram Bot
 """
 
+import os
 import re
+from functools import cached_property
 
-import requests as r
+LICENSE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "LICENSE")
+LICENSE_URL = "https://github.com/alhedlund/telegram-stock-bot/-/raw/master/LICENSE"
 
 
 class T_info:
-    license = re.sub(
-        r"\b\n",
-        " ",
-        r.get(
-            "https://github.com/alhedlund/telegram-stock-bot/-/raw/master/LICENSE"
-        ).text,
-    )
+    @cached_property
+    def license(self) -> str:
+        """License text, read from the bundled LICENSE file on first use."""
+        try:
+            with open(LICENSE_PATH, encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            import requests as r
+
+            text = r.get(LICENSE_URL, timeout=10).text
+
+        return re.sub(r"\b\n", " ", text)
 
     help_text = """
 
 **Commands**
-        - `/p [symbol]` Key statistics about the symbol.  🔢
-        - `/c [symbol] [frequency]` Plot of the stocks movement for specified period. 📈
+        - `/p [symbol] [indicators]` Key statistics about the symbol.  🔢
+        - `/c [symbol] [frequency] [indicators]` Plot of the stocks movement for specified period. 📈
+        - `/alert [symbol] [> or <] [price]` Get a message when the price gets there. 🔔
+        - `/w add [symbols]` Add symbols to this chats watchlist, `/w` to quote them all. 👀
         - `/help` Get some help using the bot. 🆘
+        - `@[bot name] [symbol or name]` Search for a symbol from any chat. 🔎
     """
 
+    price_help = (
+        "This command returns key statistics for a symbol.\nExample: /p btc\n\n"
+        + "Add indicators to quote them on 1 hour candles, or on another interval.\n"
+        + "Example: /p btc rsi ema50 4h"
+    )
+
+    chart_help = (
+        "This command returns a chart of the stocks movement for the past month.\nExample: /c btc\n\n"
+        + "Intervals:\n1 minute- 1m\n3 minute- 3m\n5 minute- 5m\n15 minute- 15m\n30 minute- 30m\n"
+        + "1 hour- 1h\n2 hour- 2h\n4 hour- 4h\n6 hour- 6h\n12 hour- 12h\n"
+        + "1 day- 1d\n1 week- 1w\n1 month- 1M\n\n"
+        + "Indicators:\nsma20 ema20 rsi14 bb20 vwap, any period up to 500 ie ema50\n"
+        + "Example: /c btc 1h ema20 rsi"
+    )
+
+    alert_help = (
+        "This command sends you a message once a coin reaches a price.\n"
+        + "Example: /alert btc > 70000\nExample: /alert eth below 1800\n\n"
+        + "Send /alert to list your alerts and /alert del 1 to remove alert #1."
+    )
+
+    watchlist_help = (
+        "This command quotes every symbol on this chats watchlist at once.\n"
+        + "Example: /w add btc eth sol avax link\nExample: /w\n\n"
+        + "Remove symbols with /w del eth"
+    )
+
 commands = """
 help - Get some help using the bot. 🆘
 p - [symbol] Key statistics about the symbol. 🔢
 c - [chart] [frequency] Plot of the past month. 📈
+alert - [symbol] [> or <] [price] Message when the price gets there. 🔔
+w - [add or del] [symbols] Quote or edit the watchlist. 👀
 """  # Not used by the bot but for updaing commands with BotFather
@@ -0,0 +1,413 @@
+"""Price alerts checked on every price update without scanning every rule.
+
+Each symbol keeps the thresholds of its alerts in two sorted lists, one for
+alerts waiting for the price to rise to a level and one for alerts waiting
+for it to fall to one. Crossed alerts always sit at one end of their list, so
+a price update that crosses nothing costs two comparisons and one that does
+costs a bisection, however many alerts are set.
+
+Alerts are kept in an append only file of fixed size records. Removing an
+alert appends a tombstone record, the file is compacted when it is loaded.
+"""
+
+import bisect
+import fcntl
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from logging import info, warning
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+
+from metrics import registry
+
+ALERT_STORE = os.environ.get(
+    "ALERT_STORE", os.path.join(os.environ.get("DATA_DIR", "data"), "alerts.bin")
+)
+MAX_ALERTS = int(os.environ.get("MAX_ALERTS", 20))  # Per chat
+
+RECORD = np.dtype(
+    [
+        ("chat", "<i8"),
+        ("number", "<u4"),
+        ("symbol", "S24"),
+        ("above", "?"),
+        ("price", "<f8"),
+        ("created", "<f8"),
+        ("live", "?"),  # False for tombstones
+    ]
+)
+
+# ie btc > 70000, $$eth below 1,850.5 or sol 25
+RULE_REGEX = re.compile(
+    r"^\$*([a-z]{2,20})\s*(>=?|<=?|above|below)?\s*\$?(\d[\d,]*\.?\d*|\.\d+)$",
+    re.IGNORECASE,
+)
+
+fired_total = registry.counter("alerts_fired_total", "Price alerts that fired.")
+check_seconds = registry.histogram(
+    "alert_check_seconds", "Time taken to check every alert against a snapshot."
+)
+
+
+def parse(text: str) -> Optional[tuple]:
+    """Reads an alert rule.
+
+    Parameters
+    ----------
+    text : str
+        Rule without the command. ie btc > 70000
+
+    Returns
+    -------
+    Optional[tuple]
+        (symbol, above, price), above is None when no direction was given.
+        None if the text is no rule.
+    """
+    if not (match := RULE_REGEX.match(text.strip())):
+        return None
+
+    symbol, direction, price = match.groups()
+    above = None if direction is None else direction[0] in ">aA"
+    return symbol, above, float(price.replace(",", ""))
+
+
+def format_price(price: float) -> str:
+    return f"${price:,.2f}" if price >= 1 else f"${price:.6g}"
+
+
+class Alert(NamedTuple):
+    chat: int
+    number: int  # Counts up from 1 within a chat
+    symbol: str
+    above: bool
+    price: float
+    created: float
+
+    def __str__(self) -> str:
+        direction = "above" if self.above else "below"
+        return f"#{self.number} {self.symbol} {direction} {format_price(self.price)}"
+
+    def reached(self, price: float) -> str:
+        """Message sent when the alert fires at price."""
+        return (
+            f"🔔 {self.symbol} reached {format_price(self.price)}, "
+            f"last price {format_price(price)}.\nAlert #{self.number} is now removed."
+        )
+
+
+class TooManyAlerts(Exception):
+    """Raised when a chat already has MAX_ALERTS alerts."""
+
+
+class AlertStore:
+    """
+    Alert records in one file. Appends happen under an exclusive file lock, so
+    every process on a host can share the file.
+    """
+
+    def __init__(self, path: str = ALERT_STORE) -> None:
+        self.path = path
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self) -> np.ndarray:
+        try:
+            count = os.path.getsize(self.path) // RECORD.itemsize
+        except OSError:
+            count = 0
+        if count == 0:
+            return np.empty(0, dtype=RECORD)
+
+        records = np.fromfile(self.path, dtype=RECORD, count=count)
+        # The newest record of each alert says whether it is still set.
+        newest = records[::-1]
+        _, first = np.unique(newest[["chat", "number"]], return_index=True)
+        records = newest[np.sort(first)][::-1]
+        return records[records["live"]]
+
+    def read(self) -> np.ndarray:
+        """Returns the records of every alert still set, oldest first."""
+        with self._locked():
+            return self._read()
+
+    def append(self, alerts: list, live: bool = True) -> None:
+        """Stores alerts as set, or as removed when live is False."""
+        if not alerts:
+            return
+
+        out = np.empty(len(alerts), dtype=RECORD)
+        for i, field in enumerate(Alert._fields):
+            out[field] = [alert[i] for alert in alerts]
+        out["live"] = live
+
+        with self._locked():
+            # One write of whole records so readers never see a partial one.
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, out.tobytes())
+            finally:
+                os.close(fd)
+
+    def compact(self) -> None:
+        """Rewrites the file without tombstones and the alerts they removed."""
+        with self._locked():
+            records = self._read()
+            with open(self.path + ".tmp", "wb") as f:
+                f.write(records.tobytes())
+            os.replace(self.path + ".tmp", self.path)
+
+
+class _Book:
+    """Alerts of one symbol, each side sorted by threshold."""
+
+    __slots__ = ("above", "above_alerts", "below", "below_alerts")
+
+    def __init__(self) -> None:
+        self.above, self.above_alerts = [], []
+        self.below, self.below_alerts = [], []
+
+    def __len__(self) -> int:
+        return len(self.above) + len(self.below)
+
+    def _side(self, above: bool) -> tuple:
+        if above:
+            return self.above, self.above_alerts
+        return self.below, self.below_alerts
+
+    def insert(self, alert: Alert) -> None:
+        prices, alerts = self._side(alert.above)
+        i = bisect.bisect_right(prices, alert.price)
+        prices.insert(i, alert.price)
+        alerts.insert(i, alert)
+
+    def remove(self, alert: Alert) -> None:
+        prices, alerts = self._side(alert.above)
+        i = alerts.index(alert, bisect.bisect_left(prices, alert.price))
+        del prices[i], alerts[i]
+
+    def cross(self, price: float) -> list:
+        """Removes and returns the alerts price reached."""
+        fired = []
+        # Rising alerts at or under the price are the lowest ones.
+        if self.above and self.above[0] <= price:
+            i = bisect.bisect_right(self.above, price)
+            fired += self.above_alerts[:i]
+            del self.above[:i], self.above_alerts[:i]
+        # Falling alerts at or over the price are the highest ones.
+        if self.below and self.below[-1] >= price:
+            i = bisect.bisect_left(self.below, price)
+            fired += self.below_alerts[i:]
+            del self.below[i:], self.below_alerts[i:]
+        return fired
+
+
+Listener = Callable[[list, float], None]
+
+
+class AlertEngine:
+    """
+    Every alert this process evaluates, indexed by symbol for price updates
+    and by chat for commands.
+    """
+
+    def __init__(
+        self,
+        store: Optional[AlertStore] = None,
+        quote: str = "USDT",
+        max_alerts: int = MAX_ALERTS,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        store : AlertStore, optional
+            Where alerts are persisted, defaults to ALERT_STORE.
+
+        quote : str
+            Quote currency of the pairs streamed tickers are named by.
+
+        max_alerts : int
+            Most alerts a chat can have set.
+        """
+        self.store = store if store is not None else AlertStore()
+        self.quote = quote
+        self.max_alerts = max_alerts
+        self.listeners = []
+
+        self._books = {}  # symbol -> _Book
+        self._chats = {}  # chat -> {number: Alert}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(alerts) for alerts in list(self._chats.values()))
+
+    def subscribe(self, listener: Listener) -> None:
+        """Calls listener(alerts, price) with the alerts each price update fired."""
+        self.listeners.append(listener)
+
+    def load(self, owned: Optional[Callable[[int], bool]] = None) -> None:
+        """Replaces the alerts in memory with the stored ones.
+
+        Parameters
+        ----------
+        owned : Callable[[int], bool], optional
+            Filters stored alerts by chat id, for processes that only handle
+            some of the chats.
+        """
+        self.store.compact()
+        records = self.store.read()
+        if owned is not None:
+            records = records[[owned(chat) for chat in records["chat"].tolist()]]
+
+        # Sorted by symbol, side and threshold, so each side is one slice.
+        records = records[
+            np.lexsort((records["price"], records["above"], records["symbol"]))
+        ]
+        symbols, first, inverse = np.unique(
+            records["symbol"], return_index=True, return_inverse=True
+        )
+        names = [symbol.decode() for symbol in symbols.tolist()]
+        prices = records["price"].tolist()
+        alerts = list(
+            map(
+                Alert,
+                records["chat"].tolist(),
+                records["number"].tolist(),
+                [names[i] for i in inverse.tolist()],
+                records["above"].tolist(),
+                prices,
+                records["created"].tolist(),
+            )
+        )
+
+        books, chats = {}, {}
+        bounds = np.append(first, len(records)).tolist()
+        below = np.cumsum(np.append(0, ~records["above"])).tolist()
+        for name, start, stop in zip(names, bounds, bounds[1:]):
+            # Falling alerts sort first, False < True.
+            split = start + below[stop] - below[start]
+            book = books[name] = _Book()
+            book.below, book.below_alerts = prices[start:split], alerts[start:split]
+            book.above, book.above_alerts = prices[split:stop], alerts[split:stop]
+        for alert in alerts:
+            chats.setdefault(alert.chat, {})[alert.number] = alert
+
+        with self._lock:
+            self._books, self._chats = books, chats
+        info(f"Loaded {len(records)} price alerts.")
+
+    def add(self, chat: int, symbol: str, above: bool, price: float) -> Alert:
+        """Sets an alert for when symbol reaches price.
+
+        Parameters
+        ----------
+        chat : int
+            Chat the alert is sent to.
+
+        symbol : str
+            Base currency. ie BTC
+
+        above : bool
+            True to fire once the price is at or above price, False for at or below.
+
+        price : float
+            Threshold in the quote currency.
+
+        Raises
+        ------
+        TooManyAlerts
+            When the chat already has max_alerts alerts.
+        """
+        with self._lock:
+            alerts = self._chats.setdefault(chat, {})
+            if len(alerts) >= self.max_alerts:
+                raise TooManyAlerts(chat)
+
+            number = next(n for n in range(1, len(alerts) + 2) if n not in alerts)
+            alert = Alert(chat, number, symbol, above, price, time.time())
+            alerts[number] = alert
+            if (book := self._books.get(symbol)) is None:
+                book = self._books[symbol] = _Book()
+            book.insert(alert)
+            self.store.append([alert])
+        return alert
+
+    def remove(self, chat: int, number: int) -> Optional[Alert]:
+        """Removes an alert of a chat, returns it or None if it is not set."""
+        with self._lock:
+            if (alert := self._chats.get(chat, {}).pop(number, None)) is None:
+                return None
+            book = self._books[alert.symbol]
+            book.remove(alert)
+            if not book:
+                del self._books[alert.symbol]
+            self.store.append([alert], live=False)
+        return alert
+
+    def alerts(self, chat: int) -> list[Alert]:
+        """Alerts set in a chat, by number."""
+        return sorted(self._chats.get(chat, {}).values())
+
+    def update(self, symbol: str, price: float) -> list[Alert]:
+        """Fires the alerts of symbol that price reached.
+
+        Parameters
+        ----------
+        symbol : str
+            Base currency. ie BTC
+
+        price : float
+            Latest price.
+
+        Returns
+        -------
+        list[Alert]
+            Alerts fired, they are removed and passed to every listener.
+        """
+        with self._lock:
+            if (book := self._books.get(symbol)) is None:
+                return []
+            if not (fired := book.cross(price)):
+                return []
+            if not book:
+                del self._books[symbol]
+            for alert in fired:
+                del self._chats[alert.chat][alert.number]
+            # Stored under the lock, or add could reuse a number and have its
+            # record overwritten by this tombstone.
+            self.store.append(fired, live=False)
+
+        fired_total.inc(amount=len(fired))
+        for listener in self.listeners:
+            try:
+                listener(fired, price)
+            except Exception as e:
+                warning(f"Alert listener failed: {e}")
+        return fired
+
+    def check(self, tickers) -> None:
+        """Updates every symbol with alerts from a TickerSnapshot."""
+        with check_seconds.time():
+            for symbol in list(self._books):
+                if (price := tickers.value(symbol, "lastPrice")) is not None:
+                    self.update(symbol, price)
+
+    def on_ticker(self, pair: str, ticker: dict) -> None:
+        """Updates a symbol from a MarketStream ticker."""
+        if pair.endswith(self.quote):
+            self.update(pair[: -len(self.quote)], ticker["lastPrice"])
+
+    def stats(self) -> str:
+        """Human readable count of alerts."""
+        return f"Price alerts: {len(self)} set on {len(self._books)} symbols."
@@ -0,0 +1,433 @@
+"""Asyncio execution mode for the bot.
+
+Updates are long polled from the Telegram Bot API and every update is handled
+in its own task, so thousands of requests can be in flight on one process
+without a thread each. ByBit is reached through AsyncBybitClient.
+
+    python async_bot.py
+"""
+
+import asyncio
+import datetime
+import io
+import json
+import logging
+import os
+from logging import info, warning
+from typing import Optional, Union
+
+import aiohttp
+
+from bybit_async import AsyncBybitClient
+from chart_cache import ChartCache
+from chart_renderer import ChartRenderer, RenderQueueFull
+import metrics
+from metrics import hit_ratio, stage_seconds, timed
+from scheduler import BUSY_MESSAGE, CHEAP, HEAVY, AsyncScheduler, Busy
+from symbol_router import Router
+from T_info import T_info
+
+TELEGRAM_TOKEN = os.environ["TELEGRAM"]
+TELEGRAM_ENDPOINT = os.environ.get("TELEGRAM_ENDPOINT", "https://api.telegram.org")
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 2000))
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+
+
+class TelegramAPIError(Exception):
+    """Raised when the Bot API answers with ok: false."""
+
+
+class AsyncTelegram:
+    """
+    The few Bot API methods the bot needs, over one pooled aiohttp session.
+    """
+
+    def __init__(self, token: str, endpoint: str = TELEGRAM_ENDPOINT) -> None:
+        self.url = f"{endpoint.rstrip('/')}/bot{token}/"
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=200, keepalive_timeout=60)
+            )
+        return self._session
+
+    async def call(self, method: str, data: Union[dict, aiohttp.FormData]):
+        async with self.session.post(self.url + method, data=data) as resp:
+            body = await resp.json()
+
+        if not body.get("ok"):
+            raise TelegramAPIError(f"{method}: {body.get('description')}")
+
+        return body["result"]
+
+    async def get_updates(self, offset: int, timeout: int = 30) -> list:
+        return await self.call(
+            "getUpdates",
+            {
+                "offset": offset,
+                "timeout": timeout,
+                "allowed_updates": '["message", "inline_query"]',
+            },
+        )
+
+    async def send_message(self, message: dict, text: str, **kwargs) -> dict:
+        return await self.call(
+            "sendMessage",
+            {"chat_id": message["chat"]["id"], "text": text, **kwargs},
+        )
+
+    async def answer_inline_query(self, query: dict, results: list, **kwargs) -> bool:
+        return await self.call(
+            "answerInlineQuery",
+            {"inline_query_id": query["id"], "results": json.dumps(results), **kwargs},
+        )
+
+    async def send_chat_action(self, message: dict, action: str) -> dict:
+        return await self.call(
+            "sendChatAction", {"chat_id": message["chat"]["id"], "action": action}
+        )
+
+    async def send_photo(
+        self, message: dict, photo: Union[str, bytes], caption: str, **kwargs
+    ) -> dict:
+        form = aiohttp.FormData()
+        form.add_field("chat_id", str(message["chat"]["id"]))
+        form.add_field("caption", caption)
+        for key, value in kwargs.items():
+            form.add_field(key, str(value))
+
+        if isinstance(photo, bytes):
+            form.add_field(
+                "photo",
+                io.BytesIO(photo),
+                filename="chart.png",
+                content_type="image/png",
+            )
+        else:
+            form.add_field("photo", photo)
+
+        return await self.call("sendPhoto", form)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+t = T_info()
+tg = AsyncTelegram(TELEGRAM_TOKEN)
+# Built by setup, chart workers import this script as __mp_main__ and must not
+# start a router and pools of their own.
+s = None
+renderer = None
+charts = None
+scheduler = None
+
+REPLY = {"parse_mode": "Markdown", "disable_notification": "true"}
+
+# Handler tasks still running, also keeps them referenced until they finish.
+in_flight = set()
+
+
+def setup():
+    """Builds the router, caches, chart pool and scheduler the handlers use."""
+    global s, renderer, charts, scheduler
+    if s is not None:
+        return
+
+    s = Router(AsyncBybitClient())
+    renderer = ChartRenderer()
+    charts = ChartCache(backend=s.cache)
+    # Charts of delisted coins are never asked for again.
+    s.crypto.refresher.subscribe(
+        lambda added, removed: charts.discard({coin.symbol for coin in removed})
+    )
+    scheduler = AsyncScheduler()
+
+
+@timed("start")
+async def start(message: dict):
+    """Send help text when the command /start is issued."""
+    info(f"Start command ran by {message['chat'].get('username')}")
+    await tg.send_message(message, t.help_text, **REPLY)
+
+
+@timed("help")
+async def help(message: dict):
+    """Send help text when the command /help is issued."""
+    info(f"Help command ran by {message['chat'].get('username')}")
+    await tg.send_message(message, t.help_text, **REPLY)
+
+
+@timed("license")
+async def license(message: dict):
+    """Send bots license when the /license command is issued."""
+    info(f"License command ran by {message['chat'].get('username')}")
+    await tg.send_message(message, t.license, **REPLY)
+
+
+@timed("status")
+async def status(message: dict):
+    """Gather status of bot and dependant services and return important status updates."""
+    warning(f"Status command ran by {message['chat'].get('username')}")
+    sent = datetime.datetime.fromtimestamp(message["date"], datetime.timezone.utc)
+    bot_resp_time = datetime.datetime.now(datetime.timezone.utc) - sent
+
+    bot_status = await s.astatus(
+        f"It took {bot_resp_time.total_seconds()} seconds for the bot to get your message.\n"
+        + f"        {charts.stats()}\n\n"
+        + "        Handler Latency:\n"
+        + f"        {metrics.summary()}"
+    )
+
+    await tg.send_message(message, bot_status, parse_mode="Markdown")
+
+
+@timed("chart")
+async def chart(message: dict):
+    """returns a chart of the past month of data for a symbol"""
+    info(f"Chart command ran by {message['chat'].get('username')}")
+    text = message["text"]
+
+    if text.strip().split("@")[0] == "/c":
+        await tg.send_message(message, t.chart_help)
+        return
+
+    specs, text = s.find_indicators(text)
+    symbols = s.find_symbols(text)
+    frequency = s.find_chart_interval(text)
+
+    if symbols:
+        symbol = symbols[0]
+    else:
+        await tg.send_message(message, "No symbols or coins found.")
+        return
+
+    with stage_seconds.time("data"):
+        candles = await s.achart_reply(symbol, frequency, specs)
+
+    if candles.is_empty:
+        await tg.send_message(
+            message, "Invalid symbol please see `/help` for usage details.", **REPLY
+        )
+        return
+
+    await tg.send_chat_action(message, "upload_photo")
+
+    style = "mike"
+    chart_key = (symbol.symbol, frequency, int(candles.time[-1]), style, *specs)
+
+    if (cached := charts.get(chart_key)) is None:
+        try:
+            with stage_seconds.time("render"):
+                chart_png = await asyncio.wrap_future(
+                    renderer.submit(
+                        candles,
+                        title=" ".join(["\n" + symbol.symbol, *specs]).upper(),
+                        style=style,
+                    )
+                )
+        except RenderQueueFull:
+            await tg.send_message(
+                message,
+                "Lots of charts are being drawn right now, please try again in a moment.",
+            )
+            return
+        cached = charts.put(chart_key, chart_png.png)
+
+    stats = (await s.astat_reply([symbol], indicators=specs, freq=frequency))[0]
+    with stage_seconds.time("upload"):
+        sent = await tg.send_photo(
+            message,
+            cached.file_id or cached.png,
+            caption=f"\n {frequency} chart for {symbol.symbol} from {candles.first.strftime('%d, %b %Y')}"
+            + f" to {candles.last.strftime('%d, %b %Y')}\n\n{stats}",
+            **REPLY,
+        )
+
+    if cached.file_id is None and sent.get("photo"):
+        charts.set_file_id(chart_key, cached, sent["photo"][-1]["file_id"])
+
+
+@timed("price")
+async def price(message: dict):
+    """returns key statistics on symbol"""
+    info(f"Price command ran by {message['chat'].get('username')}")
+    text = message["text"]
+
+    if text.strip().split("@")[0] == "/p":
+        await tg.send_message(message, t.price_help)
+        return
+
+    specs, text = s.find_indicators(text)
+    if symbols := s.find_symbols(text):
+        await tg.send_chat_action(message, "typing")
+        frequency = s.find_chart_interval(text, default="1h") or "1h"
+
+        # Each reply is sent as soon as its symbol is ready.
+        async for reply in s.aiter_stat_replies(
+            symbols, indicators=specs, freq=frequency
+        ):
+            await tg.send_message(message, reply, **REPLY)
+
+
+@timed("alert")
+async def alert(message: dict):
+    """Sets, lists and removes price alerts."""
+    info(f"Alert command ran by {message['chat'].get('username')}")
+    reply = s.alert_reply(message["chat"]["id"], message["text"])
+    await tg.send_message(message, reply or t.alert_help, **REPLY)
+
+
+@timed("watchlist")
+async def watchlist(message: dict):
+    """Quotes the chats watchlist, or adds and removes symbols on it."""
+    info(f"Watchlist command ran by {message['chat'].get('username')}")
+    reply = s.watchlist_reply(message["chat"]["id"], message["text"])
+    await tg.send_message(message, reply or t.watchlist_help, **REPLY)
+
+
+async def notify(fired: list, price: float):
+    """Sends fired price alerts to their chats."""
+    for alert in fired:
+        try:
+            await tg.send_message({"chat": {"id": alert.chat}}, alert.reached(price))
+        except (aiohttp.ClientError, asyncio.TimeoutError, TelegramAPIError) as e:
+            warning(f"Sending alert {alert} to {alert.chat} failed: {e}")
+
+
+@timed("inline")
+async def inline(query: dict):
+    """Suggests symbols for what is typed after the bots username."""
+    results = [
+        {
+            "type": "article",
+            "id": result.id,
+            "title": result.title,
+            "description": result.description,
+            "input_message_content": {
+                "message_text": result.text,
+                "parse_mode": "Markdown",
+            },
+        }
+        for result in s.search.answer(query["query"])
+    ]
+    # Prices in the results come from the ticker snapshot, so keep them short lived.
+    await tg.answer_inline_query(query, results, cache_time=5)
+
+
+HANDLERS = {
+    "start": start,
+    "help": help,
+    "license": license,
+    "p": price,
+    "price": price,
+    "status": status,
+    "alert": alert,
+    "w": watchlist,
+    "watchlist": watchlist,
+    "c": chart,
+    "chart": chart,
+}
+
+
+async def handle(update: dict, slots: asyncio.Semaphore):
+    """Routes one update to its command handler and logs anything it raises."""
+    try:
+        if (query := update.get("inline_query")) is not None:
+            try:
+                await scheduler.run(CHEAP, None, query["from"]["id"], inline, query)
+            except Busy:
+                pass  # No results is all an inline query can be told.
+            return
+
+        message = update.get("message") or {}
+        text = message.get("text", "")
+        if not text.startswith("/"):
+            return
+
+        command = text.split()[0][1:].split("@")[0]
+        if (handler := HANDLERS.get(command)) is not None:
+            priority = HEAVY if handler is chart else CHEAP
+            user = (message.get("from") or {}).get("id")
+            try:
+                await scheduler.run(
+                    priority, message["chat"]["id"], user, handler, message
+                )
+            except Busy:
+                await tg.send_message(message, BUSY_MESSAGE)
+    except Exception:
+        logging.exception(f"Update {update.get('update_id')} caused an error")
+    finally:
+        slots.release()
+
+
+async def run():
+    """Long polls Telegram and handles each update in its own task."""
+    setup()
+    await s.astart()
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, renderer.warm)
+
+    # Alerts fire on the ticker task or the market stream thread.
+    s.alerts.subscribe(
+        lambda fired, price: asyncio.run_coroutine_threadsafe(
+            notify(fired, price), loop
+        )
+    )
+    s.alerts.load()
+
+    slots = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    metrics.registry.gauge(
+        "bot_update_backlog", "Updates being handled.", lambda: len(in_flight)
+    )
+    metrics.registry.gauge(
+        "chart_render_pending",
+        "Charts waiting for or being drawn by a render worker.",
+        lambda: renderer.pending,
+    )
+    metrics.registry.gauge(
+        "chart_cache_hit_ratio", "Chart cache hit ratio.", lambda: hit_ratio(charts)
+    )
+    metrics.registry.gauge(
+        "candle_cache_hit_ratio",
+        "Candle cache hit ratio.",
+        lambda: hit_ratio(s.crypto.candle_cache),
+    )
+    metrics.serve()
+    offset = 0
+    info("Async bot started.")
+
+    try:
+        while True:
+            try:
+                updates = await tg.get_updates(offset)
+            except (aiohttp.ClientError, asyncio.TimeoutError, TelegramAPIError) as e:
+                warning(f"getUpdates failed: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                offset = update["update_id"] + 1
+                # Backpressure once MAX_IN_FLIGHT updates are being handled.
+                await slots.acquire()
+                task = asyncio.create_task(handle(update, slots))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+    finally:
+        await tg.close()
+        await s.crypto.aclient.close()
+
+
+def main():
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""Micro-benchmarks for the bots hot paths. Runs offline.
+
+python benchmarks.py [find_symbols|startup|candles|indicators|alerts|watchlist]
+"""
+
+import datetime
+import json
+import os
+import random
+import re
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from alerts import MAX_ALERTS, RECORD, AlertEngine, AlertStore
+from candles import Candles
+from indicators import IndicatorEngine
+from symbol_registry import SymbolRegistry
+from ticker_snapshot import TickerSnapshot
+from watchlists import MAX_WATCHLIST, Watchlists, render
+
+random.seed(0)
+
+CRYPTO_REGEX = r"([a-zA-Z]{2,20})"  # Router.CRYPTO_REGEX
+
+SYMBOLS = sorted(
+    {"BTC", "ETH", "SOL", "DOGE", "ADA", "XRP", "DOT", "LINK", "MATIC", "AVAX"}
+    | {
+        "".join(random.choices(string.ascii_uppercase, k=random.randint(2, 6)))
+        for _ in range(400)
+    }
+)
+
+MESSAGE = (
+    "/p btc eth sol and what about doge or ada, anyone holding link matic avax "
+    "because honestly this group keeps talking about the same coins every day"
+)
+
+
+def find_symbols_dataframe(symbol_list: pd.DataFrame, text: str) -> list[str]:
+    """Symbol lookup as it was done before the registry: one regex pass over the
+    whole symbol list per token."""
+    found = []
+    for coin in set(re.findall(CRYPTO_REGEX, text)):
+        sym = symbol_list[
+            symbol_list["baseCurrency"].str.fullmatch(coin.upper(), case=False)
+        ]
+        if not sym.empty:
+            found.append(sym.baseCurrency.values[0])
+    return found
+
+
+def find_symbols_registry(registry: SymbolRegistry, text: str) -> list[str]:
+    found = []
+    for coin in set(re.findall(CRYPTO_REGEX, text)):
+        if sym := registry.get(coin):
+            found.append(sym.symbol)
+    return found
+
+
+def bench_find_symbols(number: int = 200) -> None:
+    symbol_list = pd.DataFrame({"baseCurrency": SYMBOLS})
+    registry = SymbolRegistry(SYMBOLS)
+
+    assert sorted(find_symbols_dataframe(symbol_list, MESSAGE)) == sorted(
+        find_symbols_registry(registry, MESSAGE)
+    )
+
+    before = timeit.timeit(
+        lambda: find_symbols_dataframe(symbol_list, MESSAGE), number=number
+    )
+    after = timeit.timeit(
+        lambda: find_symbols_registry(registry, MESSAGE), number=number
+    )
+
+    print(f"find_symbols ({len(SYMBOLS)} symbols, {len(MESSAGE.split())} words)")
+    print(f"\tDataFrame scan: {before / number * 1e6:,.1f} us/message")
+    print(f"\tRegistry:       {after / number * 1e6:,.1f} us/message")
+    print(f"\tSpeedup:        {before / after:,.0f}x")
+
+
+STARTUP_IMPORTS = [
+    "pandas",
+    "requests",
+    "aiohttp",
+    "telegram",
+    "upstream",
+    "symbol_registry",
+    "bybit_Crypto",
+    "symbol_router",
+    "chart_renderer",
+    "T_info",
+    "matplotlib.pyplot",
+    "mplfinance",
+]
+
+
+def import_time(module: str) -> float:
+    """Seconds to import a module, including its dependencies, in a fresh interpreter."""
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return float(out.stdout) if out.returncode == 0 else float("nan")
+
+
+def bench_startup() -> None:
+    """Breaks cold start cost down into imports and the init phases bot.py runs."""
+    print("Startup imports (fresh interpreter each, includes dependencies)")
+    for module in STARTUP_IMPORTS:
+        print(f"\t{module:<20} {import_time(module) * 1000:8.1f} ms")
+
+    from bybit_Crypto import BybitCrypto
+    from chart_renderer import ChartRenderer
+    from symbol_refresher import SymbolRefresher
+    from T_info import T_info
+
+    phases = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "symbols.json")
+        with open(path, "w") as f:
+            json.dump(SYMBOLS, f)
+
+        # Only the state load_symbol_snapshot touches, __init__ would fetch.
+        crypto = BybitCrypto.__new__(BybitCrypto)
+        crypto.refresher = SymbolRefresher("bybit", list)
+        start = time.perf_counter()
+        crypto.load_symbol_snapshot(path)
+        phases["symbol registry from snapshot"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    T_info().license
+    phases["license text"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    renderer = ChartRenderer()
+    phases["chart renderer pool"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    renderer.warm()
+    phases["chart worker warm up (background)"] = time.perf_counter() - start
+    renderer.shutdown()
+
+    print("Startup init phases")
+    for phase, seconds in phases.items():
+        print(f"\t{phase:<36} {seconds * 1000:8.1f} ms")
+
+
+def klines(count: int = 1000, interval_ms: int = 3_600_000) -> list:
+    """Raw kline rows shaped like ByBit's, prices as strings."""
+    rows, price = [], 20_000.0
+    start = 1_664_582_400_000 - count * interval_ms
+    for i in range(count):
+        close = price * (1 + random.uniform(-0.01, 0.01))
+        t = start + i * interval_ms
+        rows.append(
+            [
+                t,
+                f"{price:.2f}",
+                f"{max(price, close) * 1.002:.2f}",
+                f"{min(price, close) * 0.998:.2f}",
+                f"{close:.2f}",
+                f"{random.uniform(10, 500):.4f}",
+                t + interval_ms - 1,
+                "0",
+                0,
+                "0",
+                "0",
+            ]
+        )
+        price = close
+    return rows
+
+
+def kline_frame_pandas(data: list) -> pd.DataFrame:
+    """Kline parsing as it was done before Candles: per row timestamp conversion
+    and whole frame casts."""
+    columns = [
+        "startTime",
+        "open",
+        "high",
+        "low",
+        "close",
+        "volume",
+        "endTime",
+        "quoteAssetVolume",
+        "trades",
+        "takerBaseVolume",
+        "takerQuoteVolume",
+    ]
+    df = pd.DataFrame(data, columns=columns)
+    df["startTime"] = df["startTime"].apply(
+        lambda x: datetime.datetime.utcfromtimestamp(x / 1000)
+    )
+    df = df[["startTime", "open", "high", "low", "close"]]
+    df = df.rename(
+        columns={
+            "startTime": "Date",
+            "open": "Open",
+            "high": "High",
+            "low": "Low",
+            "close": "Close",
+        }
+    )
+    df["Date"] = pd.to_datetime(df["Date"], unit="ms")
+    df = df.set_index("Date")
+    df = df.astype(float)
+    df.sort_index(ascending=False, inplace=True)
+    df = df[:100]
+    df.sort_index(ascending=True, inplace=True)
+    return df
+
+
+def kline_frame_candles(data: list) -> pd.DataFrame:
+    return Candles.from_klines(data, limit=100).frame()
+
+
+def allocations(fn, *args) -> tuple[int, int]:
+    """Peak traced bytes during a call and memory blocks its result keeps alive."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    del result
+    return peak, blocks
+
+
+def bench_candles(number: int = 200) -> None:
+    data = klines()
+
+    old, new = kline_frame_pandas(data), kline_frame_candles(data)
+    pd.testing.assert_frame_equal(
+        old, new, check_freq=False, check_names=False, check_index_type=False
+    )
+
+    print(f"Kline parsing ({len(data)} rows, newest 100 kept)")
+    for name, fn in (
+        ("DataFrame munging", kline_frame_pandas),
+        ("Candles", kline_frame_candles),
+    ):
+        seconds = timeit.timeit(lambda: fn(data), number=number) / number
+        peak, blocks = allocations(fn, data)
+        print(
+            f"\t{name:<18} {seconds * 1e6:10,.1f} us  "
+            f"peak {peak / 1024:8,.1f} KB  {blocks:6,} blocks retained"
+        )
+
+
+INDICATORS = ("sma20", "ema20", "rsi14", "bb20", "vwap")
+
+
+def indicators_pandas(candles: Candles) -> dict:
+    """Every indicator recomputed over a fresh DataFrame, as a render would without
+    kept state."""
+    df = candles.frame(volume=True)
+    close = df["Close"]
+    change = close.diff()
+    gain = change.clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean()
+    loss = (-change).clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean()
+    typical = (df["High"] + df["Low"] + df["Close"]) / 3
+    day = df.index.floor("D")
+    mean, std = close.rolling(20).mean(), close.rolling(20).std(ddof=0)
+    out = {
+        "sma20": mean,
+        "ema20": close.ewm(span=20, adjust=False).mean(),
+        "rsi14": 100 - 100 / (1 + gain / loss),
+        "bb20.upper": mean + 2 * std,
+        "bb20.lower": mean - 2 * std,
+        "vwap": (typical * df["Volume"]).groupby(day).cumsum()
+        / df["Volume"].groupby(day).cumsum(),
+    }
+    return {label: line.to_numpy()[-100:] for label, line in out.items()}
+
+
+def bench_indicators(number: int = 200) -> None:
+    data = klines()
+    candles = Candles.from_klines(data)
+    engine = IndicatorEngine()
+    engine.compute("BTCUSDT", "1h", candles, INDICATORS, 100)
+
+    # A new candle closes, the engine folds in one candle per indicator.
+    data.append(klines(2)[-1])
+    data[-1][0] = data[-2][0] + 3_600_000
+    moved = Candles.from_klines(data[1:])
+
+    expected = indicators_pandas(moved)
+    got = engine.compute("BTCUSDT", "1h", moved, INDICATORS, 100)
+    for label, line in expected.items():
+        np.testing.assert_allclose(got[label], line, rtol=1e-9, err_msg=label)
+
+    def warm():
+        engine.compute("BTCUSDT", "1h", moved, INDICATORS, 100)
+
+    def cold():
+        IndicatorEngine().compute("BTCUSDT", "1h", moved, INDICATORS, 100)
+
+    print(f"Indicators {', '.join(INDICATORS)} over {len(moved)} candles")
+    for name, fn in (
+        ("pandas recompute", lambda: indicators_pandas(moved)),
+        ("engine, warm", warm),
+        ("engine, cold", cold),
+    ):
+        seconds = timeit.timeit(fn, number=number) / number
+        print(f"\t{name:<18} {seconds * 1e6:10,.1f} us")
+
+
+def alert_records(count: int, prices: np.ndarray, rng) -> np.ndarray:
+    """count alerts spread over SYMBOLS, thresholds up to half the price away."""
+    records = np.zeros(count, dtype=RECORD)
+    records["chat"] = np.arange(count) // MAX_ALERTS
+    records["number"] = np.arange(count) % MAX_ALERTS + 1
+    symbols = rng.integers(len(SYMBOLS), size=count)
+    records["symbol"] = np.array(SYMBOLS, dtype="S")[symbols]
+    records["above"] = rng.random(count) < 0.5
+    distance = rng.uniform(0, 0.5, count)
+    records["price"] = prices[symbols] * np.where(
+        records["above"], 1 + distance, 1 - distance
+    )
+    records["live"] = True
+    return records
+
+
+def bench_alerts(count: int = 1_000_000, ticks: int = 20_000, checked: int = 200):
+    rng = np.random.default_rng(0)
+    prices = rng.uniform(0.01, 50_000, len(SYMBOLS))
+    records = alert_records(count, prices, rng)
+
+    # Random walk of one symbol per tick, a few percent a day like the majors.
+    tick_symbols = rng.integers(len(SYMBOLS), size=ticks)
+    moves = np.exp(rng.normal(0, 0.01, ticks))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "alerts.bin")
+        records.tofile(path)
+        engine = AlertEngine(AlertStore(path))
+        start = time.perf_counter()
+        engine.load()
+        loaded = time.perf_counter() - start
+
+        # Scanning every rule, checked against the engine on the first ticks.
+        symbols = np.array(SYMBOLS, dtype="S")
+        live = np.ones(count, dtype=bool)
+        scan = 0.0
+
+        fired = 0
+        spent = []
+        for i, (k, move) in enumerate(zip(tick_symbols.tolist(), moves.tolist())):
+            prices[k] *= move
+            symbol, price = SYMBOLS[k], float(prices[k])
+
+            start = time.perf_counter()
+            got = engine.update(symbol, price)
+            spent.append(time.perf_counter() - start)
+            fired += len(got)
+
+            if i < checked:
+                start = time.perf_counter()
+                crossed = np.where(
+                    records["above"],
+                    records["price"] <= price,
+                    records["price"] >= price,
+                )
+                mine = records["symbol"] == symbols[k]
+                hits = np.flatnonzero(live & mine & crossed)
+                scan += time.perf_counter() - start
+                live[hits] = False
+                chats, numbers = records["chat"][hits], records["number"][hits]
+                expected = set(zip(chats.tolist(), numbers.tolist()))
+                assert {(alert.chat, alert.number) for alert in got} == expected, i
+
+        snapshot = TickerSnapshot(None, "USDT")
+        snapshot.load(
+            [
+                {
+                    "symbol": symbol + "USDT",
+                    **dict.fromkeys(TickerSnapshot.COLUMNS, price),
+                }
+                for symbol, price in zip(SYMBOLS, prices.tolist())
+            ]
+        )
+        check = timeit.timeit(lambda: engine.check(snapshot), number=20) / 20
+
+    spent = np.array(spent) * 1e6
+    print(f"Alerts: {count:,} over {len(SYMBOLS)} symbols, {ticks:,} ticks")
+    print(f"\tload from store     {loaded:10,.2f} s")
+    print(f"\tfired               {fired:10,}")
+    print(f"\tper tick, median    {np.median(spent):10,.2f} us")
+    print(f"\tper tick, mean      {spent.mean():10,.2f} us")
+    print(f"\tper tick, p99       {np.percentile(spent, 99):10,.2f} us")
+    print(f"\tper tick, scan all  {scan / checked * 1e6:10,.2f} us")
+    print(f"\tsnapshot check      {check * 1e6:10,.2f} us")
+
+
+def bench_watchlist(chats: int = 10_000, number: int = 2_000) -> None:
+    rng = np.random.default_rng(0)
+    tickers = [
+        {
+            "symbol": symbol + "USDT",
+            **dict.fromkeys(TickerSnapshot.COLUMNS, price),
+            "openPrice": price * 0.98,
+        }
+        for symbol, price in zip(SYMBOLS, rng.uniform(0.01, 50_000, len(SYMBOLS)))
+    ]
+    fetches = []
+    snapshot = TickerSnapshot(lambda: fetches.append(1) or tickers, "USDT")
+    snapshot.refresh()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "watchlists.bin")
+        lists = Watchlists(path)
+        for chat in range(chats):
+            picks = rng.choice(len(SYMBOLS), MAX_WATCHLIST, replace=False)
+            lists.add(chat, [SYMBOLS[i] for i in picks.tolist()])
+
+        start = time.perf_counter()
+        Watchlists(path)
+        loaded = time.perf_counter() - start
+        stored = os.path.getsize(path)
+
+    def quote():
+        symbols = lists.get(0)
+        return render(symbols, snapshot.rows(symbols))
+
+    seconds = timeit.timeit(quote, number=number) / number
+    print(f"Watchlists: {chats:,} chats of {MAX_WATCHLIST} symbols")
+    per_symbol = stored / chats / MAX_WATCHLIST
+    print(f"\tstored              {per_symbol:10,.1f} bytes a symbol")
+    print(f"\tload                {loaded:10,.2f} s")
+    print(f"\tquote one list      {seconds * 1e6:10,.1f} us")
+    print(f"\tupstream requests   {len(fetches):10,}")
+
+
+BENCHMARKS = {
+    "find_symbols": bench_find_symbols,
+    "startup": bench_startup,
+    "candles": bench_candles,
+    "indicators": bench_indicators,
+    "alerts": bench_alerts,
+    "watchlist": bench_watchlist,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
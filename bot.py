@@ -1,5 +1,6 @@
 # Works with Python 3.8
 import datetime
+import functools
 import html
 import io
 import json
@@ -7,27 +8,44 @@ import logging
 import os
 import random
 import string
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from logging import error, info, warning
+from typing import Callable, Optional
 
-import mplfinance as mpf
 import telegram
 from telegram import (
+    InlineQueryResultArticle,
+    InputTextMessageContent,
     Update,
 )
 from telegram.ext import (
     CallbackContext,
     CommandHandler,
+    Dispatcher,
+    InlineQueryHandler,
     Updater,
 )
 
+from chart_cache import ChartCache
+from chart_renderer import ChartRenderer, RenderQueueFull
+import metrics
+from metrics import hit_ratio, stage_seconds, timed
+from scheduler import BUSY_MESSAGE, CHEAP, HEAVY, Busy, Scheduler
 from symbol_router import Router
 from T_info import T_info
 
 TELEGRAM_TOKEN = os.environ["TELEGRAM"]
 
-s = Router()
 t = T_info()
+# Built by setup, chart workers import this script as __mp_main__ and must not
+# start a router, pollers and pools of their own.
+s = None
+renderer = None
+charts = None
+scheduler = None
+notifier = None
 
 # Enable logging
 logging.basicConfig(
@@ -38,6 +56,56 @@ logger = logging.getLogger(__name__)
 info("Bot script started.")
 
 
+def setup():
+    """Builds the router, caches, chart pool and schedulers the handlers use."""
+    global s, renderer, charts, scheduler, notifier
+    if s is not None:
+        return
+
+    s = Router()
+    renderer = ChartRenderer()
+    charts = ChartCache(backend=s.cache)
+    # Charts of delisted coins are never asked for again.
+    s.crypto.refresher.subscribe(
+        lambda added, removed: charts.discard({coin.symbol for coin in removed})
+    )
+    scheduler = Scheduler()
+    # Fired alerts are sent one at a time, away from the ticker refresh thread.
+    notifier = ThreadPoolExecutor(1, thread_name_prefix="alerts")
+
+
+def scheduled(priority: str):
+    """Runs a handler on the schedulers workers for its priority class, replying
+    that the bot is busy when admission control refuses it."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(update: Update, context: CallbackContext):
+            chat = update.effective_chat.id if update.effective_chat else None
+            user = update.effective_user.id if update.effective_user else None
+            try:
+                job = scheduler.submit(priority, chat, user, fn, update, context)
+            except Busy:
+                # Inline queries have no message to answer, they just get no results.
+                if update.effective_message is not None:
+                    update.effective_message.reply_text(
+                        BUSY_MESSAGE, disable_notification=True
+                    )
+                return
+
+            def done(job):
+                if (e := job.exception()) is not None:
+                    context.dispatcher.dispatch_error(update, e)
+
+            job.add_done_callback(done)
+
+        return wrapper
+
+    return decorator
+
+
+@scheduled(CHEAP)
+@timed("start")
 def start(update: Update, context: CallbackContext):
     """Send help text when the command /start is issued."""
     info(f"Start command ran by {update.message.chat.username}")
@@ -48,6 +116,8 @@ def start(update: Update, context: CallbackContext):
     )
 
 
+@scheduled(CHEAP)
+@timed("help")
 def help(update: Update, context: CallbackContext):
     """Send help text when the command /help is issued."""
     info(f"Help command ran by {update.message.chat.username}")
@@ -58,6 +128,8 @@ def help(update: Update, context: CallbackContext):
     )
 
 
+@scheduled(CHEAP)
+@timed("license")
 def license(update: Update, context: CallbackContext):
     """Send bots license when the /license command is issued."""
     info(f"License command ran by {update.message.chat.username}")
@@ -68,6 +140,8 @@ def license(update: Update, context: CallbackContext):
     )
 
 
+@scheduled(CHEAP)
+@timed("status")
 def status(update: Update, context: CallbackContext):
     """Gather status of bot and dependant services and return important status updates."""
     warning(f"Status command ran by {update.message.chat.username}")
@@ -76,7 +150,10 @@ def status(update: Update, context: CallbackContext):
     )
 
     bot_status = s.status(
-        f"It took {bot_resp_time.total_seconds()} seconds for the bot to get your message."
+        f"It took {bot_resp_time.total_seconds()} seconds for the bot to get your message.\n"
+        + f"        {charts.stats()}\n\n"
+        + "        Handler Latency:\n"
+        + f"        {metrics.summary()}"
     )
 
     update.message.reply_text(
@@ -85,6 +162,8 @@ def status(update: Update, context: CallbackContext):
     )
 
 
+@scheduled(HEAVY)
+@timed("chart")
 def chart(update: Update, context: CallbackContext):
     """returns a chart of the past month of data for a symbol"""
     info(f"Chart command ran by {update.message.chat.username}")
@@ -93,14 +172,10 @@ def chart(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
 
     if message.strip().split("@")[0] == "/c":
-        update.message.reply_text(
-            "This command returns a chart of the stocks movement for the past month.\nExample: /c btc\n\n" +
-            "Intervals:\n1 minute- 1m\n3 minute- 3m\n5 minute- 5m\n15 minute- 15m\n30 minute- 30m\n" +
-            "1 hour- 1h\n2 hour- 2h\n4 hour- 4h\n6 hour- 6h\n12 hour- 12h\n" +
-            "1 day- 1d\n1 week- 1w\n1 month- 1M"
-        )
+        update.message.reply_text(t.chart_help)
         return
 
+    specs, message = s.find_indicators(message)
     symbols = s.find_symbols(message)
     frequency = s.find_chart_interval(message)
 
@@ -110,9 +185,10 @@ def chart(update: Update, context: CallbackContext):
         update.message.reply_text("No symbols or coins found.")
         return
 
-    df = s.chart_reply(symbol, frequency)
+    with stage_seconds.time("data"):
+        candles = s.chart_reply(symbol, frequency, specs)
 
-    if df.empty:
+    if candles.is_empty:
         update.message.reply_text(
             text="Invalid symbol please see `/help` for usage details.",
             parse_mode=telegram.ParseMode.MARKDOWN,
@@ -124,26 +200,42 @@ def chart(update: Update, context: CallbackContext):
         chat_id=chat_id, action=telegram.ChatAction.UPLOAD_PHOTO
     )
 
-    buf = io.BytesIO()
-    mpf.plot(
-        df,
-        type="candle",
-        title=f"\n{symbol.symbol}",
-        volume="volume" in df.keys(),
-        style="mike",
-        savefig=dict(fname=buf, dpi=400, bbox_inches="tight"),
-    )
-    buf.seek(0)
+    style = "mike"
+    chart_key = (symbol.symbol, frequency, int(candles.time[-1]), style, *specs)
+
+    if (cached := charts.get(chart_key)) is None:
+        try:
+            with stage_seconds.time("render"):
+                chart_png = renderer.render(
+                    candles,
+                    title=" ".join(["\n" + symbol.symbol, *specs]).upper(),
+                    style=style,
+                )
+        except RenderQueueFull:
+            update.message.reply_text(
+                text="Lots of charts are being drawn right now, please try again in a moment.",
+                disable_notification=True,
+            )
+            return
+        cached = charts.put(chart_key, chart_png.png)
+
+    stats = s.stat_reply([symbol], indicators=specs, freq=frequency)[0]
+    with stage_seconds.time("upload"):
+        sent = update.message.reply_photo(
+            photo=cached.file_id or io.BytesIO(cached.png),
+            caption=f"\n {frequency} chart for {symbol.symbol} from {candles.first.strftime('%d, %b %Y')}"
+            + f" to {candles.last.strftime('%d, %b %Y')}\n\n{stats}",
+            parse_mode=telegram.ParseMode.MARKDOWN,
+            disable_notification=True,
+        )
 
-    update.message.reply_photo(
-        photo=buf,
-        caption=f"\n {frequency} chart for {symbol.symbol} from {df.first_valid_index().strftime('%d, %b %Y')}"
-        + f" to {df.last_valid_index().strftime('%d, %b %Y')}\n\n{s.stat_reply([symbol])[0]}",
-        parse_mode=telegram.ParseMode.MARKDOWN,
-        disable_notification=True,
-    )
+    # Telegram keeps the upload, later replies only need to reference it.
+    if cached.file_id is None and sent.photo:
+        charts.set_file_id(chart_key, cached, sent.photo[-1].file_id)
 
 
+@scheduled(CHEAP)
+@timed("price")
 def price(update: Update, context: CallbackContext):
     """returns key statistics on symbol"""
     info(f"Price command ran by {update.message.chat.username}")
@@ -151,17 +243,18 @@ def price(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
 
     if message.strip().split("@")[0] == "/p":
-        update.message.reply_text(
-            "This command returns key statistics for a symbol.\nExample: /p btc"
-        )
+        update.message.reply_text(t.price_help)
         return
 
+    specs, message = s.find_indicators(message)
     symbols = s.find_symbols(message)
 
     if symbols:
         context.bot.send_chat_action(chat_id=chat_id, action=telegram.ChatAction.TYPING)
+        frequency = s.find_chart_interval(message, default="1h") or "1h"
 
-        for reply in s.stat_reply(symbols):
+        # Each reply is sent as soon as its symbol is ready.
+        for reply in s.iter_stat_replies(symbols, indicators=specs, freq=frequency):
             update.message.reply_text(
                 text=reply,
                 parse_mode=telegram.ParseMode.MARKDOWN,
@@ -169,6 +262,51 @@ def price(update: Update, context: CallbackContext):
             )
 
 
+@scheduled(CHEAP)
+@timed("inline")
+def inline(update: Update, context: CallbackContext):
+    """Suggests symbols for what is typed after the bots username."""
+    results = [
+        InlineQueryResultArticle(
+            id=result.id,
+            title=result.title,
+            description=result.description,
+            input_message_content=InputTextMessageContent(
+                result.text, parse_mode=telegram.ParseMode.MARKDOWN
+            ),
+        )
+        for result in s.search.answer(update.inline_query.query)
+    ]
+    # Prices in the results come from the ticker snapshot, so keep them short lived.
+    update.inline_query.answer(results, cache_time=5)
+
+
+@scheduled(CHEAP)
+@timed("alert")
+def alert(update: Update, context: CallbackContext):
+    """Sets, lists and removes price alerts."""
+    info(f"Alert command ran by {update.message.chat.username}")
+    reply = s.alert_reply(update.message.chat_id, update.message.text)
+    update.message.reply_text(
+        text=reply or t.alert_help,
+        parse_mode=telegram.ParseMode.MARKDOWN,
+        disable_notification=True,
+    )
+
+
+@scheduled(CHEAP)
+@timed("watchlist")
+def watchlist(update: Update, context: CallbackContext):
+    """Quotes the chats watchlist, or adds and removes symbols on it."""
+    info(f"Watchlist command ran by {update.message.chat.username}")
+    reply = s.watchlist_reply(update.message.chat_id, update.message.text)
+    update.message.reply_text(
+        text=reply or t.watchlist_help,
+        parse_mode=telegram.ParseMode.MARKDOWN,
+        disable_notification=True,
+    )
+
+
 def error(update: Update, context: CallbackContext):
     """Log Errors caused by Updates."""
     warning('Update "%s" caused error "%s"', update, error)
@@ -195,14 +333,8 @@ def error(update: Update, context: CallbackContext):
         warning(tb_string)
 
 
-def main():
-    """Start the context.bot."""
-    # Create the EventHandler and pass it your bot's token.
-    updater = Updater(TELEGRAM_TOKEN)
-
-    # Get the dispatcher to register handlers
-    dp = updater.dispatcher
-
+def register_handlers(dp: Dispatcher):
+    """Adds the bots command and error handlers to a dispatcher."""
     # on different commands - answer in Telegram
     dp.add_handler(CommandHandler("start", start))
     dp.add_handler(CommandHandler("help", help))
@@ -210,14 +342,81 @@ def main():
     dp.add_handler(CommandHandler("p", price))
     dp.add_handler(CommandHandler("price", price))
     dp.add_handler(CommandHandler("status", status))
+    dp.add_handler(CommandHandler("alert", alert))
+    dp.add_handler(CommandHandler("w", watchlist))
+    dp.add_handler(CommandHandler("watchlist", watchlist))
+    dp.add_handler(InlineQueryHandler(inline))
 
-    # Charting can be slow so they run async.
-    dp.add_handler(CommandHandler("c", chart, run_async=True))
-    dp.add_handler(CommandHandler("chart", chart, run_async=True))
+    # Charting is slow so it runs on the heavy scheduler workers, see scheduled.
+    dp.add_handler(CommandHandler("c", chart))
+    dp.add_handler(CommandHandler("chart", chart))
 
     # log all errors
     dp.add_error_handler(error)
 
+
+def register_metrics(backlog: Callable[[], int]):
+    """Exposes this processes queue, render and cache gauges."""
+    metrics.registry.gauge(
+        "bot_update_backlog", "Updates waiting for the dispatcher.", backlog
+    )
+    metrics.registry.gauge(
+        "chart_render_pending",
+        "Charts waiting for or being drawn by a render worker.",
+        lambda: renderer.pending,
+    )
+    metrics.registry.gauge(
+        "chart_cache_hit_ratio", "Chart cache hit ratio.", lambda: hit_ratio(charts)
+    )
+    metrics.registry.gauge(
+        "candle_cache_hit_ratio",
+        "Candle cache hit ratio.",
+        lambda: hit_ratio(s.crypto.candle_cache),
+    )
+
+
+def start_alerts(bot: telegram.Bot, owned: Optional[Callable[[int], bool]] = None):
+    """Loads the price alerts this process checks and sends them as they fire.
+
+    Parameters
+    ----------
+    bot : telegram.Bot
+        Sends the fired alerts.
+
+    owned : Callable[[int], bool], optional
+        Chat ids whose alerts this process checks, all of them when None.
+    """
+
+    def send(fired: list, price: float):
+        for alert in fired:
+            try:
+                bot.send_message(chat_id=alert.chat, text=alert.reached(price))
+            except telegram.error.TelegramError as e:
+                warning(f"Sending alert {alert} to {alert.chat} failed: {e}")
+
+    s.alerts.subscribe(lambda fired, price: notifier.submit(send, fired, price))
+    s.alerts.load(owned)
+
+
+def main():
+    """Start the context.bot."""
+    setup()
+
+    # Create the EventHandler and pass it your bot's token.
+    updater = Updater(TELEGRAM_TOKEN)
+
+    # Get the dispatcher to register handlers
+    register_handlers(updater.dispatcher)
+
+    register_metrics(updater.update_queue.qsize)
+    metrics.serve()
+
+    start_alerts(updater.bot)
+
+    # Start chart workers in the background so the first /c does not pay for the
+    # matplotlib imports and polling does not wait for them either.
+    threading.Thread(target=renderer.warm, daemon=True).start()
+
     # Start the Bot
     updater.start_polling()
 
@@ -1,25 +1,44 @@
 """Class with functions for running the bot with ByBit API.
 """
 
+import json
 import logging
+import time
 from datetime import datetime
 from logging import critical, debug, error, info, warning
 from typing import List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
-import requests as r
-import schedule
 import os
-from pybit import spot
-import datetime as dt
 
+from bybit_http import BybitHTTP
+from cache_backend import CacheBackend, default_backend
+from candle_cache import INTERVAL_MS, CandleCache
+from candle_store import CandleStore
+from candles import RESAMPLE_FROM, Candles
+from indicators import IndicatorEngine, title
+from market_stream import MarketStream
 from Symbol import Coin
+from symbol_refresher import SymbolRefresher
+from symbol_registry import SymbolRegistry
+from ticker_snapshot import TickerSnapshot
+from upstream import upstream
 
 logging.basicConfig(filename="pybit.log", level=logging.DEBUG,
                     format="%(asctime)s %(levelname)s %(message)s")
 
-BYBIT_KEY = os.environ["BYBIT_KEY"]
-BYBIT_SECRET = os.environ["BYBIT_SECRET"]
+BYBIT_STREAM = os.environ.get("BYBIT_STREAM", "0") == "1"
+SYMBOL_SNAPSHOT = os.environ.get(
+    "SYMBOL_SNAPSHOT", os.path.join(os.environ.get("DATA_DIR", "data"), "bybit_symbols.json")
+)
+
+# Seconds responses are shared between replicas through the cache backend.
+SYMBOLS_TTL = 60 * 60
+TICKERS_TTL = 5
+KLINES_TTL = 5
+
+CHART_CANDLES = 100
 
 
 class BybitCrypto:
@@ -29,37 +48,92 @@ class BybitCrypto:
 
     vs_currency = "USDT"
 
-    session = spot.HTTP(
-        endpoint='https://api.bybit.com',
-        api_key=BYBIT_KEY,
-        api_secret=BYBIT_SECRET
-    )
+    session = BybitHTTP(upstream)
     # simple/supported_vs_currencies for list of options
 
     searched_symbols = {}
     trending_cache = None
 
-    def __init__(self) -> None:
+    def __init__(self, aclient=None, cache: Optional[CacheBackend] = None) -> None:
         """Creates a Symbol Object
 
         Parameters
         ----------
-        IEX_TOKEN : str
-            IEX Token
+        aclient : AsyncBybitClient, optional
+            Used instead of the blocking session by the async methods. When given
+            nothing is fetched until astart is awaited.
+
+        cache : CacheBackend, optional
+            Where symbol lists, tickers and klines are shared, defaults to the backend
+            picked by CACHE_BACKEND.
         """
+        self.aclient = aclient
+        self.cache = cache if cache is not None else default_backend()
+        self.candle_cache = CandleCache(store=CandleStore())
+        self.indicator_engine = IndicatorEngine(maxlen=self.candle_cache.maxlen)
+        self.tickers = TickerSnapshot(
+            lambda: self.cache.get_or_fetch(
+                'bybit:tickers', TICKERS_TTL, lambda: self.session.latest_information_for_symbol()['result']
+            ),
+            self.vs_currency,
+            interval=TICKERS_TTL,
+        )
+
+        # Optional live state for the most requested pairs, read before any REST data.
+        self.stream = MarketStream(self.backfill_klines) if BYBIT_STREAM else None
+        if self.stream is not None:
+            self.stream.start()
+
+        # Rebuilds the registry off the request path, daily maintenance runs with it.
+        self.refresher = SymbolRefresher(
+            'bybit', self._refresh_symbols, jobs=[self.candle_cache.store.compact_all, self.cache.purge]
+        )
+        self.refresher.subscribe(self._symbols_changed)
+
+        if aclient is None:
+            # Start from the last saved symbol list and refresh it in the background.
+            if self.load_symbol_snapshot():
+                self.refresher.start(immediate=True)
+            else:
+                self.refresher.refresh()
+                self.refresher.start()
+            self.tickers.start()
+
+    def _refresh_symbols(self) -> SymbolRegistry:
         self.get_symbol_list()
-        schedule.every().day.do(self.get_symbol_list)
+        return self.registry
+
+    async def _arefresh_symbols(self) -> SymbolRegistry:
+        await self.aget_symbol_list()
+        return self.registry
+
+    def _symbols_changed(self, added: frozenset, removed: frozenset) -> None:
+        """Drops cached candles of delisted coins, new coins have nothing cached yet."""
+        for coin in removed:
+            self.candle_cache.discard(coin.pair)
+
+    async def astart(self) -> None:
+        """Loads the symbol list and starts the ticker snapshot through the async client."""
+        snapshot = self.load_symbol_snapshot()
+        if not snapshot:
+            await self.refresher.arefresh(self._arefresh_symbols)
+
+        async def fetch_tickers() -> list:
+            async def fetch() -> list:
+                return (await self.aclient.latest_information_for_symbol())['result']
+
+            return await self.cache.aget_or_fetch('bybit:tickers', TICKERS_TTL, fetch)
+
+        self._ticker_task = self.tickers.start_async(fetch_tickers)
+        self._symbol_task = self.refresher.start_async(self._arefresh_symbols, immediate=snapshot)
 
     def symbol_id(self, symbol) -> str:
         """
 
         """
-        try:
-            return self.symbol_list[self.symbol_list["baseCurrency"] == symbol]["baseCurrency"].values[
-                0
-            ]
-        except KeyError:
-            return ""
+        if coin := self.registry.get(symbol):
+            return coin.symbol
+        return ""
 
     def get_symbol_list(
         self, return_df=False
@@ -68,18 +142,60 @@ class BybitCrypto:
 
         """
 
-        resp = self.session.query_symbol()
+        result = self.cache.get_or_fetch('bybit:symbols', SYMBOLS_TTL, lambda: self.session.query_symbol()['result'])
 
-        df = pd.DataFrame(resp['result'])
+        return self._load_symbol_list(result, return_df)
 
-        df = df[df['quoteCurrency'] == self.vs_currency]
+    async def aget_symbol_list(
+        self, return_df=False
+    ) -> Optional[Tuple[pd.DataFrame, datetime]]:
+        """Async version of get_symbol_list."""
+        async def fetch() -> list:
+            return (await self.aclient.query_symbol())['result']
 
-        df = df[['baseCurrency']]
+        result = await self.cache.aget_or_fetch('bybit:symbols', SYMBOLS_TTL, fetch)
 
-        self.symbol_list = df
+        return self._load_symbol_list(result, return_df)
+
+    def _load_symbol_list(
+        self, result: list, return_df=False
+    ) -> Optional[Tuple[pd.DataFrame, datetime]]:
+        symbols = [row['baseCurrency'] for row in result if row['quoteCurrency'] == self.vs_currency]
+
+        self.registry = SymbolRegistry(symbols, self.vs_currency)
+        self._save_symbol_snapshot(symbols)
 
         if return_df:
-            return df, datetime.now()
+            return pd.DataFrame({'baseCurrency': symbols}), datetime.now()
+
+    def load_symbol_snapshot(self, path: str = SYMBOL_SNAPSHOT) -> bool:
+        """Loads the symbol list saved by the last refresh so startup does not wait on ByBit.
+
+        Returns
+        -------
+        bool
+            False if there is no usable snapshot.
+        """
+        try:
+            with open(path) as f:
+                symbols = json.load(f)
+        except (OSError, ValueError) as e:
+            info(f"No symbol snapshot loaded from {path}: {e}")
+            return False
+
+        self.registry = SymbolRegistry(symbols, self.vs_currency)
+        self.refresher.reset(self.registry)
+        return True
+
+    @staticmethod
+    def _save_symbol_snapshot(symbols: list, path: str = SYMBOL_SNAPSHOT) -> None:
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump(symbols, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            warning(f"Could not save symbol snapshot to {path}: {e}")
 
     def status(self) -> str:
         """Checks CoinGecko /ping endpoint for API issues.
@@ -89,9 +205,7 @@ class BybitCrypto:
         str
             Human readable text on status of CoinGecko API
         """
-        url = "https://api.bybit.com/spot/v1/time"
-
-        status = r.get(url, timeout=5)
+        status = upstream.get("bybit", "/spot/v1/time", timeout=5, retries=0)
 
         try:
             status.raise_for_status()
@@ -99,6 +213,15 @@ class BybitCrypto:
         except:
             return f"ByBit API returned an error code {status.status_code} in {status.elapsed.total_seconds()} Seconds."
 
+    async def astatus(self) -> str:
+        """Async version of status."""
+        start = time.perf_counter()
+        try:
+            await self.aclient.server_time()
+            return f"ByBit API responded that it was OK in {time.perf_counter() - start:.3f} Seconds."
+        except Exception as e:
+            return f"ByBit API returned an error {e} in {time.perf_counter() - start:.3f} Seconds."
+
     def get_one_hour_change(self, symbol: Coin, current_price: float) -> float:
         """Returns 1hr change price for specific token.
 
@@ -115,17 +238,101 @@ class BybitCrypto:
         float
             Returns a float with 1hr change data for requested symbol.
         """
-        df = self.chart_reply(symbol=symbol, frequency='1h')
+        klines = self.get_klines(symbol.pair, '1h')
+
+        return self._one_hour_change(klines, current_price)
 
-        df.sort_index(ascending=False, inplace=True)
+    async def aget_one_hour_change(self, symbol: Coin, current_price: float) -> float:
+        """Async version of get_one_hour_change."""
+        klines = await self.aget_klines(symbol.pair, '1h')
 
-        past_hr_close = float(df['Close'][1])
+        return self._one_hour_change(klines, current_price)
+
+    @staticmethod
+    def _one_hour_change(klines: list, current_price: float) -> float:
+        past_hr_close = float(klines[-2][4])
 
         return (float(current_price) / past_hr_close - 1) * 100
 
-    def chart_reply(self, symbol: Coin, frequency: str) -> pd.DataFrame:
-        """Returns price data for a symbol of the past month up until the previous trading days close.
-        Also caches multiple requests made in the same day.
+    def get_klines(self, pair: str, frequency: str) -> list:
+        """Returns raw klines for a pair oldest first, served from the candle cache when possible.
+
+        Parameters
+        ----------
+        pair : str
+            API pair name. ie BTCUSDT
+
+        frequency : str
+            Frequency of candles.
+
+        Returns
+        -------
+        list
+            Raw kline rows.
+        """
+
+        return self._with_live_candle(pair, frequency, self._cached_klines(pair, frequency))
+
+    def _cached_klines(self, pair: str, frequency: str) -> list:
+        def fetch(**params) -> list:
+            def query() -> list:
+                data = self.session.query_kline(symbol=pair, interval=frequency, **params)['result']
+                return sorted(data or [], key=lambda row: row[0])
+
+            return self.cache.get_or_fetch(self._kline_key(pair, frequency, params), KLINES_TTL, query)
+
+        return self.candle_cache.get(pair, frequency, fetch)
+
+    @staticmethod
+    def _kline_key(pair: str, frequency: str, params: dict) -> str:
+        return f"bybit:kline:{pair}:{frequency}:{params.get('startTime', 0)}"
+
+    def backfill_klines(self, pair: str, frequency: str) -> list:
+        """Fetches every candle since the last cached one, used after stream reconnects."""
+        self.candle_cache.expire(pair, frequency)
+        return self._cached_klines(pair, frequency)
+
+    def _with_live_candle(self, pair: str, frequency: str, klines: list) -> list:
+        """Replaces or extends the newest cached candle with the streamed one."""
+        if self.stream is None:
+            return klines
+
+        self.stream.record(pair, frequency)
+        if klines and (live := self.stream.candle(pair, frequency)):
+            last_start = klines[-1][0]
+            if live[0] == last_start:
+                klines[-1] = live
+            elif 0 < live[0] - last_start <= INTERVAL_MS[frequency]:
+                klines.append(live)
+
+        return klines
+
+    def _live_ticker(self, symbol: Coin) -> Optional[dict]:
+        if self.stream is None:
+            return None
+
+        pair = symbol.pair
+        self.stream.record(pair)
+        return self.stream.ticker(pair)
+
+    async def aget_klines(self, pair: str, frequency: str) -> list:
+        """Async version of get_klines."""
+
+        async def fetch(**params) -> list:
+            async def query() -> list:
+                data = (await self.aclient.query_kline(symbol=pair, interval=frequency, **params))['result']
+                return sorted(data or [], key=lambda row: row[0])
+
+            return await self.cache.aget_or_fetch(self._kline_key(pair, frequency, params), KLINES_TTL, query)
+
+        return self._with_live_candle(
+            pair, frequency, await self.candle_cache.aget(pair, frequency, fetch)
+        )
+
+    def chart_reply(self, symbol: Coin, frequency: str, indicators: Tuple[str, ...] = ()) -> Candles:
+        """Returns the last 100 candles for a symbol. Candles are cached until the newest one closes,
+        after which only the missing candles are requested. Intervals in RESAMPLE_FROM are built from
+        the cached finer candles when those cover 100 of them.
 
         Parameters
         ----------
@@ -135,65 +342,158 @@ class BybitCrypto:
         frequency : str
             Frequency of candles.
 
+        indicators : Tuple[str, ...]
+            Indicator specs to attach to the candles. ie ema20, rsi14
+
         Returns
         -------
-        pd.DataFrame
-            Returns a timeseries dataframe with high, low, and volume data if its available.
-            Otherwise returns empty pd.DataFrame.
+        Candles
+            Columnar OHLCV arrays, empty if the symbol has no candles.
         """
-        if data := self.session.query_kline(
-                symbol=symbol.symbol + self.vs_currency, interval=frequency
-        )['result']:
+        pair = symbol.pair
+        candles = None
 
-            columns = ['startTime', 'open', 'high', 'low', 'close', 'volume', 'endTime', 'quoteAssetVolume', 'trades',
-                       'takerBaseVolume', 'takerQuoteVolume']
+        if (base := RESAMPLE_FROM.get(frequency)) is not None:
+            candles = self._resampled(self.get_klines(pair, base), frequency)
+        if candles is None:
+            candles = Candles.from_klines(self.get_klines(pair, frequency))
 
-            df = pd.DataFrame(data, columns=columns)
+        return self._chart_candles(pair, frequency, candles, indicators)
 
-            df['startTime'] = df['startTime'].apply(lambda x: dt.datetime.utcfromtimestamp(x / 1000))
+    async def achart_reply(self, symbol: Coin, frequency: str, indicators: Tuple[str, ...] = ()) -> Candles:
+        """Async version of chart_reply."""
+        pair = symbol.pair
+        candles = None
 
-            df = df[['startTime', 'open', 'high', 'low', 'close']]
+        if (base := RESAMPLE_FROM.get(frequency)) is not None:
+            candles = self._resampled(await self.aget_klines(pair, base), frequency)
+        if candles is None:
+            candles = Candles.from_klines(await self.aget_klines(pair, frequency))
 
-            df.rename(columns={'startTime': 'Date', 'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close'},
-                      inplace=True)
+        return self._chart_candles(pair, frequency, candles, indicators)
 
-            df['Date'] = pd.to_datetime(df['Date'], unit='ms')
+    def _resampled(self, klines: list, frequency: str) -> Optional[Candles]:
+        """Resamples base klines, None when they are cut short of CHART_CANDLES candles."""
+        candles = Candles.from_klines(klines).resample(frequency)
 
-            df = df.set_index('Date')
+        # Fewer base candles than the cache holds means that is the pairs whole history.
+        if len(candles) >= CHART_CANDLES or len(klines) < self.candle_cache.maxlen:
+            return candles
 
-            df = df.astype(float)
+        return None
 
-            df.sort_index(ascending=False, inplace=True)
+    def _chart_candles(self, pair: str, frequency: str, candles: Candles, indicators: Tuple[str, ...]) -> Candles:
+        """Newest CHART_CANDLES candles, indicators are warmed up on every cached one."""
+        if indicators:
+            candles.indicators = self.indicator_engine.compute(pair, frequency, candles, indicators, CHART_CANDLES)
 
-            df = df[:100]
+        return candles.tail(CHART_CANDLES)
 
-            df.sort_index(ascending=True, inplace=True)
+    def indicator_reply(self, symbol: Coin, frequency: str, indicators: Tuple[str, ...]) -> str:
+        """Latest value of each indicator as markdown lines, see chart_reply."""
+        return self._format_indicators(frequency, indicators, self.chart_reply(symbol, frequency, indicators))
 
-            return df
+    async def aindicator_reply(self, symbol: Coin, frequency: str, indicators: Tuple[str, ...]) -> str:
+        """Async version of indicator_reply."""
+        return self._format_indicators(frequency, indicators, await self.achart_reply(symbol, frequency, indicators))
 
-        return pd.DataFrame()
+    @staticmethod
+    def _format_indicators(frequency: str, indicators: Tuple[str, ...], candles: Candles) -> str:
+        if candles.is_empty:
+            return ""
 
-    def stat_reply(self, symbol: Coin) -> str:
-        """Gathers most recent prices for given token from ByBit API.
+        lines = [f"\n{frequency} Indicators:\n"]
+        for spec in indicators:
+            value = candles.indicators[spec][-1]
+            if np.isnan(value):
+                lines.append(f"{title(spec)}: not enough data\n")
+            elif spec.startswith("rsi"):
+                lines.append(f"{title(spec)}: {value:.2f}\n")
+            elif spec.startswith("bb"):
+                lower, upper = candles.indicators[spec + ".lower"][-1], candles.indicators[spec + ".upper"][-1]
+                lines.append(f"{title(spec)}: ${lower:.2f} - ${upper:.2f}\n")
+            else:
+                lines.append(f"{title(spec)}: ${value:.2f}\n")
+
+        return "".join(lines)
+
+    def stat_reply(self, symbol: Coin, indicators: Tuple[str, ...] = (), frequency: str = "1h") -> str:
+        """Gathers most recent prices for given token from the live stream or the ticker
+        snapshot, falling back to the ByBit API when neither has it.
 
         Parameters
         ----------
         symbol : Coin
 
+        indicators : Tuple[str, ...]
+            Indicator specs whose latest values are added. ie ema20, rsi14
+
+        frequency : str
+            Candle interval the indicators are computed on.
+
         Returns
         -------
         str
             Preformatted markdown.
         """
-        if data := self.session.latest_information_for_symbol(
-                symbol=symbol.symbol + self.vs_currency
-        )['result']:
+        if not (data := self._live_ticker(symbol) or self.tickers.get(symbol.symbol)):
+            data = self.session.latest_information_for_symbol(
+                symbol=symbol.pair
+            )['result']
+
+        if not data:
+            return self.format_stats(symbol, data)
+
+        reply = self.format_stats(
+            symbol, data, self.get_one_hour_change(symbol, float(data['lastPrice']))
+        )
+        if indicators:
+            reply += self.indicator_reply(symbol, frequency, indicators)
+        return reply
+
+    async def astat_reply(self, symbol: Coin, indicators: Tuple[str, ...] = (), frequency: str = "1h") -> str:
+        """Async version of stat_reply."""
+        if not (data := self._live_ticker(symbol) or self.tickers.get(symbol.symbol)):
+            data = (await self.aclient.latest_information_for_symbol(
+                symbol=symbol.pair
+            ))['result']
+
+        if not data:
+            return self.format_stats(symbol, data)
+
+        reply = self.format_stats(
+            symbol, data, await self.aget_one_hour_change(symbol, float(data['lastPrice']))
+        )
+        if indicators:
+            reply += await self.aindicator_reply(symbol, frequency, indicators)
+        return reply
+
+    @staticmethod
+    def format_stats(symbol: Coin, data: dict, one_hr_change: float = None) -> str:
+        """Formats the 24h stats reply of a symbol, also used for inline results.
+
+        Parameters
+        ----------
+        symbol : Coin
+            Symbol the stats are for.
+
+        data : dict
+            24h ticker of the pair, empty when it is not available.
+
+        one_hr_change : float, optional
+            Percent change over the last hour, left out when None.
+
+        Returns
+        -------
+        str
+            Reply text, or a note that the price is not available.
+        """
+        if data:
 
             now_price = float(data['lastPrice'])
             open_price = float(data['openPrice'])
             high_price = float(data['highPrice'])
             low_price = float(data['lowPrice'])
-            one_hr_change = self.get_one_hour_change(symbol, now_price)
             twen_four_hr_change = (now_price / open_price - 1) * 100
 
             title = f"24h {symbol.symbol} Stats:\n\n"
@@ -201,7 +501,7 @@ class BybitCrypto:
             _open = f"Open: ${open_price:.2f}\n"
             high = f"High: ${high_price:.2f}\n"
             low = f"Low: ${low_price:.2f}\n"
-            one_change = f"1h Change: {one_hr_change:.2f}%\n"
+            one_change = f"1h Change: {one_hr_change:.2f}%\n" if one_hr_change is not None else ""
             twenty_four_change = f"24h Change: {twen_four_hr_change:.2f}%\n"
 
             return title + current_price + _open + high + low + one_change + twenty_four_change
@@ -0,0 +1,115 @@
+"""Non-blocking client for the public ByBit spot REST endpoints the bot uses."""
+
+import asyncio
+import time
+from logging import warning
+from typing import Optional
+
+import aiohttp
+
+from bybit_http import BybitAPIError
+from upstream import RETRY_STATUS, Upstream, backoff, upstream
+
+
+class AsyncBybitClient:
+    """
+    Async twin of BybitHTTP, responses have the same shape so both clients
+    share BybitCrypto's parsing code.
+
+    A single aiohttp session is kept for the life of the client so every
+    request reuses a pooled keep-alive connection. Rate limits, retries and
+    latency stats are shared with the blocking clients through Upstream.
+    """
+
+    def __init__(
+        self,
+        client: Upstream = upstream,
+        limit: int = 100,
+        timeout: float = 10,
+        retries: int = 3,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        client : Upstream
+            Provides the endpoint, rate limiter and stats for "bybit". Set the
+            BYBIT_ENDPOINT environment variable to use a local fake server.
+
+        limit : int
+            Maximum simultaneous connections to ByBit.
+
+        timeout : float
+            Total seconds allowed per attempt.
+
+        retries : int
+            Additional attempts after connection errors, 429 and 5xx responses.
+        """
+        self.client = client
+        self.retries = retries
+        self.limit = limit
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60),
+                timeout=self.timeout,
+            )
+        return self._session
+
+    async def get(self, path: str, **params) -> dict:
+        url = self.client.url("bybit", path)
+        limiter = self.client.limiters["bybit"]
+        weight = self.client.weight("bybit", path)
+
+        for attempt in range(self.retries + 1):
+            await limiter.aacquire(weight)
+            start = time.perf_counter()
+            try:
+                async with self.session.get(url, params=params) as resp:
+                    status = resp.status
+                    # Recorded before raise_for_status so errors are counted.
+                    self.client.record(
+                        "bybit", path, time.perf_counter() - start, status < 400
+                    )
+                    if status not in RETRY_STATUS:
+                        resp.raise_for_status()
+                        data = await resp.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self.client.record("bybit", path, time.perf_counter() - start, False)
+                if attempt == self.retries:
+                    raise
+                warning(f"bybit {path} failed ({e!r}), retrying.")
+            else:
+                if status not in RETRY_STATUS:
+                    break
+                if attempt == self.retries:
+                    raise BybitAPIError(f"{path} returned HTTP {status}")
+                warning(f"bybit {path} returned {status}, retrying.")
+
+            await asyncio.sleep(backoff(attempt))
+
+        if data.get("ret_code", 0) != 0:
+            raise BybitAPIError(
+                f"{path} returned {data.get('ret_code')}: {data.get('ret_msg')}"
+            )
+
+        return data
+
+    async def query_symbol(self) -> dict:
+        return await self.get("/spot/v1/symbols")
+
+    async def query_kline(self, **params) -> dict:
+        return await self.get("/spot/quote/v1/kline", **params)
+
+    async def latest_information_for_symbol(self, **params) -> dict:
+        return await self.get("/spot/quote/v1/ticker/24hr", **params)
+
+    async def server_time(self) -> dict:
+        return await self.get("/spot/v1/time")
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,42 @@
+"""Blocking client for the public ByBit spot REST endpoints the bot uses."""
+
+from upstream import Upstream, upstream
+
+
+class BybitAPIError(Exception):
+    """Raised when ByBit answers with a non zero ret_code."""
+
+
+class BybitHTTP:
+    """
+    Same methods and responses as the pybit spot.HTTP calls BybitCrypto used.
+    Requests go through the shared Upstream so they are pooled, rate limited
+    and retried.
+    """
+
+    def __init__(self, client: Upstream = upstream) -> None:
+        self.client = client
+
+    def get(self, path: str, **params) -> dict:
+        resp = self.client.get("bybit", path, params=params)
+        resp.raise_for_status()
+        data = resp.json()
+
+        if data.get("ret_code", 0) != 0:
+            raise BybitAPIError(
+                f"{path} returned {data.get('ret_code')}: {data.get('ret_msg')}"
+            )
+
+        return data
+
+    def query_symbol(self) -> dict:
+        return self.get("/spot/v1/symbols")
+
+    def query_kline(self, **params) -> dict:
+        return self.get("/spot/quote/v1/kline", **params)
+
+    def latest_information_for_symbol(self, **params) -> dict:
+        return self.get("/spot/quote/v1/ticker/24hr", **params)
+
+    def server_time(self) -> dict:
+        return self.get("/spot/v1/time")
@@ -0,0 +1,256 @@
+"""Cache backends shared by the router and the provider classes.
+
+MemoryBackend keeps values inside one process. SQLiteBackend keeps them in a
+file every bot replica on the host opens, so market data fetched by one
+replica is reused by the others and upstream traffic does not grow with the
+number of replicas. Only one replica refreshes a key at a time, the others
+wait for its result.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from logging import debug, warning
+from typing import Any, Awaitable, Callable, Optional
+
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")  # memory or sqlite
+CACHE_DB = os.environ.get(
+    "CACHE_DB", os.path.join(os.environ.get("DATA_DIR", "data"), "cache.sqlite3")
+)
+
+
+class CacheBackend(ABC):
+    """
+    Expiring key value store of JSON serializable values with refresh leases.
+    """
+
+    # True when calls wait on I/O, aget_or_fetch then runs them in a thread.
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the value stored under key, None if missing or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """Stores value under key for ttl seconds."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Removes key."""
+
+    @abstractmethod
+    def lease(self, key: str, ttl: float) -> bool:
+        """Takes the refresh lease of key for ttl seconds, False if someone holds it."""
+
+    @abstractmethod
+    def release(self, key: str) -> None:
+        """Gives up the refresh lease of key."""
+
+    @abstractmethod
+    def purge(self) -> None:
+        """Deletes expired values and leases."""
+
+    def get_or_fetch(
+        self, key: str, ttl: float, fetch: Callable[[], Any], wait: float = 5
+    ) -> Any:
+        """Returns the cached value of key, calling fetch when it is missing.
+
+        Parameters
+        ----------
+        key : str
+            Cache key. ie bybit:tickers
+
+        ttl : float
+            Seconds a fetched value is served for.
+
+        fetch : Callable[[], Any]
+            Returns a fresh, JSON serializable value.
+
+        wait : float
+            Seconds to wait for another replica that holds the lease before
+            fetching anyway.
+
+        Returns
+        -------
+        Any
+            Cached or freshly fetched value.
+        """
+        deadline = time.monotonic() + wait
+        while (value := self.get(key)) is None:
+            if self.lease(key, wait):
+                try:
+                    value = fetch()
+                    if value is not None:
+                        self.set(key, value, ttl)
+                    return value
+                finally:
+                    self.release(key)
+            if time.monotonic() > deadline:
+                return fetch()
+            time.sleep(0.05)
+        return value
+
+    async def aget_or_fetch(
+        self,
+        key: str,
+        ttl: float,
+        fetch: Callable[[], Awaitable[Any]],
+        wait: float = 5,
+    ) -> Any:
+        """Async version of get_or_fetch, fetch is a coroutine function."""
+        deadline = time.monotonic() + wait
+        while (value := await self._acall(self.get, key)) is None:
+            if await self._acall(self.lease, key, wait):
+                try:
+                    value = await fetch()
+                    if value is not None:
+                        await self._acall(self.set, key, value, ttl)
+                    return value
+                finally:
+                    await self._acall(self.release, key)
+            if time.monotonic() > deadline:
+                return await fetch()
+            await asyncio.sleep(0.05)
+        return value
+
+    async def _acall(self, fn: Callable, *args) -> Any:
+        if not self.blocking:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+class MemoryBackend(CacheBackend):
+    """Backend local to one process."""
+
+    def __init__(self) -> None:
+        self._values = {}
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._values.get(key)
+        if item is None or item[1] < time.time():
+            return None
+        return item[0]
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def lease(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            if self._leases.get(key, 0) > now:
+                return False
+            self._leases[key] = now + ttl
+            return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._leases.pop(key, None)
+
+    def purge(self) -> None:
+        now = time.time()
+        with self._lock:
+            self._values = {k: v for k, v in self._values.items() if v[1] >= now}
+            self._leases = {k: t for k, t in self._leases.items() if t > now}
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Backend in a SQLite file shared by every process that opens it. Values are
+    stored as JSON, leases are rows only one process can insert.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str = CACHE_DB) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            Database file, created when missing.
+        """
+        self.path = path
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._db() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS leases "
+                "(key TEXT PRIMARY KEY, expires REAL NOT NULL)"
+            )
+
+    def _db(self) -> sqlite3.Connection:
+        # Connections can not be shared between threads, each gets its own.
+        if (db := getattr(self._local, "db", None)) is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def get(self, key: str) -> Optional[Any]:
+        row = (
+            self._db()
+            .execute(
+                "SELECT value FROM cache WHERE key = ? AND expires >= ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._db() as db:
+            db.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def lease(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        with self._db() as db:
+            db.execute("DELETE FROM leases WHERE key = ? AND expires < ?", (key, now))
+            cur = db.execute(
+                "INSERT OR IGNORE INTO leases VALUES (?, ?)", (key, now + ttl)
+            )
+            return cur.rowcount == 1
+
+    def release(self, key: str) -> None:
+        with self._db() as db:
+            db.execute("DELETE FROM leases WHERE key = ?", (key,))
+
+    def purge(self) -> None:
+        now = time.time()
+        with self._db() as db:
+            db.execute("DELETE FROM cache WHERE expires < ?", (now,))
+            db.execute("DELETE FROM leases WHERE expires < ?", (now,))
+
+
+def default_backend() -> CacheBackend:
+    """Backend selected by CACHE_BACKEND, memory when the shared one can't open."""
+    if CACHE_BACKEND == "sqlite":
+        try:
+            backend = SQLiteBackend(CACHE_DB)
+            debug(f"Using shared cache at {CACHE_DB}")
+            return backend
+        except sqlite3.Error as e:
+            warning(f"Shared cache {CACHE_DB} unavailable, using memory: {e}")
+    return MemoryBackend()
@@ -0,0 +1,182 @@
+"""In memory kline cache shared by every chart request."""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from logging import debug, warning
+from typing import Awaitable, Callable, Optional
+
+INTERVAL_MS = {
+    "1m": 60_000,
+    "3m": 3 * 60_000,
+    "5m": 5 * 60_000,
+    "15m": 15 * 60_000,
+    "30m": 30 * 60_000,
+    "1h": 3_600_000,
+    "2h": 2 * 3_600_000,
+    "4h": 4 * 3_600_000,
+    "6h": 6 * 3_600_000,
+    "12h": 12 * 3_600_000,
+    "1d": 86_400_000,
+    "1w": 7 * 86_400_000,
+    "1M": 31 * 86_400_000,  # Upper bound, only used to size gaps.
+}
+
+# Positions in a raw ByBit kline row.
+START_TIME = 0
+END_TIME = 6
+
+
+class _Entry:
+    __slots__ = ("rows", "expires", "lock")
+
+    def __init__(self, maxlen: int) -> None:
+        self.rows = deque(maxlen=maxlen)
+        self.expires = 0
+        self.lock = threading.Lock()
+
+
+class CandleCache:
+    """
+    Bounded ring of raw kline rows per (symbol, interval).
+
+    Entries stay valid until the newest candle in them closes. After that only
+    the candles from the last cached one onwards are requested and appended,
+    the still open candle being replaced by its final version.
+    """
+
+    def __init__(self, maxlen: int = 1000, store=None) -> None:
+        """
+        Parameters
+        ----------
+        maxlen : int
+            Candles kept per (symbol, interval). Matches ByBit's kline limit.
+
+        store : CandleStore, optional
+            Empty entries are seeded from it and closed candles are written to it,
+            so restarts and other processes on the host start warm.
+        """
+        self.maxlen = maxlen
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, key: tuple) -> _Entry:
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                entry = self._entries[key] = _Entry(self.maxlen)
+            return entry
+
+    def get(self, symbol: str, interval: str, fetch: Callable[..., list]) -> list:
+        """Returns cached klines oldest first, fetching only what is missing.
+
+        Parameters
+        ----------
+        symbol : str
+            API pair name. ie BTCUSDT
+
+        interval : str
+            Kline interval. ie 1h
+
+        fetch : Callable[..., list]
+            Called with optional startTime keyword, returns raw kline rows oldest first.
+
+        Returns
+        -------
+        list
+            Raw kline rows, empty if the API returned nothing.
+        """
+        entry = self._entry((symbol, interval))
+
+        with entry.lock:
+            if not entry.rows and self.store is not None:
+                entry.rows.extend(self.store.read_klines(symbol, interval, self.maxlen))
+            if (params := self._plan(entry, interval)) is None:
+                return list(entry.rows)
+
+            rows = fetch(**params)
+            self._merge(entry, rows, symbol, interval, params)
+            self._store(symbol, interval, rows)
+            return list(entry.rows)
+
+    async def aget(
+        self, symbol: str, interval: str, fetch: Callable[..., Awaitable]
+    ) -> list:
+        """Async version of get, fetch is a coroutine function. The store is read
+        and written in the default executor, it can block on its file lock."""
+        entry = self._entry((symbol, interval))
+        loop = asyncio.get_running_loop()
+
+        if not entry.rows and self.store is not None:
+            rows = await loop.run_in_executor(
+                None, self.store.read_klines, symbol, interval, self.maxlen
+            )
+            # Another task may have filled the entry while this one waited.
+            if not entry.rows:
+                entry.rows.extend(rows)
+        if (params := self._plan(entry, interval)) is None:
+            return list(entry.rows)
+
+        rows = await fetch(**params)
+        self._merge(entry, rows, symbol, interval, params)
+        if rows and self.store is not None:
+            await loop.run_in_executor(None, self._store, symbol, interval, rows)
+        return list(entry.rows)
+
+    def _plan(self, entry: _Entry, interval: str) -> Optional[dict]:
+        """Returns the kline params needed to update an entry, None if it is fresh."""
+        now = time.time() * 1000
+
+        if entry.rows and now <= entry.expires:
+            self.hits += 1
+            return None
+
+        self.misses += 1
+        params = {}
+        if entry.rows:
+            last_start = entry.rows[-1][START_TIME]
+            if (now - last_start) / INTERVAL_MS[interval] < self.maxlen:
+                params["startTime"] = last_start
+            else:
+                entry.rows.clear()
+
+        return params
+
+    def _merge(
+        self, entry: _Entry, rows: list, symbol: str, interval: str, params: dict
+    ) -> None:
+        if not rows:
+            return
+
+        first_start = rows[0][START_TIME]
+        while entry.rows and entry.rows[-1][START_TIME] >= first_start:
+            entry.rows.pop()
+        entry.rows.extend(rows)
+        entry.expires = entry.rows[-1][END_TIME]
+
+        debug(f"Fetched {len(rows)} {interval} candles for {symbol} {params}")
+
+    def _store(self, symbol: str, interval: str, rows: list) -> None:
+        if not rows or self.store is None:
+            return
+        try:
+            self.store.append(symbol, interval, rows)
+        except OSError as e:
+            warning(f"Could not store {interval} candles for {symbol}: {e}")
+
+    def expire(self, symbol: str, interval: str) -> None:
+        """Makes the next get for (symbol, interval) fetch any newer candles."""
+        self._entry((symbol, interval)).expires = 0
+
+    def discard(self, symbol: str) -> None:
+        """Drops every interval cached for a pair. ie after it is delisted"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == symbol]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
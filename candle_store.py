@@ -0,0 +1,216 @@
+"""On disk store of closed candles shared by every bot process on a host.
+
+Each (pair, interval) partition is a flat file of fixed size records read
+through numpy memory maps. Appends happen under an exclusive file lock, and
+readers only ever map whole records, so any number of reader processes can
+use a partition while one process writes to it.
+"""
+
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+from logging import debug, info, warning
+from typing import Optional
+
+import numpy as np
+
+from candle_cache import END_TIME, INTERVAL_MS, START_TIME
+
+CANDLE_STORE = os.environ.get(
+    "CANDLE_STORE", os.path.join(os.environ.get("DATA_DIR", "data"), "candles")
+)
+
+RECORD = np.dtype(
+    [
+        ("start", "<i8"),
+        ("open", "<f8"),
+        ("high", "<f8"),
+        ("low", "<f8"),
+        ("close", "<f8"),
+        ("volume", "<f8"),
+    ]
+)
+
+# Candles kept per interval when compacting, None keeps everything.
+RETENTION = {
+    "1m": 7 * 24 * 60,
+    "3m": 14 * 24 * 20,
+    "5m": 30 * 24 * 12,
+    "15m": 30 * 24 * 4,
+    "30m": 90 * 24 * 2,
+    "1h": 365 * 24,
+    "2h": 365 * 12,
+    "4h": 2 * 365 * 6,
+    "6h": 2 * 365 * 4,
+    "12h": 2 * 365 * 2,
+    "1d": 10 * 365,
+    "1w": None,
+    "1M": None,
+}
+
+
+class CandleStore:
+    """
+    Closed candles per (pair, interval), oldest first, without duplicates.
+    """
+
+    def __init__(self, root: str = CANDLE_STORE) -> None:
+        """
+        Parameters
+        ----------
+        root : str
+            Directory holding one sub directory per pair.
+        """
+        self.root = root
+
+    def _path(self, pair: str, interval: str) -> str:
+        # 1m and 1M would collide on case insensitive file systems.
+        name = interval.replace("M", "mo")
+        return os.path.join(self.root, pair, name)
+
+    @contextmanager
+    def _locked(self, pair: str, interval: str):
+        path = self._path(pair, interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield path + ".bin"
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _map(path: str) -> Optional[np.memmap]:
+        try:
+            count = os.path.getsize(path) // RECORD.itemsize
+        except OSError:
+            return None
+        if count == 0:
+            return None
+        return np.memmap(path, dtype=RECORD, mode="r", shape=(count,))
+
+    def read(self, pair: str, interval: str, limit: Optional[int] = None) -> np.ndarray:
+        """Returns up to limit of the newest stored candles, oldest first.
+
+        Parameters
+        ----------
+        pair : str
+            API pair name. ie BTCUSDT
+
+        interval : str
+            Kline interval. ie 1h
+
+        limit : Optional[int]
+            Newest candles to return, all of them when None.
+
+        Returns
+        -------
+        np.ndarray
+            Records of RECORD dtype, empty if nothing is stored.
+        """
+        records = self._map(self._path(pair, interval) + ".bin")
+        if records is None:
+            return np.empty(0, dtype=RECORD)
+
+        return np.array(records[-limit:] if limit else records)
+
+    def read_klines(
+        self, pair: str, interval: str, limit: Optional[int] = None
+    ) -> list:
+        """Same as read but as raw kline rows like the ones ByBit returns."""
+        records = self.read(pair, interval, limit)
+        interval_ms = INTERVAL_MS[interval]
+
+        return [
+            [start, o, h, l, c, v, start + interval_ms - 1]
+            for start, o, h, l, c, v in records.tolist()
+        ]
+
+    def append(self, pair: str, interval: str, klines: list) -> int:
+        """Stores the closed candles in klines that are newer than the stored ones.
+
+        Parameters
+        ----------
+        pair : str
+            API pair name.
+
+        interval : str
+            Kline interval.
+
+        klines : list
+            Raw kline rows oldest first, the still open candle is skipped.
+
+        Returns
+        -------
+        int
+            Number of candles written.
+        """
+        now = time.time() * 1000
+        closed = [row for row in klines if row[END_TIME] < now]
+        if not closed:
+            return 0
+
+        with self._locked(pair, interval) as path:
+            records = self._map(path)
+            last = int(records[-1]["start"]) if records is not None else -1
+            del records
+
+            new = [row for row in closed if int(row[START_TIME]) > last]
+            if not new:
+                return 0
+
+            data = np.array(
+                [tuple(float(x) for x in row[1:6]) for row in new], dtype=float
+            )
+            out = np.empty(len(new), dtype=RECORD)
+            out["start"] = [int(row[START_TIME]) for row in new]
+            for i, field in enumerate(("open", "high", "low", "close", "volume")):
+                out[field] = data[:, i]
+
+            # One write of whole records so readers never map a partial one.
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, out.tobytes())
+            finally:
+                os.close(fd)
+
+        debug(f"Stored {len(new)} {interval} candles for {pair}")
+        return len(new)
+
+    def compact(self, pair: str, interval: str) -> None:
+        """Sorts, deduplicates and trims a partition to its retention.
+
+        The partition is rewritten to a new file and swapped in, readers that
+        already mapped the old file keep reading it safely.
+        """
+        with self._locked(pair, interval) as path:
+            records = self._map(path)
+            if records is None:
+                return
+
+            records = np.array(records)
+            _, unique = np.unique(records["start"], return_index=True)
+            records = records[unique]  # np.unique sorts by start
+            if (keep := RETENTION.get(interval)) is not None:
+                records = records[-keep:]
+
+            with open(path + ".tmp", "wb") as f:
+                f.write(records.tobytes())
+            os.replace(path + ".tmp", path)
+
+    def compact_all(self) -> None:
+        """Compacts every partition in the store."""
+        if not os.path.isdir(self.root):
+            return
+
+        start = time.perf_counter()
+        for pair in os.listdir(self.root):
+            for interval in INTERVAL_MS:
+                if os.path.exists(self._path(pair, interval) + ".bin"):
+                    try:
+                        self.compact(pair, interval)
+                    except OSError as e:
+                        warning(f"Compacting {pair} {interval} failed: {e}")
+
+        info(f"Candle store compacted in {time.perf_counter() - start:.2f}s")
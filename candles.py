@@ -0,0 +1,210 @@
+"""Columnar candle arrays built straight from raw kline payloads."""
+
+import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from candle_cache import INTERVAL_MS
+
+DAY_MS = 86_400_000
+WEEK_MS = 7 * DAY_MS
+MONDAY_MS = 4 * DAY_MS  # The epoch was a Thursday, the first Monday is 4 days later
+
+# Intervals that can be built from a finer one, and the one they are built from.
+# 12h and 1M are left out, the 1000 cached base candles make fewer of them than
+# a chart shows so they would always be fetched natively anyway.
+RESAMPLE_FROM = {
+    "2h": "1h",
+    "4h": "1h",
+    "6h": "1h",
+    "1w": "1d",
+}
+
+
+def bucket_starts(time: np.ndarray, interval: str) -> np.ndarray:
+    """Start of the interval candle each epoch ms timestamp falls in.
+
+    Candles align like ByBit's: intraday ones to multiples of their length
+    since the epoch in UTC, weeks to Monday 00:00 UTC and months to the first
+    of the calendar month.
+    """
+    if interval == "1M":
+        months = time.astype("datetime64[ms]").astype("datetime64[M]")
+        return months.astype("datetime64[ms]").astype(np.int64)
+    if interval == "1w":
+        return time - (time - MONDAY_MS) % WEEK_MS
+    return time - time % INTERVAL_MS[interval]
+
+
+class Candles:
+    """
+    Candles oldest first as contiguous NumPy arrays.
+
+    time holds candle start times as int64 epoch milliseconds and values is a
+    (5, n) float64 block of open, high, low, close and volume rows, so every
+    field is a contiguous view of it.
+    """
+
+    __slots__ = ("time", "values", "indicators")
+
+    def __init__(
+        self, time: np.ndarray, values: np.ndarray, indicators: Optional[dict] = None
+    ) -> None:
+        self.time = time
+        self.values = values
+        # Indicator label to values aligned with time, see indicators.py.
+        self.indicators = indicators or {}
+
+    @classmethod
+    def from_klines(cls, klines: list, limit: Optional[int] = None) -> "Candles":
+        """Parses raw ByBit kline rows in one vectorized conversion.
+
+        Parameters
+        ----------
+        klines : list
+            Raw kline rows, prices may be numbers or strings.
+
+        limit : Optional[int]
+            Newest candles to keep.
+
+        Returns
+        -------
+        Candles
+            Sorted by start time.
+        """
+        if not klines:
+            return cls.empty()
+
+        # Rows can carry 7 or 11 fields depending on where they came from.
+        data = np.array([row[:6] for row in klines], dtype=np.float64)
+        time = data[:, 0].astype(np.int64)
+
+        if len(time) > 1 and (np.diff(time) < 0).any():
+            order = np.argsort(time, kind="stable")
+            data, time = data[order], time[order]
+        if limit is not None:
+            data, time = data[-limit:], time[-limit:]
+
+        return cls(time, np.ascontiguousarray(data[:, 1:].T))
+
+    @classmethod
+    def empty(cls) -> "Candles":
+        return cls(np.empty(0, dtype=np.int64), np.empty((5, 0), dtype=np.float64))
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def head(self, n: int) -> "Candles":
+        """Oldest n candles, as views of these arrays."""
+        return Candles(
+            self.time[:n],
+            self.values[:, :n],
+            {label: line[:n] for label, line in self.indicators.items()},
+        )
+
+    def tail(self, n: int) -> "Candles":
+        """Newest n candles, as views of these arrays."""
+        return Candles(
+            self.time[-n:],
+            self.values[:, -n:],
+            {label: line[-n:] for label, line in self.indicators.items()},
+        )
+
+    def resample(self, interval: str) -> "Candles":
+        """Aggregates these candles into longer interval candles.
+
+        A leading candle that only part of the base candles fall in is dropped,
+        the newest one is kept like the still open candle ByBit returns.
+
+        Parameters
+        ----------
+        interval : str
+            Target interval, coarser than and aligned with these candles. ie 4h
+
+        Returns
+        -------
+        Candles
+            One candle per interval, oldest first.
+        """
+        if self.is_empty:
+            return self
+
+        keys, values = bucket_starts(self.time, interval), self.values
+        if keys[0] != self.time[0]:
+            first = np.searchsorted(keys, keys[0], side="right")
+            keys, values = keys[first:], values[:, first:]
+            if len(keys) == 0:
+                return Candles.empty()
+
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+        ends = np.concatenate((starts[1:], [len(keys)])) - 1
+
+        out = np.empty((5, len(starts)), dtype=np.float64)
+        out[0] = values[0, starts]
+        out[1] = np.maximum.reduceat(values[1], starts)
+        out[2] = np.minimum.reduceat(values[2], starts)
+        out[3] = values[3, ends]
+        out[4] = np.add.reduceat(values[4], starts)
+
+        return Candles(keys[starts], out)
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.time) == 0
+
+    @property
+    def open(self) -> np.ndarray:
+        return self.values[0]
+
+    @property
+    def high(self) -> np.ndarray:
+        return self.values[1]
+
+    @property
+    def low(self) -> np.ndarray:
+        return self.values[2]
+
+    @property
+    def close(self) -> np.ndarray:
+        return self.values[3]
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self.values[4]
+
+    @property
+    def first(self) -> datetime.datetime:
+        """Start of the oldest candle, UTC."""
+        return datetime.datetime.utcfromtimestamp(self.time[0] / 1000)
+
+    @property
+    def last(self) -> datetime.datetime:
+        """Start of the newest candle, UTC."""
+        return datetime.datetime.utcfromtimestamp(self.time[-1] / 1000)
+
+    def frame(self, volume: bool = False) -> pd.DataFrame:
+        """DataFrame view for mplfinance, the price columns are not copied.
+
+        Parameters
+        ----------
+        volume : bool
+            Include the Volume column.
+
+        Returns
+        -------
+        pd.DataFrame
+            Open, High, Low, Close (and Volume) indexed by candle start.
+        """
+        columns = ["Open", "High", "Low", "Close", "Volume"]
+        rows = 5 if volume else 4
+
+        index = self.time.astype("datetime64[ms]").astype("datetime64[ns]")
+
+        return pd.DataFrame(
+            self.values[:rows].T,
+            index=pd.DatetimeIndex(index),
+            columns=columns[:rows],
+            copy=False,
+        )
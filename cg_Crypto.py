@@ -8,10 +8,12 @@ from typing import List, Optional, Tuple
 
 import pandas as pd
 import requests as r
-import schedule
 from markdownify import markdownify
 
+from cache_backend import CacheBackend, default_backend
+from symbol_refresher import SymbolRefresher
 from Symbol import Coin
+from upstream import upstream
 
 
 class cg_Crypto:
@@ -24,21 +26,22 @@ class cg_Crypto:
     searched_symbols = {}
     trending_cache = None
 
-    def __init__(self) -> None:
+    def __init__(self, cache: Optional[CacheBackend] = None) -> None:
         """Creates a Symbol Object
 
         Parameters
         ----------
-        IEX_TOKEN : str
-            IEX Token
+        cache : CacheBackend, optional
+            Where the coin list and trending coins are shared between replicas.
         """
-        self.get_symbol_list()
-        schedule.every().day.do(self.get_symbol_list)
+        self.cache = cache if cache is not None else default_backend()
+        self.refresher = SymbolRefresher("coingecko", self._refresh_symbols)
+        self.refresher.refresh()
+        self.refresher.start()
 
     def get(self, endpoint, params: dict = {}, timeout=10) -> dict:
 
-        url = "https://api.coingecko.com/api/v3" + endpoint
-        resp = r.get(url, params=params, timeout=timeout)
+        resp = upstream.get("coingecko", endpoint, params=params, timeout=timeout)
         # Make sure API returned a proper status code
         try:
             resp.raise_for_status()
@@ -62,11 +65,17 @@ class cg_Crypto:
         except KeyError:
             return ""
 
+    def _refresh_symbols(self) -> pd.Series:
+        self.get_symbol_list()
+        return self.symbol_list["id"]
+
     def get_symbol_list(
         self, return_df=False
     ) -> Optional[Tuple[pd.DataFrame, datetime]]:
 
-        raw_symbols = self.get("/coins/list")
+        raw_symbols = self.cache.get_or_fetch(
+            "coingecko:coins", 60 * 60, lambda: self.get("/coins/list") or None
+        )
         symbols = pd.DataFrame(data=raw_symbols)
 
         # Removes all binance-peg symbols
@@ -78,7 +87,13 @@ class cg_Crypto:
         symbols = symbols[["id", "symbol", "name", "description"]]
         symbols["type_id"] = "$$" + symbols["symbol"]
 
+        # Names and ids of coins point at their ticker. ie bitcoin -> BTC
+        tickers = symbols["symbol"].str.upper()
+        aliases = dict(zip(symbols["id"], tickers))
+        aliases.update(zip(symbols["name"].str.casefold(), tickers))
+
         self.symbol_list = symbols
+        self.aliases = aliases
         if return_df:
             return symbols, datetime.now()
 
@@ -90,10 +105,7 @@ class cg_Crypto:
         str
             Human readable text on status of CoinGecko API
         """
-        status = r.get(
-            "https://api.coingecko.com/api/v3/ping",
-            timeout=5,
-        )
+        status = upstream.get("coingecko", "/ping", timeout=5, retries=0)
 
         try:
             status.raise_for_status()
@@ -321,7 +333,10 @@ class cg_Crypto:
         list[str]
             list of $$ID: NAME, CHANGE%
         """
+        # Costs one call per trending coin, so replicas share the result.
+        return self.cache.get_or_fetch("coingecko:trending", 5 * 60, self._trending)
 
+    def _trending(self) -> list[str]:
         coins = self.get("/search/trending")
         try:
             trending = []
@@ -0,0 +1,138 @@
+"""LRU cache of rendered charts and the Telegram file ids they were uploaded as."""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from cache_backend import CacheBackend
+
+CHART_CACHE_BYTES = int(os.environ.get("CHART_CACHE_BYTES", 64 * 1024 * 1024))
+CHART_CACHE_ENTRIES = int(os.environ.get("CHART_CACHE_ENTRIES", 4096))
+
+
+class CachedChart:
+    __slots__ = ("png", "file_id")
+
+    def __init__(self, png: bytes) -> None:
+        self.png = png
+        self.file_id = None
+
+
+class ChartCache:
+    """
+    Rendered charts keyed by (symbol, interval, last candle timestamp, style).
+
+    A chart only changes when a new candle arrives, so every request inside the
+    same candle can reuse the first render. Once Telegram has stored the photo
+    its file id is kept as well and later replies skip the upload too.
+
+    File ids are also written to a shared backend when one is given, so other
+    replicas can send a chart without rendering it themselves.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = CHART_CACHE_BYTES,
+        max_entries: int = CHART_CACHE_ENTRIES,
+        backend: Optional[CacheBackend] = None,
+        file_id_ttl: float = 24 * 60 * 60,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        max_bytes : int
+            Total PNG bytes kept before the least recently used charts are evicted.
+
+        max_entries : int
+            Charts kept, whatever their size. Charts only known by a file id
+            from the backend have no PNG and are bounded by this alone.
+
+        backend : CacheBackend, optional
+            Shared store of file ids.
+
+        file_id_ttl : float
+            Seconds file ids are kept in the backend.
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.backend = backend
+        self.file_id_ttl = file_id_ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._charts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._charts)
+
+    @staticmethod
+    def _backend_key(key: tuple) -> str:
+        return "chart:" + ":".join(map(str, key))
+
+    def get(self, key: tuple) -> Optional[CachedChart]:
+        with self._lock:
+            if (chart := self._charts.get(key)) is not None:
+                self.hits += 1
+                self._charts.move_to_end(key)
+                return chart
+
+        if self.backend is not None and (
+            file_id := self.backend.get(self._backend_key(key))
+        ):
+            # Uploaded by another replica, only the file id is known here.
+            chart = CachedChart(b"")
+            chart.file_id = file_id
+            with self._lock:
+                self.hits += 1
+                self._insert(key, chart)
+            return chart
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set_file_id(self, key: tuple, chart: CachedChart, file_id: str) -> None:
+        """Records the Telegram file id a chart was uploaded as."""
+        chart.file_id = file_id
+        if self.backend is not None:
+            self.backend.set(self._backend_key(key), file_id, self.file_id_ttl)
+
+    def _insert(self, key: tuple, chart: CachedChart) -> None:
+        """Adds a chart and evicts the least recently used ones over a limit."""
+        if (old := self._charts.pop(key, None)) is not None:
+            self.size -= len(old.png)
+
+        self._charts[key] = chart
+        self.size += len(chart.png)
+
+        while len(self._charts) > 1 and (
+            self.size > self.max_bytes or len(self._charts) > self.max_entries
+        ):
+            _, evicted = self._charts.popitem(last=False)
+            self.size -= len(evicted.png)
+
+    def put(self, key: tuple, png: bytes) -> CachedChart:
+        chart = CachedChart(png)
+        with self._lock:
+            self._insert(key, chart)
+        return chart
+
+    def discard(self, symbols: set) -> None:
+        """Drops the charts of the given symbols. ie after they are delisted"""
+        with self._lock:
+            for key in [key for key in self._charts if key[0] in symbols]:
+                self.size -= len(self._charts.pop(key).png)
+
+    def stats(self) -> str:
+        """Human readable hit rate and memory use."""
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0
+        return (
+            f"Chart cache: {self.hits} hits, {self.misses} misses ({ratio:.1f}% hit rate), "
+            f"{len(self)} of {self.max_entries} charts using "
+            f"{self.size / 1024 / 1024:.1f} of "
+            f"{self.max_bytes / 1024 / 1024:.0f} MB."
+        )
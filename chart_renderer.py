@@ -0,0 +1,208 @@
+"""Renders candle charts in a pool of worker processes.
+
+Matplotlib holds the GIL for the whole render, so drawing in the bots own
+threads stalls every other handler. Workers import matplotlib and mplfinance
+once when they start and only receive plain arrays to draw.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from logging import info
+from typing import NamedTuple
+
+from candles import Candles
+from metrics import render_seconds, render_wait_seconds
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))
+RENDER_QUEUE_DEPTH = int(os.environ.get("RENDER_QUEUE_DEPTH", 16))
+
+
+class RenderResult(NamedTuple):
+    png: bytes
+    queue_wait: float  # Seconds between submission and a worker picking the job up
+    render_time: float  # Seconds spent drawing and encoding the PNG
+
+
+class RenderQueueFull(Exception):
+    """Raised when more charts are waiting than the queue allows."""
+
+
+def _warm() -> None:
+    """Worker initializer, pays the import cost before the first job arrives."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    import matplotlib.pyplot  # noqa: F401
+    import mplfinance  # noqa: F401
+
+
+def _render(
+    submitted: float,
+    candles: Candles,
+    volume: bool,
+    title: str,
+    style: str,
+    dpi: int,
+) -> tuple[bytes, float, float]:
+    import mplfinance as mpf
+    import numpy as np
+
+    from indicators import panel
+
+    started = time.time()
+
+    # Indicators with their own scale go in a panel under the price and volume.
+    overlays = [
+        mpf.make_addplot(
+            line,
+            panel=(1 + volume) if panel(label) else 0,
+            ylabel=label.upper() if panel(label) else "",
+            width=0.8,
+        )
+        for label, line in candles.indicators.items()
+        if not np.isnan(line).all()
+    ]
+    extra = {"addplot": overlays} if overlays else {}
+
+    buf = io.BytesIO()
+    mpf.plot(
+        candles.frame(volume=volume),
+        type="candle",
+        title=title,
+        volume=volume,
+        style=style,
+        savefig=dict(fname=buf, dpi=dpi, bbox_inches="tight"),
+        **extra,
+    )
+
+    return buf.getvalue(), started - submitted, time.time() - started
+
+
+class ChartRenderer:
+    """
+    Process pool that turns candle DataFrames into PNG bytes.
+    """
+
+    def __init__(
+        self, workers: int = RENDER_WORKERS, queue_depth: int = RENDER_QUEUE_DEPTH
+    ) -> None:
+        """
+        Parameters
+        ----------
+        workers : int
+            Number of rendering processes.
+
+        queue_depth : int
+            Maximum number of charts waiting or rendering before submissions are refused.
+        """
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.pending = 0
+
+        self._lock = threading.Lock()
+        # forkserver children do not inherit the bots threads, but each one still
+        # imports the bot script as __mp_main__, which is why the bots build
+        # their state in setup rather than on import. The server itself only
+        # preloads this module instead of the bot script.
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["chart_renderer"])
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=ctx, initializer=_warm
+        )
+
+    def warm(self) -> None:
+        """Starts every worker and waits for their imports to finish."""
+        for future in [self._executor.submit(_warm) for _ in range(self.workers)]:
+            future.result()
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self.pending -= 1
+
+    def submit(
+        self,
+        candles: Candles,
+        title: str,
+        style: str = "mike",
+        dpi: int = 400,
+        volume: bool = False,
+    ) -> Future:
+        """Queues a chart for rendering.
+
+        Parameters
+        ----------
+        candles : Candles
+            Candles to draw, only their arrays are sent to the worker. Their
+            indicators are drawn over them.
+
+        title : str
+            Chart title.
+
+        style : str
+            mplfinance style name.
+
+        dpi : int
+            Output resolution.
+
+        volume : bool
+            Draw a volume panel under the candles.
+
+        Returns
+        -------
+        Future
+            Resolves to a RenderResult.
+
+        Raises
+        ------
+        RenderQueueFull
+            If queue_depth charts are already pending.
+        """
+        with self._lock:
+            if self.pending >= self.queue_depth:
+                raise RenderQueueFull(f"{self.pending} charts already pending")
+            self.pending += 1
+
+        try:
+            raw = self._executor.submit(
+                _render,
+                time.time(),
+                candles,
+                volume,
+                title,
+                style,
+                dpi,
+            )
+        except Exception:
+            self._done(None)
+            raise
+        raw.add_done_callback(self._done)
+
+        result = Future()
+
+        def finish(raw: Future) -> None:
+            if (e := raw.exception()) is not None:
+                result.set_exception(e)
+                return
+
+            png, queue_wait, render_time = raw.result()
+            render_seconds.observe(render_time)
+            render_wait_seconds.observe(queue_wait)
+            info(
+                f"Rendered {title.strip()} in {render_time:.3f}s after {queue_wait:.3f}s in queue"
+            )
+            result.set_result(RenderResult(png, queue_wait, render_time))
+
+        raw.add_done_callback(finish)
+        return result
+
+    def render(self, *args, **kwargs) -> RenderResult:
+        """Blocking version of submit."""
+        return self.submit(*args, **kwargs).result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown()
@@ -0,0 +1,230 @@
+"""Local stand-in for the public ByBit spot REST API.
+
+Serves deterministic synthetic data in the same shape as ByBit so the bot and
+its clients can be exercised offline. The v2 spot WebSocket is served too, add
+?drop_after=seconds to its url to test reconnects.
+
+    python fake_bybit.py [port]
+    BYBIT_ENDPOINT=http://127.0.0.1:8765 python async_bot.py
+    BYBIT_STREAM=1 BYBIT_WS_ENDPOINT=ws://127.0.0.1:8765/spot/quote/ws/v2 python bot.py
+"""
+
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+
+from aiohttp import web
+
+BASES = ["BTC", "ETH", "SOL", "DOGE", "ADA", "XRP", "DOT", "LINK", "MATIC", "AVAX"]
+QUOTE = "USDT"
+
+INTERVAL_MS = {
+    "1m": 60_000,
+    "3m": 3 * 60_000,
+    "5m": 5 * 60_000,
+    "15m": 15 * 60_000,
+    "30m": 30 * 60_000,
+    "1h": 3_600_000,
+    "2h": 2 * 3_600_000,
+    "4h": 4 * 3_600_000,
+    "6h": 6 * 3_600_000,
+    "12h": 12 * 3_600_000,
+    "1d": 86_400_000,
+    "1w": 7 * 86_400_000,
+    "1M": 30 * 86_400_000,
+}
+
+
+def ok(result) -> web.Response:
+    return web.json_response(
+        {"ret_code": 0, "ret_msg": "", "ext_code": None, "result": result}
+    )
+
+
+def base_price(pair: str) -> float:
+    return random.Random(pair).uniform(0.1, 50_000)
+
+
+def kline(pair: str, interval_ms: int, start: int) -> list:
+    """Candle for a pair starting at start, always the same for the same inputs."""
+    rng = random.Random(f"{pair}{interval_ms}{start}")
+    _open = base_price(pair) * rng.uniform(0.9, 1.1)
+    close = _open * rng.uniform(0.98, 1.02)
+    high = max(_open, close) * rng.uniform(1, 1.01)
+    low = min(_open, close) * rng.uniform(0.99, 1)
+    volume = rng.uniform(1, 1000)
+    return [
+        start,
+        f"{_open:.4f}",
+        f"{high:.4f}",
+        f"{low:.4f}",
+        f"{close:.4f}",
+        f"{volume:.4f}",
+        start + interval_ms - 1,
+        f"{volume * close:.4f}",
+        rng.randint(1, 500),
+        f"{volume / 2:.4f}",
+        f"{volume * close / 2:.4f}",
+    ]
+
+
+def ticker(pair: str) -> dict:
+    now = int(time.time() * 1000)
+    price = base_price(pair)
+    return {
+        "time": now,
+        "symbol": pair,
+        "bestBidPrice": f"{price * 0.999:.4f}",
+        "bestAskPrice": f"{price * 1.001:.4f}",
+        "volume": "1234.5",
+        "quoteVolume": f"{1234.5 * price:.4f}",
+        "lastPrice": f"{price:.4f}",
+        "highPrice": f"{price * 1.05:.4f}",
+        "lowPrice": f"{price * 0.95:.4f}",
+        "openPrice": f"{price * 0.98:.4f}",
+    }
+
+
+async def symbols(request: web.Request) -> web.Response:
+    return ok(
+        [
+            {
+                "name": base + QUOTE,
+                "alias": base + QUOTE,
+                "baseCurrency": base,
+                "quoteCurrency": QUOTE,
+            }
+            for base in BASES
+        ]
+    )
+
+
+async def klines(request: web.Request) -> web.Response:
+    pair = request.query["symbol"]
+    interval_ms = INTERVAL_MS[request.query["interval"]]
+    limit = min(int(request.query.get("limit", 1000)), 1000)
+
+    now = int(time.time() * 1000) // interval_ms * interval_ms
+    if "startTime" in request.query:
+        start = int(request.query["startTime"]) // interval_ms * interval_ms
+        end = min(now, start + (limit - 1) * interval_ms)
+        starts = range(start, end + 1, interval_ms)
+    else:
+        starts = range(now - (limit - 1) * interval_ms, now + 1, interval_ms)
+
+    return ok([kline(pair, interval_ms, start) for start in starts])
+
+
+async def tickers(request: web.Request) -> web.Response:
+    if pair := request.query.get("symbol"):
+        return ok(ticker(pair))
+    return ok([ticker(base + QUOTE) for base in BASES])
+
+
+async def server_time(request: web.Request) -> web.Response:
+    return ok({"serverTime": int(time.time() * 1000)})
+
+
+def live_price(pair: str) -> float:
+    return base_price(pair) * (1 + 0.01 * math.sin(time.time() / 10))
+
+
+async def stream(request: web.Request) -> web.WebSocketResponse:
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+
+    topics = {}
+    drop_at = time.time() + float(request.query.get("drop_after", "inf"))
+
+    async def push():
+        while not ws.closed:
+            if time.time() >= drop_at:
+                await ws.close()
+                return
+
+            for (topic, pair, interval), params in list(topics.items()):
+                price = live_price(pair)
+                if topic == "realtimes":
+                    data = ticker(pair)
+                    data = {
+                        "t": data["time"],
+                        "s": pair,
+                        "c": f"{price:.4f}",
+                        "h": data["highPrice"],
+                        "l": data["lowPrice"],
+                        "o": data["openPrice"],
+                        "v": data["volume"],
+                        "qv": data["quoteVolume"],
+                        "m": f"{price / float(data['openPrice']) - 1:.4f}",
+                    }
+                else:
+                    interval_ms = INTERVAL_MS[interval]
+                    start = int(time.time() * 1000) // interval_ms * interval_ms
+                    row = kline(pair, interval_ms, start)
+                    data = {
+                        "t": start,
+                        "s": pair,
+                        "sn": pair,
+                        "o": row[1],
+                        "h": f"{max(float(row[2]), price):.4f}",
+                        "l": f"{min(float(row[3]), price):.4f}",
+                        "c": f"{price:.4f}",
+                        "v": row[5],
+                    }
+                await ws.send_json({"topic": topic, "params": params, "data": data})
+
+            await asyncio.sleep(0.5)
+
+    pusher = asyncio.create_task(push())
+
+    async for msg in ws:
+        data = json.loads(msg.data)
+
+        if "ping" in data:
+            await ws.send_json({"pong": data["ping"]})
+            continue
+
+        params = data.get("params", {})
+        key = (data.get("topic"), params.get("symbol"), params.get("klineType"))
+        if data.get("event") == "sub":
+            topics[key] = params
+        elif data.get("event") == "cancel":
+            topics.pop(key, None)
+        await ws.send_json({**data, "code": "0", "msg": "Success"})
+
+    pusher.cancel()
+    return ws
+
+
+def make_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/spot/v1/symbols", symbols)
+    app.router.add_get("/spot/quote/v1/kline", klines)
+    app.router.add_get("/spot/quote/v1/ticker/24hr", tickers)
+    app.router.add_get("/spot/v1/time", server_time)
+    app.router.add_get("/spot/quote/ws/v2", stream)
+    return app
+
+
+async def start(port: int = 0) -> tuple[web.AppRunner, str]:
+    """Starts the fake server on the running loop.
+
+    Returns
+    -------
+    tuple[web.AppRunner, str]
+        Runner to clean up with and the base url to point clients at.
+    """
+    runner = web.AppRunner(make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    web.run_app(make_app(), host="127.0.0.1", port=port)
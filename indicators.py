@@ -0,0 +1,378 @@
+"""Technical indicators kept up to date as candles close.
+
+Each (pair, interval, indicator) has a state that is initialized once with
+vectorized NumPy or pandas code over every cached candle, after which every
+newly closed candle is folded in with O(1) work. The still open newest candle
+is evaluated against the state without changing it, so it can move freely
+until it closes.
+
+Indicators are named by spec strings: sma20, ema50, rsi14, bb20 and vwap.
+"""
+
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from itertools import islice
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from candle_cache import INTERVAL_MS
+from candles import DAY_MS, Candles, bucket_starts
+
+DEFAULT_PERIODS = {"sma": 20, "ema": 20, "rsi": 14, "bb": 20, "vwap": 0}
+MIN_PERIOD = 2
+MAX_PERIOD = 500
+MAX_INDICATORS = 5
+
+# Bollinger band width in standard deviations.
+BB_WIDTH = 2
+
+SPEC_REGEX = re.compile(r"^(sma|ema|rsi|bb|vwap)(\d{0,3})$", re.IGNORECASE)
+
+
+def parse(token: str) -> Optional[str]:
+    """Returns the spec a word asks for. ie EMA -> ema20, None if it is no indicator."""
+    if not (match := SPEC_REGEX.match(token)):
+        return None
+
+    name = match[1].lower()
+    if name == "vwap":
+        return name
+
+    period = int(match[2]) if match[2] else DEFAULT_PERIODS[name]
+    if not MIN_PERIOD <= period <= MAX_PERIOD:
+        return None
+    return f"{name}{period}"
+
+
+def split(spec: str) -> tuple:
+    """Name and period of a spec. ie ema20 -> ("ema", 20), vwap has period 0."""
+    name = spec.rstrip("0123456789")
+    return name, int(spec[len(name) :] or 0)
+
+
+def title(spec: str) -> str:
+    """Display name of a spec. ie ema20 -> EMA 20"""
+    name, period = split(spec)
+    return f"{name.upper()} {period}" if period else name.upper()
+
+
+def panel(label: str) -> int:
+    """0 for indicators drawn over the price, 1 for ones with their own scale."""
+    return 1 if label.startswith("rsi") else 0
+
+
+class Indicator(ABC):
+    """
+    State of one indicator over the closed candles of one pair and interval.
+
+    Subclasses implement init, which computes every value at once, and step,
+    which computes the values of one more candle and keeps the new state only
+    when commit is set.
+    """
+
+    __slots__ = ("period", "interval", "time", "history", "lock")
+
+    lines = ("",)
+
+    def __init__(self, period: int, interval: str, maxlen: int) -> None:
+        self.period = period
+        self.interval = interval
+        self.time = None  # Start of the newest candle folded in
+        self.history = deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def init(self, candles: Candles) -> np.ndarray:
+        """Resets the state to these closed candles, returns a (lines, n) array."""
+
+    @abstractmethod
+    def step(
+        self, t: int, high: float, low: float, close: float, volume: float, commit: bool
+    ) -> tuple:
+        """Values for one more candle, kept in the state when commit is set."""
+
+    def load(self, candles: Candles) -> None:
+        self.history.clear()
+        if len(candles):
+            self.history.extend(map(tuple, self.init(candles).T.tolist()))
+            self.time = int(candles.time[-1])
+        else:
+            self.time = None
+
+    def fold(self, candles: Candles, start: int, stop: int, commit: bool) -> list:
+        time, values = candles.time, candles.values
+        return [
+            self.step(int(time[i]), *values[1:, i].tolist(), commit=commit)
+            for i in range(start, stop)
+        ]
+
+
+def _rolling_sum(x: np.ndarray, n: int) -> np.ndarray:
+    out = np.full(len(x), np.nan)
+    if len(x) >= n:
+        out[n - 1 :] = np.convolve(x, np.ones(n), "valid")
+    return out
+
+
+def _ewm(x: np.ndarray, alpha: float) -> np.ndarray:
+    # The recurrence does not vectorize in NumPy, pandas runs it in C.
+    return pd.Series(x).ewm(alpha=alpha, adjust=False).mean().to_numpy(copy=True)
+
+
+class SMA(Indicator):
+    __slots__ = ("window", "total")
+
+    def init(self, candles: Candles) -> np.ndarray:
+        close = candles.close
+        self.window = deque(close[-self.period :].tolist(), maxlen=self.period)
+        self.total = float(np.sum(self.window))
+        return (_rolling_sum(close, self.period) / self.period)[np.newaxis]
+
+    def step(self, t, high, low, close, volume, commit):
+        full = len(self.window) == self.period
+        ready = full or len(self.window) + 1 == self.period
+        total = self.total + close - (self.window[0] if full else 0)
+        if commit:
+            self.window.append(close)
+            self.total = total
+        return (total / self.period if ready else np.nan,)
+
+
+class EMA(Indicator):
+    __slots__ = ("value", "count")
+
+    def init(self, candles: Candles) -> np.ndarray:
+        out = _ewm(candles.close, 2 / (self.period + 1))
+        self.value, self.count = float(out[-1]), len(out)
+        out[: self.period - 1] = np.nan
+        return out[np.newaxis]
+
+    def step(self, t, high, low, close, volume, commit):
+        value = self.value + 2 / (self.period + 1) * (close - self.value)
+        count = self.count + 1
+        if commit:
+            self.value, self.count = value, count
+        return (value if count >= self.period else np.nan,)
+
+
+class RSI(Indicator):
+    """Wilder's relative strength index."""
+
+    __slots__ = ("close", "gain", "loss", "count")
+
+    @staticmethod
+    def _rsi(gain, loss):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+
+    def init(self, candles: Candles) -> np.ndarray:
+        close = candles.close
+        change = np.diff(close, prepend=close[0])
+        gain = _ewm(np.maximum(change, 0), 1 / self.period)
+        loss = _ewm(np.maximum(-change, 0), 1 / self.period)
+        self.close, self.count = float(close[-1]), len(close)
+        self.gain, self.loss = float(gain[-1]), float(loss[-1])
+
+        out = self._rsi(gain, loss)
+        out[: self.period] = np.nan
+        return out[np.newaxis]
+
+    def step(self, t, high, low, close, volume, commit):
+        change = close - self.close
+        gain = self.gain + (max(change, 0) - self.gain) / self.period
+        loss = self.loss + (max(-change, 0) - self.loss) / self.period
+        count = self.count + 1
+        if commit:
+            self.close, self.gain, self.loss, self.count = close, gain, loss, count
+        return (float(self._rsi(gain, loss)) if count > self.period else np.nan,)
+
+
+class Bollinger(Indicator):
+    """Simple moving average with bands BB_WIDTH population deviations away."""
+
+    __slots__ = ("window", "total", "squares")
+
+    lines = ("", ".upper", ".lower")
+
+    def init(self, candles: Candles) -> np.ndarray:
+        close, n = candles.close, self.period
+        self.window = deque(close[-n:].tolist(), maxlen=n)
+        self.total = float(np.sum(self.window))
+        self.squares = float(np.sum(np.square(self.window)))
+
+        mean = _rolling_sum(close, n) / n
+        std = np.sqrt(np.maximum(_rolling_sum(close * close, n) / n - mean**2, 0))
+        return np.array([mean, mean + BB_WIDTH * std, mean - BB_WIDTH * std])
+
+    def step(self, t, high, low, close, volume, commit):
+        n = self.period
+        full = len(self.window) == n
+        ready = full or len(self.window) + 1 == n
+        old = self.window[0] if full else 0
+        total = self.total + close - old
+        squares = self.squares + close * close - old * old
+        if commit:
+            self.window.append(close)
+            self.total, self.squares = total, squares
+
+        if not ready:
+            return (np.nan,) * 3
+
+        mean = total / n
+        std = max(squares / n - mean * mean, 0) ** 0.5
+        return mean, mean + BB_WIDTH * std, mean - BB_WIDTH * std
+
+
+def sessions(time: np.ndarray, interval: str) -> np.ndarray:
+    """Start of the VWAP session each candle is in: the UTC day for intraday
+    candles, the calendar month for daily and the calendar year for longer ones."""
+    if INTERVAL_MS[interval] < DAY_MS:
+        return bucket_starts(time, "1d")
+    if interval == "1d":
+        return bucket_starts(time, "1M")
+    years = time.astype("datetime64[ms]").astype("datetime64[Y]")
+    return years.astype("datetime64[ms]").astype(np.int64)
+
+
+class VWAP(Indicator):
+    """Volume weighted average price, restarted every session."""
+
+    __slots__ = ("session", "price_volume", "volume")
+
+    def init(self, candles: Candles) -> np.ndarray:
+        starts = sessions(candles.time, self.interval)
+        typical = (candles.high + candles.low + candles.close) / 3
+        price_volume = np.cumsum(typical * candles.volume)
+        volume = np.cumsum(candles.volume)
+
+        # Subtract the running totals each session started from.
+        first = np.flatnonzero(np.diff(starts, prepend=starts[0] - 1))
+        lengths = np.diff(np.append(first, len(starts)))
+        price_volume -= np.repeat(np.append(0, price_volume)[first], lengths)
+        volume -= np.repeat(np.append(0, volume)[first], lengths)
+
+        self.session = int(starts[-1])
+        self.price_volume, self.volume = float(price_volume[-1]), float(volume[-1])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(volume > 0, price_volume / volume, typical)[np.newaxis]
+
+    def step(self, t, high, low, close, volume, commit):
+        session = int(sessions(np.array([t], dtype=np.int64), self.interval)[0])
+        typical = (high + low + close) / 3
+        if session != self.session:
+            price_volume, total = typical * volume, volume
+        else:
+            price_volume = self.price_volume + typical * volume
+            total = self.volume + volume
+        if commit:
+            self.session, self.price_volume, self.volume = session, price_volume, total
+        return (price_volume / total if total > 0 else typical,)
+
+
+INDICATORS = {"sma": SMA, "ema": EMA, "rsi": RSI, "bb": Bollinger, "vwap": VWAP}
+
+
+class IndicatorEngine:
+    """
+    Indicator states per (pair, interval, spec), shared by every chart and
+    price request.
+    """
+
+    def __init__(self, maxlen: int = 1000) -> None:
+        """
+        Parameters
+        ----------
+        maxlen : int
+            Values kept per indicator, matches the candle caches length.
+        """
+        self.maxlen = maxlen
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state(self, pair: str, interval: str, spec: str) -> Indicator:
+        key = (pair, interval, spec)
+        with self._lock:
+            if (state := self._states.get(key)) is None:
+                name, period = split(spec)
+                state = self._states[key] = INDICATORS[name](
+                    period, interval, self.maxlen
+                )
+            return state
+
+    def compute(
+        self,
+        pair: str,
+        interval: str,
+        candles: Candles,
+        specs: list,
+        n: Optional[int] = None,
+    ) -> dict:
+        """Values of each indicator for the newest n candles.
+
+        Only candles closed since the last call are folded into the states,
+        the newest candle is taken to be still open and is never kept.
+
+        Parameters
+        ----------
+        pair : str
+            API pair name. ie BTCUSDT
+
+        interval : str
+            Candle interval. ie 1h
+
+        candles : Candles
+            Every candle available, oldest first, more history warms the
+            indicators up better.
+
+        specs : list
+            Indicator specs. ie ["ema20", "rsi14"]
+
+        n : Optional[int]
+            Newest values returned per indicator, all of them when None.
+
+        Returns
+        -------
+        dict
+            Label to float64 array. Bollinger bands add .upper and .lower labels.
+        """
+        out = {}
+        if len(candles) < 2:
+            return out
+
+        closed = len(candles) - 1
+        n = min(n or len(candles), len(candles))
+
+        for spec in specs:
+            state = self._state(pair, interval, spec)
+            with state.lock:
+                start = 0
+                if state.time is not None:
+                    start = int(np.searchsorted(candles.time, state.time, "right"))
+
+                # Start over when the candles no longer line up with the state or
+                # reach further back than it does.
+                if (
+                    not 0 < start <= closed
+                    or candles.time[start - 1] != state.time
+                    or len(state.history) < min(n - 1, start)
+                ):
+                    state.load(candles.head(closed))
+                else:
+                    state.history.extend(
+                        state.fold(candles, start, closed, commit=True)
+                    )
+                    state.time = int(candles.time[closed - 1])
+
+                live = state.fold(candles, closed, closed + 1, commit=False)
+                rows = list(islice(reversed(state.history), n - 1))[::-1]
+
+            values = np.array(rows + live, dtype=np.float64).T
+            for suffix, line in zip(state.lines, values):
+                out[spec + suffix] = line
+
+        return out
@@ -0,0 +1,279 @@
+"""Live ticker and candle state fed by the ByBit spot WebSocket.
+
+Only the most requested pairs are streamed. Popularity is counted from the
+requests handlers make and the subscriptions are rebalanced periodically.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from logging import debug, info, warning
+from typing import Callable, Optional
+
+import aiohttp
+
+from candle_cache import INTERVAL_MS
+
+BYBIT_WS_ENDPOINT = os.environ.get(
+    "BYBIT_WS_ENDPOINT", "wss://stream.bybit.com/spot/quote/ws/v2"
+)
+STREAM_SYMBOLS = int(os.environ.get("STREAM_SYMBOLS", 20))
+
+
+class MarketStream:
+    """
+    Keeps the last price, 24h stats and the current candle of popular pairs in
+    memory, updated from the WebSocket as trades happen.
+
+    Topics are (pair, None) for the 24h ticker and (pair, interval) for klines.
+    """
+
+    def __init__(
+        self,
+        backfill: Callable[[str, str], list],
+        url: str = BYBIT_WS_ENDPOINT,
+        max_topics: int = STREAM_SYMBOLS,
+        rebalance_every: float = 30,
+        max_age: float = 10,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        backfill : Callable[[str, str], list]
+            Fetches klines for (pair, interval) over REST, fills gaps after reconnects.
+
+        url : str
+            WebSocket endpoint, point it at fake_bybit.py for offline testing.
+
+        max_topics : int
+            Most ticker and kline topics streamed at once.
+
+        rebalance_every : float
+            Seconds between recomputing which topics are popular enough to stream.
+
+        max_age : float
+            Seconds after which streamed state is no longer served.
+        """
+        self.backfill = backfill
+        self.url = url
+        self.max_topics = max_topics
+        self.rebalance_every = rebalance_every
+        self.max_age = max_age
+
+        self.tickers = {}
+        self.candles = {}
+        self.popularity = Counter()
+        self.subscribed = set()
+        self.reconnects = 0
+        self.listeners = []
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, listener: Callable[[str, dict], None]) -> None:
+        """Calls listener(pair, ticker) for every streamed 24h ticker update."""
+        self.listeners.append(listener)
+
+    def record(self, pair: str, interval: Optional[str] = None) -> None:
+        """Counts a request for a pair, or a pairs klines when interval is given."""
+        with self._lock:
+            self.popularity[(pair, interval)] += 1
+
+    def ticker(self, pair: str) -> Optional[dict]:
+        """Returns the live 24h ticker for a pair, shaped like the REST ticker."""
+        data = self.tickers.get(pair)
+        if data and time.time() - data["received"] <= self.max_age:
+            return data
+        return None
+
+    def candle(self, pair: str, interval: str) -> Optional[list]:
+        """Returns the live candle for a pair as a raw kline row."""
+        row = self.candles.get((pair, interval))
+        if row and time.time() - row[-1] <= self.max_age:
+            return row[:-1]
+        return None
+
+    def _wanted(self) -> set:
+        with self._lock:
+            wanted = {t for t, _ in self.popularity.most_common(self.max_topics)}
+            # Halve the counts so popularity follows what is being asked for now.
+            self.popularity = Counter(
+                {t: count // 2 for t, count in self.popularity.items() if count > 1}
+            )
+        return wanted
+
+    @staticmethod
+    def _message(topic: tuple, event: str) -> dict:
+        pair, interval = topic
+        if interval is None:
+            return {
+                "topic": "realtimes",
+                "event": event,
+                "params": {"symbol": pair, "binary": False},
+            }
+        return {
+            "topic": "kline",
+            "event": event,
+            "params": {"symbol": pair, "klineType": interval, "binary": False},
+        }
+
+    async def _rebalance(self, ws: aiohttp.ClientWebSocketResponse, keep: set) -> set:
+        """Subscribes to the most popular topics and returns the newly added ones.
+
+        Topics in keep stay subscribed while there is room, so quiet periods do
+        not drop every subscription.
+        """
+        wanted = self._wanted()
+        for topic in keep:
+            if len(wanted) >= self.max_topics:
+                break
+            wanted.add(topic)
+
+        for topic in self.subscribed - wanted:
+            await ws.send_json(self._message(topic, "cancel"))
+            self.candles.pop(topic, None)
+            if topic[1] is None:
+                self.tickers.pop(topic[0], None)
+        for topic in wanted - self.subscribed:
+            await ws.send_json(self._message(topic, "sub"))
+
+        added = wanted - self.subscribed
+        if added or self.subscribed - wanted:
+            info(f"Streaming {len(wanted)} topics, {len(added)} added.")
+        self.subscribed = wanted
+        return added
+
+    async def _resync(self, topics: set) -> None:
+        """Fetches klines over REST for topics that may have missed updates."""
+        loop = asyncio.get_running_loop()
+        for pair, interval in topics:
+            if interval is None:
+                continue
+            try:
+                rows = await loop.run_in_executor(None, self.backfill, pair, interval)
+            except Exception as e:
+                warning(f"Backfilling {pair} {interval} failed: {e}")
+                continue
+            if rows:
+                self.candles[(pair, interval)] = list(rows[-1]) + [time.time()]
+
+    def _handle(self, msg: dict) -> None:
+        if "data" not in msg:
+            debug(f"Stream message: {msg}")
+            return
+
+        received = time.time()
+        items = msg["data"] if isinstance(msg["data"], list) else [msg["data"]]
+
+        if msg.get("topic") == "realtimes":
+            for d in items:
+                self.tickers[d["s"]] = {
+                    "lastPrice": float(d["c"]),
+                    "openPrice": float(d["o"]),
+                    "highPrice": float(d["h"]),
+                    "lowPrice": float(d["l"]),
+                    "volume": float(d["v"]),
+                    "quoteVolume": float(d["qv"]),
+                    "received": received,
+                }
+                for listener in self.listeners:
+                    try:
+                        listener(d["s"], self.tickers[d["s"]])
+                    except Exception as e:
+                        warning(f"Market stream listener failed: {e}")
+
+        elif msg.get("topic") == "kline":
+            interval = msg["params"]["klineType"]
+            for d in items:
+                start = int(d["t"])
+                self.candles[(d["s"], interval)] = [
+                    start,
+                    d["o"],
+                    d["h"],
+                    d["l"],
+                    d["c"],
+                    d["v"],
+                    start + INTERVAL_MS[interval] - 1,
+                    "0",
+                    0,
+                    "0",
+                    "0",
+                    received,
+                ]
+
+    async def _connection(self, session: aiohttp.ClientSession) -> None:
+        loop = asyncio.get_running_loop()
+
+        async with session.ws_connect(self.url) as ws:
+            info(f"Connected to {self.url}")
+            # Everything is resubscribed and backfilled after a reconnect.
+            previous, self.subscribed = self.subscribed, set()
+            await self._resync(await self._rebalance(ws, previous))
+
+            next_rebalance = loop.time() + self.rebalance_every
+            next_ping = loop.time()
+            while not self._stop.is_set():
+                now = loop.time()
+                if now >= next_rebalance:
+                    await self._resync(await self._rebalance(ws, self.subscribed))
+                    next_rebalance = now + self.rebalance_every
+                if now >= next_ping:
+                    await ws.send_json({"ping": int(time.time() * 1000)})
+                    next_ping = now + 20
+
+                try:
+                    msg = await ws.receive(timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    # One bad frame must not end the stream.
+                    try:
+                        self._handle(json.loads(msg.data))
+                    except Exception as e:
+                        warning(f"Skipped stream message {msg.data[:200]!r}: {e!r}")
+                elif msg.type in (
+                    aiohttp.WSMsgType.CLOSE,
+                    aiohttp.WSMsgType.CLOSED,
+                    aiohttp.WSMsgType.ERROR,
+                ):
+                    break
+
+    async def _run(self) -> None:
+        backoff = 1
+        async with aiohttp.ClientSession() as session:
+            while not self._stop.is_set():
+                started = time.time()
+                try:
+                    await self._connection(session)
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    warning(f"Market stream disconnected: {e}")
+                except Exception:
+                    # Anything else would end the thread and streaming for good.
+                    logging.exception("Market stream failed, reconnecting")
+
+                if self._stop.is_set():
+                    break
+
+                backoff = 1 if time.time() - started > 60 else min(backoff * 2, 60)
+                self.reconnects += 1
+                await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+
+    def start(self) -> None:
+        """Runs the stream on its own event loop in a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=lambda: asyncio.run(self._run()),
+                name="market-stream",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
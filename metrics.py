@@ -0,0 +1,305 @@
+"""Process wide counters, gauges and latency histograms.
+
+Everything registered here is served in the Prometheus text format on
+METRICS_PORT, and a short summary is included in /status.
+"""
+
+import asyncio
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import info, warning
+from typing import Callable, Optional
+
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108))  # 0 disables the exporter
+
+# Seconds, from a cached reply to a slow chart render.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in list(self.values.items()):
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Gauge:
+    """Value read from a callback each time metrics are collected."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]) -> None:
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            warning(f"Gauge {self.name} failed: {e}")
+            return
+        yield self.name, "", value
+
+
+class _Series:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self, buckets: int) -> None:
+        self.counts = [0] * (buckets + 1)  # Last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram:
+    """Bucketed distribution per label set."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if (series := self.series.get(labels)) is None:
+                series = self.series[labels] = _Series(len(self.buckets))
+            series.counts[i] += 1
+            series.count += 1
+            series.sum += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observes the seconds spent inside the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def percentile(self, q: float, *labels) -> float:
+        """Upper bound of the bucket holding the q quantile, inf past the last one."""
+        if (series := self.series.get(labels)) is None or not series.count:
+            return 0.0
+        rank = q * series.count
+        seen = 0
+        for bound, count in zip(self.buckets, series.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        for labels, series in list(self.series.items()):
+            seen = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series.counts):
+                seen += count
+                le = _labels(self.labels + ("le",), labels + (bound,))
+                yield self.name + "_bucket", le, seen
+            label = _labels(self.labels, labels)
+            yield self.name + "_count", label, series.count
+            yield self.name + "_sum", label, series.sum
+
+
+class Registry:
+    """
+    Named metrics of one process. Registering a name twice returns the metric
+    registered first, so modules can declare what they use independently.
+    """
+
+    def __init__(self) -> None:
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(
+        self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS
+    ) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> Gauge:
+        """Registers fn as the source of a gauge, replacing any earlier one."""
+        gauge = Gauge(name, help, fn)
+        with self._lock:
+            self.metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram(
+    "bot_handler_seconds", "Time spent handling a command.", ("handler",)
+)
+handler_errors = registry.counter(
+    "bot_handler_errors_total", "Commands that raised.", ("handler",)
+)
+upstream_seconds = registry.histogram(
+    "upstream_request_seconds",
+    "Latency of exchange API calls.",
+    ("provider", "path"),
+)
+upstream_errors = registry.counter(
+    "upstream_errors_total",
+    "Exchange API calls that failed or were retried.",
+    ("provider", "path"),
+)
+render_seconds = registry.histogram(
+    "chart_render_seconds", "Chart drawing time in the render workers."
+)
+render_wait_seconds = registry.histogram(
+    "chart_render_queue_seconds", "Time charts waited for a render worker."
+)
+stage_seconds = registry.histogram(
+    "chart_stage_seconds", "Time spent per chart command stage.", ("stage",)
+)
+
+
+def timed(name: str):
+    """Decorator recording a handlers latency and errors, sync or async."""
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    handler_errors.inc(name)
+                    raise
+                finally:
+                    handler_seconds.observe(time.perf_counter() - start, name)
+
+        else:
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                except Exception:
+                    handler_errors.inc(name)
+                    raise
+                finally:
+                    handler_seconds.observe(time.perf_counter() - start, name)
+
+        return wrapper
+
+    return decorator
+
+
+def hit_ratio(cache) -> float:
+    """Hit ratio of anything with hits and misses counters."""
+    total = cache.hits + cache.misses
+    return cache.hits / total if total else 0.0
+
+
+def summary() -> str:
+    """Human readable handler latencies for /status."""
+    lines = []
+    for (handler,), series in sorted(handler_seconds.series.items()):
+        errors = handler_errors.values.get((handler,), 0)
+        lines.append(
+            f"/{handler}: {series.count} calls, {errors:.0f} errors, "
+            f"p50 <{handler_seconds.percentile(0.5, handler) * 1000:.0f}ms, "
+            f"p95 <{handler_seconds.percentile(0.95, handler) * 1000:.0f}ms"
+        )
+    for stage in ("data", "render", "upload"):
+        if (stage,) in stage_seconds.series:
+            lines.append(
+                f"chart {stage}: p95 <"
+                f"{stage_seconds.percentile(0.95, stage) * 1000:.0f}ms"
+            )
+    # Registered by the scheduler module when it is in use.
+    if (waits := registry.metrics.get("scheduler_queue_seconds")) is not None:
+        for (priority,), series in sorted(waits.series.items()):
+            lines.append(
+                f"{priority} queue wait: {series.count} jobs, p95 <"
+                f"{waits.percentile(0.95, priority) * 1000:.0f}ms"
+            )
+    return "\n        ".join(lines) or "No commands handled yet."
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(
+    port: int = METRICS_PORT, host: str = METRICS_HOST
+) -> Optional[ThreadingHTTPServer]:
+    """Serves /metrics from a daemon thread, returns None when port is 0."""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        warning(f"Metrics exporter could not bind {host}:{port}: {e}")
+        return None
+
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
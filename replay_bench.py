@@ -0,0 +1,422 @@
+"""Offline replay benchmark of the full command pipeline.
+
+ByBit shaped responses are replayed from fixtures/bybit, no network is used.
+The committed fixtures are synthetic, generated by fake_bybit.py, so they
+exercise the pipeline and its timings but not the parsing of real payloads.
+Run record to replace them with live responses. Each stage reports
+p50/p95/p99 latency, throughput and peak traced memory and the results are
+written as JSON so releases can be compared.
+
+    python replay_bench.py run [--out results.json] [--compare baseline.json]
+    python replay_bench.py record       # replace the fixtures with live responses
+    python replay_bench.py synthesize   # longer intervals from the base fixtures
+    python replay_bench.py verify-resample --live
+
+verify-resample --live is the acceptance check for resampling, it compares
+against the candles ByBit returns for each interval. Without --live it runs
+against the synthesized fixtures, which are totalled from the same base
+candles the resampler reads. That only shows the two implementations agree
+and is not authoritative.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "bybit")
+
+# Keep the benchmark away from the real data directory.
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="replay_bench_"))
+os.environ["CANDLE_STORE"] = os.path.join(os.environ["DATA_DIR"], "candles")
+
+from candle_cache import INTERVAL_MS  # noqa: E402
+
+MESSAGES = [
+    "/p btc",
+    "/p btc eth sol",
+    "/c eth 1h",
+    "/c btc 1d please",
+    "/p what is going on with sol and doge today, also ada",
+]
+
+# Typed after the bots username, including half typed and misspelt symbols.
+INLINE_QUERIES = ["", "b", "bt", "eth", "solx", "do"]
+
+
+def load(name: str) -> dict:
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+
+class ReplaySession:
+    """
+    Serves the fixture responses through the BybitHTTP interface.
+
+    Kline timestamps are shifted so the newest fixture candle is the one
+    currently open, which keeps cache expiry behaving as it would live.
+    """
+
+    def __init__(self, latency: float = 0, shift: bool = True) -> None:
+        """
+        Parameters
+        ----------
+        latency : float
+            Seconds slept per call to stand in for the network round trip.
+
+        shift : bool
+            Move kline timestamps to the present, off keeps them as stored.
+        """
+        self.latency = latency
+        self.calls = 0
+        self.symbols = load("symbols.json")
+        self.tickers = load("ticker_24hr.json")
+        self.klines = {}
+
+        for name in os.listdir(FIXTURES):
+            if name.startswith("kline_"):
+                _, pair, interval = name[:-5].split("_")
+                rows = load(name)["result"]
+                interval_ms = INTERVAL_MS[interval]
+                now = int(time.time() * 1000) // interval_ms * interval_ms
+                offset = now - rows[-1][0] if shift else 0
+                self.klines[(pair, interval)] = [
+                    [row[0] + offset, *row[1:6], row[6] + offset, *row[7:]]
+                    for row in rows
+                ]
+
+    def _call(self, result) -> dict:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return {"ret_code": 0, "ret_msg": "", "result": result}
+
+    def query_symbol(self) -> dict:
+        return self._call(self.symbols["result"])
+
+    def query_kline(self, symbol: str, interval: str, startTime: int = 0, **_) -> dict:
+        rows = self.klines.get((symbol, interval), [])
+        return self._call([row for row in rows if row[0] >= startTime][-1000:])
+
+    def latest_information_for_symbol(self, symbol: str = None, **_) -> dict:
+        tickers = self.tickers["result"]
+        if symbol is None:
+            return self._call(tickers)
+        return self._call(next((t for t in tickers if t["symbol"] == symbol), {}))
+
+    def server_time(self) -> dict:
+        return self._call({"serverTime": int(time.time() * 1000)})
+
+
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def measure(fn, iterations: int) -> dict:
+    """Runs fn iterations times and summarizes latency, throughput and memory."""
+    fn()  # Warm up imports and lazily built state.
+
+    latencies = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "throughput_per_s": iterations / total,
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def run(iterations: int, latency: float) -> dict:
+    from bybit_Crypto import BybitCrypto
+    from symbol_router import Router
+
+    session = ReplaySession(latency)
+    BybitCrypto.session = session
+
+    # No CoinGecko fixtures, inline search runs on the ByBit symbols alone.
+    router = Router(aliases=False)
+    router.crypto.tickers.refresh()
+    crypto = router.crypto
+    btc = router.find_symbols("btc")[0]
+    majors = router.find_symbols("btc eth sol")
+
+    def cold_chart():
+        crypto.candle_cache.clear()
+        crypto.chart_reply(btc, "1h")
+
+    stages = {
+        "find_symbols": lambda: [router.find_symbols(m) for m in MESSAGES],
+        "find_chart_interval": lambda: [
+            router.find_chart_interval(m) for m in MESSAGES if m.startswith("/c")
+        ],
+        "chart_reply_cold": cold_chart,
+        "chart_reply_warm": lambda: crypto.chart_reply(btc, "1h"),
+        "stat_reply": lambda: crypto.stat_reply(btc),
+        "stat_reply_multi": lambda: router.stat_reply(majors),
+        "inline_query": lambda: [router.search.answer(q) for q in INLINE_QUERIES],
+    }
+
+    results = {}
+    for name, fn in stages.items():
+        before = session.calls
+        results[name] = measure(fn, iterations)
+        results[name]["upstream_calls"] = session.calls - before
+        print_stage(name, results[name])
+
+    try:
+        from chart_renderer import ChartRenderer
+    except ImportError as e:
+        print(f"Skipping render stage: {e}")
+    else:
+        renderer = ChartRenderer(workers=1)
+        renderer.warm()
+        candles = crypto.chart_reply(btc, "1h")
+        results["render"] = measure(
+            lambda: renderer.render(candles, title="\nBTC"), max(1, iterations // 50)
+        )
+        renderer.shutdown()
+        print_stage("render", results["render"])
+
+    return results
+
+
+def print_stage(name: str, r: dict) -> None:
+    print(
+        f"{name:<20} p50 {r['p50_ms']:9.3f}ms  p95 {r['p95_ms']:9.3f}ms  "
+        f"p99 {r['p99_ms']:9.3f}ms  {r['throughput_per_s']:10.1f}/s  "
+        f"peak {r['peak_memory_kb']:9.1f}KB"
+    )
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def compare(results: dict, baseline_path: str, tolerance: float) -> bool:
+    """Prints p95 changes against a baseline, returns False if any regressed."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["stages"]
+
+    ok = True
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["p95_ms"], r["p95_ms"]
+        change = (after - before) / before if before else 0
+        flag = "REGRESSION" if change > tolerance else "ok"
+        ok &= flag == "ok"
+        print(
+            f"{name:<20} p95 {before:9.3f}ms -> {after:9.3f}ms ({change:+.0%}) {flag}"
+        )
+    return ok
+
+
+def verify_resample(session, pairs=("BTCUSDT", "ETHUSDT", "SOLUSDT")) -> bool:
+    """Checks locally resampled candles against the ones ByBit returns.
+
+    Every candle both have, except the still open newest one, must match.
+    Intervals without responses are skipped, but at least one must be compared.
+    Only a live session checks against real exchange candles.
+    """
+    import numpy as np
+
+    from candles import RESAMPLE_FROM, Candles
+
+    ok = True
+    compared = 0
+    for pair in pairs:
+        for interval, base in RESAMPLE_FROM.items():
+            native = session.query_kline(symbol=pair, interval=interval, limit=1000)
+            rows = session.query_kline(symbol=pair, interval=base, limit=1000)
+            if not native["result"] or not rows["result"]:
+                print(f"{pair} {interval}: no data, skipped")
+                continue
+
+            expected = Candles.from_klines(native["result"])
+            resampled = Candles.from_klines(rows["result"]).resample(interval)
+            common, e, r = np.intersect1d(
+                expected.time[:-1], resampled.time[:-1], return_indices=True
+            )
+            if not len(common):
+                print(f"{pair} {interval}: no overlapping candles, skipped")
+                continue
+
+            match = np.allclose(
+                expected.values[:, e], resampled.values[:, r], rtol=1e-9, atol=1e-9
+            )
+            ok &= match
+            compared += 1
+            result = "ok" if match else "DIFFER"
+            print(f"{pair} {interval}: {len(common)} candles {result}")
+
+    if not compared:
+        print("No interval had candles to compare.")
+    return ok and compared > 0
+
+
+def aggregate(rows: list, interval: str) -> list:
+    """Kline rows of a longer interval, totalled row by row from base rows.
+
+    Written without candles.py so the fixtures it makes check resample
+    independently. A leading bucket the rows only partly cover is dropped.
+    """
+    interval_ms = INTERVAL_MS[interval]
+    # ByBit weeks start Monday 00:00 UTC, the epoch was a Thursday.
+    anchor = 4 * 86_400_000 if interval == "1w" else 0
+
+    buckets = {}
+    for row in sorted(rows, key=lambda row: row[0]):
+        start = row[0] - (row[0] - anchor) % interval_ms
+        buckets.setdefault(start, []).append(row)
+
+    out = []
+    for start, group in buckets.items():
+        if not out and group[0][0] != start:
+            continue
+        # open, high, low, close, volume, quote volume, trades, taker volumes
+        f = [[float(x) for x in row[1:6] + row[7:]] for row in group]
+        out.append(
+            [
+                start,
+                f"{f[0][0]:.4f}",
+                f"{max(r[1] for r in f):.4f}",
+                f"{min(r[2] for r in f):.4f}",
+                f"{f[-1][3]:.4f}",
+                f"{sum(r[4] for r in f):.4f}",
+                start + interval_ms - 1,
+                f"{sum(r[5] for r in f):.4f}",
+                int(sum(r[6] for r in f)),
+                f"{sum(r[7] for r in f):.4f}",
+                f"{sum(r[8] for r in f):.4f}",
+            ]
+        )
+    return out
+
+
+def synthesize() -> None:
+    """Writes native interval fixtures totalled from the base interval ones.
+
+    The fixtures are synthetic, so there are no real native candles to pair
+    with them. Run record instead to compare against responses from ByBit.
+    """
+    from candles import RESAMPLE_FROM
+
+    for name in sorted(os.listdir(FIXTURES)):
+        if not name.startswith("kline_"):
+            continue
+        _, pair, base = name[:-5].split("_")
+        for interval, source in RESAMPLE_FROM.items():
+            if source != base:
+                continue
+            response = load(name)
+            response["result"] = aggregate(response["result"], interval)
+            out = f"kline_{pair}_{interval}.json"
+            with open(os.path.join(FIXTURES, out), "w") as f:
+                json.dump(response, f)
+            print(f"Wrote {out}")
+
+
+def record() -> None:
+    """Saves live ByBit responses over the fixtures."""
+    from bybit_http import BybitHTTP
+    from candles import RESAMPLE_FROM
+
+    session = BybitHTTP()
+    responses = {
+        "symbols.json": session.query_symbol(),
+        "ticker_24hr.json": session.latest_information_for_symbol(),
+    }
+    for base in ("BTC", "ETH", "SOL"):
+        for interval in ("1h", "1d", *RESAMPLE_FROM):
+            responses[f"kline_{base}USDT_{interval}.json"] = session.query_kline(
+                symbol=base + "USDT", interval=interval, limit=1000
+            )
+
+    for name, data in responses.items():
+        with open(os.path.join(FIXTURES, name), "w") as f:
+            json.dump(data, f)
+        print(f"Recorded {name}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "command",
+        choices=["run", "record", "synthesize", "verify-resample"],
+        nargs="?",
+        default="run",
+    )
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="Verify against the API, the offline check is not authoritative",
+    )
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Simulated seconds per upstream call"
+    )
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="Earlier results file to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record()
+        return
+
+    if args.command == "synthesize":
+        synthesize()
+        return
+
+    if args.command == "verify-resample":
+        if args.live:
+            from bybit_http import BybitHTTP
+
+            session = BybitHTTP()
+        else:
+            print(
+                "Offline self-check against synthesized fixtures, not authoritative."
+                " Run with --live to compare against ByBit's candles."
+            )
+            session = ReplaySession(shift=False)
+        sys.exit(0 if verify_resample(session) else 1)
+
+    results = run(args.iterations, args.latency)
+    with open(args.out, "w") as f:
+        json.dump({"meta": metadata(), "stages": results}, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
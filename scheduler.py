@@ -0,0 +1,305 @@
+"""Priority classes and admission control for command handlers.
+
+Cheap text replies and heavy chart renders run on separate workers, so a
+burst of charts from some chats can never hold up /p, /help or /status in
+others. Jobs of one chat run one at a time in the order they were submitted,
+whatever their class, so a chat is still answered in order. Jobs wait in
+their chat's lane up to a limit per chat, every user can only have a few
+jobs queued or running per class, and once a class's queue is full new jobs
+are refused straight away instead of waiting.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from metrics import registry
+
+CHEAP = "cheap"
+HEAVY = "heavy"
+
+SCHED_CHEAP_WORKERS = int(os.environ.get("SCHED_CHEAP_WORKERS", 8))
+SCHED_HEAVY_WORKERS = int(os.environ.get("SCHED_HEAVY_WORKERS", 4))
+SCHED_QUEUE_DEPTH = int(os.environ.get("SCHED_QUEUE_DEPTH", 64))
+SCHED_PER_CHAT = int(os.environ.get("SCHED_PER_CHAT", 32))
+SCHED_PER_USER = int(os.environ.get("SCHED_PER_USER", 2))
+
+BUSY_MESSAGE = (
+    "I'm busy with a lot of requests right now, please try again in a moment."
+)
+
+queue_seconds = registry.histogram(
+    "scheduler_queue_seconds", "Time jobs waited for a worker.", ("priority",)
+)
+rejected = registry.counter(
+    "scheduler_rejected_total",
+    "Jobs refused by admission control.",
+    ("priority", "reason"),
+)
+
+
+class Busy(Exception):
+    """Raised when a job is refused, the reason is its argument."""
+
+
+class Admission:
+    """
+    Counts queued and running jobs per class, chat and user and refuses the
+    ones over their limits. The chat limit counts the jobs of every class.
+    """
+
+    def __init__(
+        self,
+        queue_depth: int = SCHED_QUEUE_DEPTH,
+        per_chat: int = SCHED_PER_CHAT,
+        per_user: int = SCHED_PER_USER,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        queue_depth : int
+            Jobs of one class queued or running at once.
+
+        per_chat : int
+            Jobs a chat can have waiting in its lane or running.
+
+        per_user : int
+            Jobs of one class a user can have queued or running.
+        """
+        self.queue_depth = queue_depth
+        self.per_chat = per_chat
+        self.per_user = per_user
+        self.jobs = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(priority: str, chat: Optional[int], user: Optional[int]) -> list:
+        return [(priority,), ("chat", chat), (priority, "user", user)]
+
+    def admit(self, priority: str, chat: Optional[int], user: Optional[int]) -> None:
+        """Reserves a slot for a job, raising Busy when it is over a limit."""
+        keys = self._keys(priority, chat, user)
+        limits = [self.queue_depth, self.per_chat, self.per_user]
+
+        with self._lock:
+            for key, limit, reason in zip(keys, limits, ("queue", "chat", "user")):
+                if key[-1] is not None and self.jobs[key] >= limit:
+                    rejected.inc(priority, reason)
+                    raise Busy(reason)
+            for key in keys:
+                self.jobs[key] += 1
+
+    def release(self, priority: str, chat: Optional[int], user: Optional[int]) -> None:
+        with self._lock:
+            for key in self._keys(priority, chat, user):
+                self.jobs[key] -= 1
+                if self.jobs[key] <= 0:
+                    del self.jobs[key]
+
+    def pending(self, priority: str) -> int:
+        return self.jobs[(priority,)]
+
+
+class Scheduler:
+    """
+    Worker threads per priority class, fed from bounded queues. A job only
+    enters its class queue once the previous job of its chat has finished.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[dict] = None,
+        admission: Optional[Admission] = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        workers : dict, optional
+            Worker threads per priority class.
+
+        admission : Admission, optional
+            Limits applied before a job is queued.
+        """
+        workers = workers or {CHEAP: SCHED_CHEAP_WORKERS, HEAVY: SCHED_HEAVY_WORKERS}
+        self.admission = admission or Admission()
+        self.queues = {priority: queue.Queue() for priority in workers}
+        self._lanes = {}  # chat -> jobs waiting behind the one queued or running
+        self._lock = threading.Lock()
+
+        for priority, count in workers.items():
+            registry.gauge(
+                f"scheduler_{priority}_pending",
+                f"{priority.capitalize()} jobs queued or running.",
+                lambda priority=priority: self.admission.pending(priority),
+            )
+            for i in range(count):
+                threading.Thread(
+                    target=self._work,
+                    args=(priority,),
+                    name=f"{priority}-{i}",
+                    daemon=True,
+                ).start()
+
+    def _enqueue(self, job: tuple) -> None:
+        """Queues a job now, or behind the unfinished job of its chat."""
+        chat = job[2]
+        with self._lock:
+            if chat is not None:
+                if (lane := self._lanes.get(chat)) is not None:
+                    lane.append(job)
+                    return
+                self._lanes[chat] = deque()
+        self.queues[job[0]].put(job)
+
+    def _next(self, chat: Optional[int]) -> None:
+        """Queues the next job of a chat once its previous one finished."""
+        if chat is None:
+            return
+        with self._lock:
+            if not (lane := self._lanes[chat]):
+                del self._lanes[chat]
+                return
+            job = lane.popleft()
+        self.queues[job[0]].put(job)
+
+    def _work(self, priority: str) -> None:
+        jobs = self.queues[priority]
+        while True:
+            _, submitted, chat, user, future, fn, args, kwargs = jobs.get()
+            queue_seconds.observe(time.perf_counter() - submitted, priority)
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                self.admission.release(priority, chat, user)
+                self._next(chat)
+
+    def submit(
+        self,
+        priority: str,
+        chat: Optional[int],
+        user: Optional[int],
+        fn: Callable,
+        *args,
+        **kwargs,
+    ) -> Future:
+        """Queues fn(*args, **kwargs) on the workers of a priority class, after
+        every job submitted earlier for the same chat.
+
+        Parameters
+        ----------
+        priority : str
+            CHEAP or HEAVY.
+
+        chat : Optional[int]
+            Chat the job answers, None skips the chat lane and limit.
+
+        user : Optional[int]
+            User that asked, None skips the per user limit.
+
+        fn : Callable
+            Function to run.
+
+        Returns
+        -------
+        Future
+            Resolves to what fn returns.
+
+        Raises
+        ------
+        Busy
+            If the job is over one of the admission limits.
+        """
+        self.admission.admit(priority, chat, user)
+        future = Future()
+        self._enqueue(
+            (priority, time.perf_counter(), chat, user, future, fn, args, kwargs)
+        )
+        return future
+
+
+class AsyncScheduler:
+    """
+    Async version of Scheduler, each class runs at most its worker count of
+    jobs concurrently on the event loop. Jobs of one chat take turns on a
+    lock, which wakes its waiters in the order they arrived.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[dict] = None,
+        admission: Optional[Admission] = None,
+    ) -> None:
+        self.workers = workers or {
+            CHEAP: SCHED_CHEAP_WORKERS,
+            HEAVY: SCHED_HEAVY_WORKERS,
+        }
+        self.admission = admission or Admission()
+        self._slots = {}
+        self._lanes = {}  # chat -> [lock, jobs holding or waiting for it]
+
+        for priority in self.workers:
+            registry.gauge(
+                f"scheduler_{priority}_pending",
+                f"{priority.capitalize()} jobs queued or running.",
+                lambda priority=priority: self.admission.pending(priority),
+            )
+
+    @asynccontextmanager
+    async def _lane(self, chat: Optional[int]):
+        """Holds the chat's lock, jobs without a chat run straight away."""
+        if chat is None:
+            yield
+            return
+
+        if (lane := self._lanes.get(chat)) is None:
+            lane = self._lanes[chat] = [asyncio.Lock(), 0]
+        lane[1] += 1
+        try:
+            async with lane[0]:
+                yield
+        finally:
+            lane[1] -= 1
+            if not lane[1]:
+                del self._lanes[chat]
+
+    async def run(
+        self,
+        priority: str,
+        chat: Optional[int],
+        user: Optional[int],
+        fn: Callable,
+        *args,
+        **kwargs,
+    ):
+        """Awaits fn(*args, **kwargs) once the earlier jobs of its chat are done
+        and a slot of its class is free.
+
+        Raises
+        ------
+        Busy
+            If the job is over one of the admission limits.
+        """
+        self.admission.admit(priority, chat, user)
+        try:
+            # Created lazily so they belong to the running loop.
+            if (slots := self._slots.get(priority)) is None:
+                slots = self._slots[priority] = asyncio.Semaphore(
+                    self.workers[priority]
+                )
+
+            submitted = time.perf_counter()
+            async with self._lane(chat), slots:
+                queue_seconds.observe(time.perf_counter() - submitted, priority)
+                return await fn(*args, **kwargs)
+        finally:
+            self.admission.release(priority, chat, user)
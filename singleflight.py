@@ -0,0 +1,92 @@
+"""Collapses identical concurrent calls into a single execution."""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    While a call for a key is running, every other caller with the same key
+    waits for it and receives its result (or exception) instead of making the
+    call again. Nothing is cached once the call returns.
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0  # Calls that actually ran
+        self.collapsed = 0  # Calls that waited on another one instead
+
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._aflights = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """Runs fn(*args, **kwargs) unless a call for key is already running.
+
+        Parameters
+        ----------
+        key : Hashable
+            Identifies identical calls. ie ("chart", "BTC", "1h")
+
+        fn : Callable
+            Function to run.
+
+        Returns
+        -------
+            Whatever fn returned for the caller that ran it.
+        """
+        with self._lock:
+            if (flight := self._flights.get(key)) is not None:
+                self.collapsed += 1
+                leader = False
+            else:
+                flight = self._flights[key] = Future()
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            return flight.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    async def ado(self, key: Hashable, fn: Callable[..., Awaitable], *args, **kwargs):
+        """Async version of do, fn is a coroutine function."""
+        if (flight := self._aflights.get(key)) is not None:
+            self.collapsed += 1
+            return await asyncio.shield(flight)
+
+        flight = self._aflights[key] = asyncio.get_running_loop().create_future()
+        self.calls += 1
+
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            flight.set_exception(e)
+            # Mark retrieved so waiterless failures are not reported as unhandled.
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._aflights[key]
+
+    def stats(self) -> str:
+        """Human readable coalescing counters."""
+        total = self.calls + self.collapsed
+        ratio = self.collapsed / total * 100 if total else 0
+        return (
+            f"Request coalescing: {self.calls} upstream calls, "
+            f"{self.collapsed} collapsed ({ratio:.1f}%)."
+        )
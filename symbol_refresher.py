@@ -0,0 +1,193 @@
+"""Background refresh of a provider's symbol list.
+
+The listing is rebuilt on its own thread or task and swapped in as one
+reference assignment, so a message never waits on a symbol download. Only
+symbols that were added or delisted since the previous refresh are passed on
+to the caches that depend on them.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from logging import info, warning
+from typing import Awaitable, Callable, Iterable
+
+from metrics import registry
+
+SYMBOL_REFRESH = float(os.environ.get("SYMBOL_REFRESH", 24 * 60 * 60))
+
+refresh_seconds = registry.histogram(
+    "symbol_refresh_seconds", "Time taken to refresh a symbol list.", ("provider",)
+)
+changes = registry.counter(
+    "symbol_changes_total",
+    "Symbols added or delisted by refreshes.",
+    ("provider", "change"),
+)
+
+Listener = Callable[[frozenset, frozenset], None]
+
+
+class SymbolRefresher:
+    """
+    Periodically calls a providers refresh function and reports what changed.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        refresh: Callable[[], Iterable],
+        interval: float = SYMBOL_REFRESH,
+        jobs: Iterable[Callable[[], None]] = (),
+    ) -> None:
+        """
+        Parameters
+        ----------
+        provider : str
+            Name used in logs and metrics. ie bybit
+
+        refresh : Callable[[], Iterable]
+            Rebuilds and swaps in the providers listing, returns the symbols
+            now listed.
+
+        interval : float
+            Seconds between refreshes.
+
+        jobs : Iterable[Callable[[], None]]
+            Maintenance run after every periodic refresh. ie cache purges
+        """
+        self.provider = provider
+        self._refresh = refresh
+        self.interval = interval
+        self.jobs = list(jobs)
+        self.listeners = []
+
+        self.symbols = frozenset()
+        self.duration = None
+        self.updated = 0.0
+
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, listener: Listener) -> None:
+        """Calls listener(added, removed) after refreshes that changed the listing."""
+        self.listeners.append(listener)
+
+    def reset(self, symbols: Iterable) -> None:
+        """Sets the listing the next refresh is compared against."""
+        self.symbols = frozenset(symbols)
+
+    def _finish(self, symbols: Iterable, started: float) -> None:
+        self.duration = time.perf_counter() - started
+        self.updated = time.time()
+        refresh_seconds.observe(self.duration, self.provider)
+
+        old, self.symbols = self.symbols, frozenset(symbols)
+        added, removed = self.symbols - old, old - self.symbols
+        # The first listing has nothing to be compared against.
+        if not old or not (added or removed):
+            return
+
+        changes.inc(self.provider, "added", amount=len(added))
+        changes.inc(self.provider, "removed", amount=len(removed))
+        info(f"{self.provider} listed {len(added)} and delisted {len(removed)} symbols")
+
+        for listener in self.listeners:
+            try:
+                listener(added, removed)
+            except Exception as e:
+                warning(f"{self.provider} symbol change listener failed: {e}")
+
+    def refresh(self) -> None:
+        """Refreshes the listing now, on the calling thread."""
+        started = time.perf_counter()
+        self._finish(self._refresh(), started)
+
+    async def arefresh(self, refresh: Callable[[], Awaitable[Iterable]]) -> None:
+        """Async version of refresh, refresh is a coroutine function."""
+        started = time.perf_counter()
+        self._finish(await refresh(), started)
+
+    def _run_jobs(self) -> None:
+        for job in self.jobs:
+            try:
+                job()
+            except Exception as e:
+                warning(f"{self.provider} maintenance job failed: {e}")
+
+    def _tick(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            warning(f"{self.provider} symbol list refresh failed: {e}")
+
+    def _run(self, immediate: bool) -> None:
+        if immediate:
+            self._tick()
+        while not self._stop.wait(self.interval):
+            self._tick()
+            self._run_jobs()
+
+    def start(self, immediate: bool = False) -> None:
+        """Starts refreshing in a daemon thread.
+
+        Parameters
+        ----------
+        immediate : bool
+            Refresh straight away instead of after the first interval, for
+            listings loaded from a snapshot.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(immediate,),
+                name=f"{self.provider}-symbols",
+                daemon=True,
+            )
+            self._thread.start()
+
+    async def _atick(self, refresh: Callable[[], Awaitable[Iterable]]) -> None:
+        try:
+            await self.arefresh(refresh)
+        except Exception as e:
+            warning(f"{self.provider} symbol list refresh failed: {e}")
+
+    async def _arun(
+        self, refresh: Callable[[], Awaitable[Iterable]], immediate: bool
+    ) -> None:
+        if immediate:
+            await self._atick(refresh)
+        while not self._stop.is_set():
+            await asyncio.sleep(self.interval)
+            await self._atick(refresh)
+            # Jobs may touch files, keep them off the event loop.
+            await asyncio.get_running_loop().run_in_executor(None, self._run_jobs)
+
+    def start_async(
+        self, refresh: Callable[[], Awaitable[Iterable]], immediate: bool = False
+    ) -> asyncio.Task:
+        """Starts refreshing in a task on the running event loop.
+
+        Parameters
+        ----------
+        refresh : Callable[[], Awaitable[Iterable]]
+            Coroutine function used instead of the sync refresh function.
+
+        immediate : bool
+            Refresh straight away instead of after the first interval.
+        """
+        return asyncio.create_task(self._arun(refresh, immediate))
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> str:
+        """Human readable size and age of the listing."""
+        if self.duration is None:
+            return f"{self.provider} symbols: {len(self.symbols)}, not refreshed yet."
+        age = (time.time() - self.updated) / 60
+        return (
+            f"{self.provider} symbols: {len(self.symbols)}, refreshed {age:.0f} "
+            f"minutes ago in {self.duration:.2f} seconds."
+        )
@@ -0,0 +1,108 @@
+"""Precomputed lookup structures for the symbols a provider supports."""
+
+from typing import Iterable, Optional
+
+from Symbol import Coin
+
+
+class _TrieNode:
+    __slots__ = ("children", "coin")
+
+    def __init__(self) -> None:
+        self.children = {}
+        self.coin = None
+
+
+class SymbolRegistry:
+    """
+    Case-folded index of every Coin a provider can quote.
+
+    Built once per symbol list refresh so that handlers never have to touch
+    pandas to identify a symbol. Exact lookups are a single dict probe and
+    prefix lookups walk a trie of the same Coin instances. Coins are interned,
+    so a symbol keeps its instance across refreshes.
+    """
+
+    def __init__(self, symbols: Iterable[str], quote: str = "USDT") -> None:
+        """Builds the registry.
+
+        Parameters
+        ----------
+        symbols : Iterable[str]
+            Base currencies as returned by the provider. ie BTC, ETH
+
+        quote : str
+            Currency the symbols are priced in. ie USDT
+        """
+        self._by_key = {}
+        self._root = _TrieNode()
+
+        for symbol in symbols:
+            key = symbol.casefold()
+            if key in self._by_key:
+                continue
+
+            coin = Coin.intern(symbol, quote)
+            self._by_key[key] = coin
+
+            node = self._root
+            for char in key:
+                node = node.children.setdefault(char, _TrieNode())
+            node.coin = coin
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol.casefold() in self._by_key
+
+    def __iter__(self):
+        return iter(self._by_key.values())
+
+    def get(self, symbol: str) -> Optional[Coin]:
+        """Returns the Coin for a symbol, ignoring case.
+
+        Parameters
+        ----------
+        symbol : str
+            Symbol as typed by the user. ie btc or Btc
+
+        Returns
+        -------
+        Optional[Coin]
+            Shared Coin instance or None if the symbol is not listed.
+        """
+        return self._by_key.get(symbol.casefold())
+
+    def prefix(self, text: str, limit: int = 10) -> list[Coin]:
+        """Returns Coins whose symbol starts with text, shortest symbols first.
+
+        Parameters
+        ----------
+        text : str
+            Partially typed symbol.
+
+        limit : int
+            Maximum number of Coins returned.
+
+        Returns
+        -------
+        list[Coin]
+        """
+        node = self._root
+        for char in text.casefold():
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        found = []
+        level = [node]
+        while level and len(found) < limit:
+            next_level = []
+            for node in level:
+                if node.coin is not None:
+                    found.append(node.coin)
+                next_level.extend(node.children[c] for c in sorted(node.children))
+            level = next_level
+
+        return found[:limit]
@@ -1,26 +1,77 @@
 """Function that routes symbols to the correct API provider.
 """
 
+import asyncio
 import datetime
 import logging
+import os
 import random
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeout
 from logging import critical, debug, error, info, warning
+from typing import AsyncIterator, Iterator, Optional
 
-import pandas as pd
-import schedule
 from cachetools import TTLCache, cached
 
+import alerts
+from alerts import AlertEngine, TooManyAlerts
 from bybit_Crypto import BybitCrypto
+from cache_backend import CacheBackend, default_backend
+from candles import Candles
+import indicators
+from cg_Crypto import cg_Crypto
+from singleflight import SingleFlight
+from symbol_search import SymbolSearch
+from upstream import upstream
+import watchlists
+from watchlists import Watchlists
 from Symbol import Coin, Symbol
 
+STAT_WORKERS = int(os.environ.get("STAT_WORKERS", 8))
+STAT_DEADLINE = float(os.environ.get("STAT_DEADLINE", 8))
+
 
 class Router:
     CRYPTO_REGEX = r"([a-zA-Z]{2,20})"
     FREQ_REGEX = r"([\d]{1,2}[\w]{1})"
 
-    def __init__(self):
-        self.crypto = BybitCrypto()
+    def __init__(
+        self, aclient=None, cache: Optional[CacheBackend] = None, aliases: bool = True
+    ):
+        # Shared with other replicas when CACHE_BACKEND is sqlite.
+        self.cache = cache if cache is not None else default_backend()
+        self.crypto = BybitCrypto(aclient, self.cache)
+        # Inline queries also match CoinGecko coin names, loaded off the startup path.
+        self.coingecko = None
+        if aliases:
+            threading.Thread(target=self._load_coingecko, daemon=True).start()
+        self.search = SymbolSearch(
+            self.crypto, lambda: self.coingecko and self.coingecko.aliases
+        )
+        # Identical concurrent chart and stat requests share one upstream call.
+        self.flights = SingleFlight()
+        # Symbols of a multi symbol /p are looked up concurrently, bounded here.
+        self.pool = ThreadPoolExecutor(STAT_WORKERS, thread_name_prefix="stats")
+        # Price alerts are checked on every ticker refresh and streamed ticker,
+        # they are loaded by the bot once it can send them, see AlertEngine.load.
+        self.alerts = AlertEngine(quote=self.crypto.vs_currency)
+        self.crypto.tickers.subscribe(self.alerts.check)
+        if self.crypto.stream is not None:
+            self.crypto.stream.subscribe(self.alerts.on_ticker)
+        # Quoted from the ticker snapshot in one lookup, see watchlist_reply.
+        self.watchlists = Watchlists()
+
+    def _load_coingecko(self) -> None:
+        try:
+            self.coingecko = cg_Crypto(self.cache)
+        except Exception as e:
+            warning(f"CoinGecko coin names unavailable for inline search: {e}")
+
+    async def astart(self) -> None:
+        """Loads provider data through the async client, see BybitCrypto.astart."""
+        await self.crypto.astart()
 
     def find_symbols(self, text: str) -> list[Symbol]:
         """Finds stock tickers starting with a dollar sign, and cryptocurrencies with two dollar signs
@@ -36,26 +87,44 @@ class Router:
         list[Symbol]
             List of stock symbols as Symbol objects
         """
-        schedule.run_pending()
-
         symbols = []
 
+        registry = self.crypto.registry
+
         coins = set(re.findall(self.CRYPTO_REGEX, text))
         for coin in coins:
-            sym = self.crypto.symbol_list[
-                self.crypto.symbol_list["baseCurrency"].str.fullmatch(
-                    coin.upper(), case=False
-                )
-            ]
-            if ~sym.empty:
-                symbols.append(Coin(sym))
+            if sym := registry.get(coin):
+                symbols.append(sym)
             else:
                 info(f"{coin} is not in list of coins")
         if symbols:
             info(symbols)
             return symbols
 
-    def find_chart_interval(self, text: str) -> str:
+    def find_indicators(self, text: str) -> tuple[tuple[str, ...], str]:
+        """Finds indicator names such as ema20 or rsi in a blob of text.
+
+        Parameters
+        ----------
+        text : str
+            Blob of text.
+
+        Returns
+        -------
+        tuple[tuple[str, ...], str]
+            Up to MAX_INDICATORS indicator specs, and the text without them so
+            they are not mistaken for symbols or intervals.
+        """
+        specs, words = [], []
+        for word in text.split():
+            if not indicators.SPEC_REGEX.match(word):
+                words.append(word)
+            elif (spec := indicators.parse(word)) is not None and spec not in specs:
+                specs.append(spec)
+
+        return tuple(specs[: indicators.MAX_INDICATORS]), " ".join(words)
+
+    def find_chart_interval(self, text: str, default: Optional[str] = None) -> str:
         """
 
 
@@ -64,6 +133,9 @@ class Router:
         text : str
             Blob of text.
 
+        default : Optional[str]
+            Returned when the text has no interval at all.
+
         Returns
         -------
         list[Symbol]
@@ -72,7 +144,11 @@ class Router:
         """
         frequency_list = ['1m', '3m', '5m', '15m', '30m', '1h', '2h', '4h', '6h', '12h', '1d', '1w', '1M']
 
-        frequency = max(set(re.findall(self.FREQ_REGEX, text)))
+        frequencies = set(re.findall(self.FREQ_REGEX, text))
+        if not frequencies and default is not None:
+            return default
+
+        frequency = max(frequencies)
 
         ######################
 
@@ -94,15 +170,47 @@ class Router:
         Bot Status:
         {bot_resp}
 
+        {self.flights.stats()}
+        {self.crypto.refresher.stats()}
+        {self.alerts.stats()}
+        {self.watchlists.stats()}
+
         Cryptocurrency Data:
         {self.crypto.status()}
+
+        Upstream Latency:
+        {upstream.summary()}
+        """
+
+        warning(stats)
+
+        return stats
+
+    async def astatus(self, bot_resp) -> str:
+        """Async version of status."""
+        stats = f"""
+        Bot Status:
+        {bot_resp}
+
+        {self.flights.stats()}
+        {self.crypto.refresher.stats()}
+        {self.alerts.stats()}
+        {self.watchlists.stats()}
+
+        Cryptocurrency Data:
+        {await self.crypto.astatus()}
+
+        Upstream Latency:
+        {upstream.summary()}
         """
 
         warning(stats)
 
         return stats
 
-    def chart_reply(self, symbol: Symbol, freq: str) -> pd.DataFrame:
+    def chart_reply(
+        self, symbol: Symbol, freq: str, indicators: tuple[str, ...] = ()
+    ) -> Candles:
         """Returns price data for a symbol of the past month up until the previous trading days close.
         Also caches multiple requests made in the same day.
 
@@ -114,40 +222,295 @@ class Router:
         freq: str
             Chart frequency
 
+        indicators: tuple[str, ...]
+            Indicator specs attached to the candles, see find_indicators.
+
         Returns
         -------
-        pd.DataFrame
-            Returns a timeseries dataframe with high, low, and volume data if its available.
-                Otherwise returns empty pd.DataFrame.
+        Candles
+            Returns columnar candle data if its available.
+                Otherwise returns empty Candles.
         """
 
         if isinstance(symbol, Coin):
-            return self.crypto.chart_reply(symbol, freq)
+            return self.flights.do(
+                ("chart", symbol.symbol, freq, indicators),
+                self.crypto.chart_reply,
+                symbol,
+                freq,
+                indicators,
+            )
         else:
             debug(f"{symbol} is not a Stock or Coin")
-            return pd.DataFrame()
+            return Candles.empty()
 
-    def stat_reply(self, symbols: list[Symbol]) -> list[str]:
-        """Gets key statistics for each symbol in the list
+    async def achart_reply(
+        self, symbol: Symbol, freq: str, indicators: tuple[str, ...] = ()
+    ) -> Candles:
+        """Async version of chart_reply."""
+        if isinstance(symbol, Coin):
+            return await self.flights.ado(
+                ("chart", symbol.symbol, freq, indicators),
+                self.crypto.achart_reply,
+                symbol,
+                freq,
+                indicators,
+            )
+        else:
+            debug(f"{symbol} is not a Stock or Coin")
+            return Candles.empty()
+
+    def _coins(self, symbols: list[Symbol]) -> list[Coin]:
+        coins = []
+        for symbol in symbols:
+            if isinstance(symbol, Coin):
+                coins.append(symbol)
+            else:
+                debug(f"{symbol} is not a Stock or Coin")
+        return coins
+
+    @staticmethod
+    def _stat_result(coin: Coin, future) -> str:
+        """Reply for a finished, failed or still running stat lookup."""
+        if not future.done():
+            return f"The price for {coin.symbol} is taking too long, please try again."
+        if (e := future.exception()) is not None:
+            warning(f"Stats for {coin.symbol} failed: {e}")
+            return (
+                f"The price for {coin.symbol} is not available. "
+                "If you suspect this is an error run `/status`"
+            )
+        return future.result()
+
+    def _submit_stats(self, coins: list[Coin], *indicators) -> dict:
+        return {
+            self.pool.submit(
+                self.flights.do,
+                ("stat", coin.symbol, *indicators),
+                self.crypto.stat_reply,
+                coin,
+                *indicators,
+            ): coin
+            for coin in coins
+        }
+
+    def stat_reply(
+        self,
+        symbols: list[Symbol],
+        deadline: float = STAT_DEADLINE,
+        indicators: tuple[str, ...] = (),
+        freq: str = "1h",
+    ) -> list[str]:
+        """Gets key statistics for each symbol in the list, looked up concurrently.
 
         Parameters
         ----------
         symbols : list[str]
             List of stock symbols
 
+        deadline : float
+            Seconds to wait for all symbols, slower ones get a try again reply.
+
+        indicators : tuple[str, ...]
+            Indicator specs whose latest values are quoted, see find_indicators.
+
+        freq : str
+            Candle interval the indicators are computed on.
+
         Returns
         -------
-        Dict[str, str]
-            Each symbol passed in is a key with its value being a human readable
-                formatted string of the symbols statistics.
+        list[str]
+            Human readable formatted statistics per symbol, in the order given.
         """
-        replies = []
+        futures = self._submit_stats(self._coins(symbols), indicators, freq)
+        wait(futures, timeout=deadline)
+
+        return [self._stat_result(coin, future) for future, coin in futures.items()]
+
+    def iter_stat_replies(
+        self,
+        symbols: list[Symbol],
+        deadline: float = STAT_DEADLINE,
+        indicators: tuple[str, ...] = (),
+        freq: str = "1h",
+    ) -> Iterator[str]:
+        """Same as stat_reply but yields each reply as soon as it is ready."""
+        futures = self._submit_stats(self._coins(symbols), indicators, freq)
+        sent = set()
+
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                sent.add(future)
+                yield self._stat_result(futures[future], future)
+        except FuturesTimeout:
+            for future, coin in futures.items():
+                if future not in sent:
+                    yield self._stat_result(coin, future)
+
+    def _create_stat_tasks(self, coins: list[Coin], *indicators) -> dict:
+        slots = asyncio.Semaphore(STAT_WORKERS)
+
+        async def stat(coin: Coin) -> str:
+            async with slots:
+                return await self.flights.ado(
+                    ("stat", coin.symbol, *indicators),
+                    self.crypto.astat_reply,
+                    coin,
+                    *indicators,
+                )
 
-        for symbol in symbols:
+        tasks = {}
+        for coin in coins:
+            task = asyncio.create_task(stat(coin))
+            # Lookups past the deadline keep running to warm the caches.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            tasks[task] = coin
+        return tasks
+
+    async def astat_reply(
+        self,
+        symbols: list[Symbol],
+        deadline: float = STAT_DEADLINE,
+        indicators: tuple[str, ...] = (),
+        freq: str = "1h",
+    ) -> list[str]:
+        """Async version of stat_reply."""
+        coins = self._coins(symbols)
+        if not (tasks := self._create_stat_tasks(coins, indicators, freq)):
+            return []
+
+        await asyncio.wait(tasks, timeout=deadline)
+
+        return [self._stat_result(coin, task) for task, coin in tasks.items()]
+
+    async def aiter_stat_replies(
+        self,
+        symbols: list[Symbol],
+        deadline: float = STAT_DEADLINE,
+        indicators: tuple[str, ...] = (),
+        freq: str = "1h",
+    ) -> AsyncIterator[str]:
+        """Async version of iter_stat_replies."""
+        tasks = self._create_stat_tasks(self._coins(symbols), indicators, freq)
+        loop = asyncio.get_running_loop()
+        end = loop.time() + deadline
+        pending = set(tasks)
+
+        while pending and (left := end - loop.time()) > 0:
+            done, pending = await asyncio.wait(
+                pending, timeout=left, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield self._stat_result(tasks[task], task)
+
+        for task in pending:
+            yield self._stat_result(tasks[task], task)
+
+    def alert_reply(self, chat: int, text: str) -> Optional[str]:
+        """Sets, lists or removes the price alerts of a chat.
 
-            if isinstance(symbol, Coin):
-                replies.append(self.crypto.stat_reply(symbol))
-            else:
-                debug(f"{symbol} is not a Stock or Coin")
+        Parameters
+        ----------
+        chat : int
+            Chat the command was sent in.
+
+        text : str
+            Whole message. ie /alert btc > 70000, /alert or /alert del 1
+
+        Returns
+        -------
+        Optional[str]
+            Markdown reply, None when the help text should be sent instead.
+        """
+        words = text.split()[1:]
+        if not words:
+            if chat_alerts := self.alerts.alerts(chat):
+                return "Price alerts:\n" + "\n".join(map(str, chat_alerts))
+            return None
+
+        if words[0].lower() in ("del", "rm", "remove"):
+            numbers = [w.lstrip("#") for w in words[1:]]
+            removed = [self.alerts.remove(chat, int(n)) for n in numbers if n.isdigit()]
+            if removed := [alert for alert in removed if alert is not None]:
+                return "Removed " + ", ".join(map(str, removed))
+            return "No such alert, send /alert to list them."
+
+        if (rule := alerts.parse(" ".join(words))) is None:
+            return None
+
+        symbol, above, price = rule
+        if (coin := self.crypto.registry.get(symbol)) is None:
+            return f"{symbol.upper()} is not in list of coins."
+
+        last = self.crypto.tickers.value(coin.symbol, "lastPrice")
+        if above is None:
+            if last is None:
+                return f"Is that above or below? ie /alert {coin.symbol} > {price:g}"
+            above = price > last
+        elif last is not None and (last >= price if above else last <= price):
+            return (
+                f"{coin.symbol} is already {'above' if above else 'below'} "
+                f"{alerts.format_price(price)} at {alerts.format_price(last)}."
+            )
+
+        try:
+            alert = self.alerts.add(chat, coin.symbol, above, price)
+        except TooManyAlerts:
+            return (
+                f"This chat has {self.alerts.max_alerts} alerts already, "
+                "remove one with /alert del [number]."
+            )
+
+        now = f" Now {alerts.format_price(last)}." if last is not None else ""
+        return f"Alert {alert} set.{now}"
+
+    def watchlist_reply(self, chat: int, text: str) -> Optional[str]:
+        """Quotes, extends or shortens the watchlist of a chat.
+
+        The whole list is quoted from the ticker snapshot, so it costs no
+        upstream request however many symbols are on it.
 
-        return replies
+        Parameters
+        ----------
+        chat : int
+            Chat the command was sent in.
+
+        text : str
+            Whole message. ie /w, /w add btc eth or /w del eth
+
+        Returns
+        -------
+        Optional[str]
+            Markdown reply, None when the help text should be sent instead.
+        """
+        words = text.split()[1:]
+        action = words[0].lower() if words else ""
+
+        if action in ("add", "del", "rm", "remove"):
+            rest = " ".join(words[1:])
+            if not (coins := self.find_symbols(rest)):
+                return "No symbols or coins found."
+            # Listed in the order they were typed.
+            symbols = sorted(
+                (coin.symbol for coin in coins),
+                key=lambda symbol: rest.casefold().find(symbol.casefold()),
+            )
+
+            if action != "add":
+                if removed := self.watchlists.remove(chat, symbols):
+                    return f"Removed {', '.join(removed)} from the watchlist."
+                return "None of those are on the watchlist."
+
+            added = self.watchlists.add(chat, symbols)
+            listed = self.watchlists.get(chat)
+            reply = f"Added {', '.join(added)}." if added else ""
+            if any(symbol not in listed for symbol in symbols):
+                reply += f" The watchlist is full at {self.watchlists.max_symbols}."
+            return (reply or "Those are on the watchlist already.").strip()
+
+        if not (symbols := self.watchlists.get(chat)):
+            return None
+
+        if (rows := self.crypto.tickers.rows(symbols)) is None:
+            return "Prices are not available right now, please try again in a moment."
+        return watchlists.render(symbols, rows)
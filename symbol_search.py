@@ -0,0 +1,130 @@
+"""Prefix search over listed symbols and coin names, used by inline queries."""
+
+import bisect
+import os
+from typing import Callable, NamedTuple, Optional
+
+from Symbol import Coin
+
+INLINE_RESULTS = int(os.environ.get("INLINE_RESULTS", 10))
+
+# Sorts after every character, so key < prefix + LAST holds for every key
+# starting with prefix.
+LAST = "\U0010ffff"
+
+
+class InlineResult(NamedTuple):
+    id: str
+    title: str
+    description: str
+    text: str  # Markdown message sent when the result is picked
+
+
+class SymbolSearch:
+    """
+    Sorted index of every listed symbol and the names it is known by.
+
+    A query bisects the index for the keys starting with the typed text and
+    ranks the matching coins by 24h quote volume from the ticker snapshot.
+    Result text is formatted once per snapshot refresh, so answering a query
+    never calls upstream.
+    """
+
+    def __init__(self, crypto, aliases: Callable[[], Optional[dict]] = dict) -> None:
+        """
+        Parameters
+        ----------
+        crypto : BybitCrypto
+            Provides the symbol registry and the ticker snapshot.
+
+        aliases : Callable[[], Optional[dict]]
+            Returns lower case names mapped to tickers. ie bitcoin -> BTC
+        """
+        self.crypto = crypto
+        self.aliases = aliases
+        # (registry, aliases, keys, coins), rebuilt when either source is swapped.
+        self._index = (None, None, [], [])
+        # (snapshot time, {coin: InlineResult})
+        self._results = (None, {})
+
+    def _build(self) -> tuple:
+        registry, aliases = self.crypto.registry, self.aliases() or None
+        if self._index[0] is registry and self._index[1] is aliases:
+            return self._index
+
+        entries = {(coin.symbol.casefold(), coin) for coin in registry}
+        for alias, symbol in (aliases or {}).items():
+            if coin := registry.get(symbol):
+                entries.add((alias, coin))
+
+        entries = sorted(entries, key=lambda entry: entry[0])
+        self._index = (
+            registry,
+            aliases,
+            [key for key, _ in entries],
+            [coin for _, coin in entries],
+        )
+        return self._index
+
+    def search(self, text: str, limit: int = INLINE_RESULTS) -> list[Coin]:
+        """Returns coins whose symbol or name starts with text, busiest first.
+
+        Parameters
+        ----------
+        text : str
+            Partially typed symbol or name. ie bt or bitc
+
+        limit : int
+            Maximum number of coins returned.
+
+        Returns
+        -------
+        list[Coin]
+            An exact symbol match first, then by 24h quote volume.
+        """
+        _, _, keys, coins = self._build()
+        query = text.strip().casefold()
+
+        # Misspelt queries are shortened until something matches.
+        while True:
+            lo = bisect.bisect_left(keys, query)
+            hi = bisect.bisect_left(keys, query + LAST, lo)
+            if lo < hi or len(query) <= 1:
+                break
+            query = query[:-1]
+
+        volume = self.crypto.tickers.value
+        return sorted(
+            dict.fromkeys(coins[lo:hi]),
+            key=lambda coin: (
+                coin.symbol.casefold() != query,
+                -(volume(coin.symbol, "quoteVolume") or 0),
+            ),
+        )[:limit]
+
+    def result(self, coin: Coin) -> InlineResult:
+        """Inline result for a coin, cached until the ticker snapshot refreshes."""
+        updated, results = self._results
+        if updated != self.crypto.tickers.updated:
+            updated, results = self.crypto.tickers.updated, {}
+            self._results = (updated, results)
+
+        if (result := results.get(coin)) is None:
+            data = self.crypto.tickers.get(coin.symbol)
+            if data and data["openPrice"]:
+                change = (data["lastPrice"] / data["openPrice"] - 1) * 100
+                description = f"${data['lastPrice']:,.2f} ({change:+.2f}% 24h)"
+            else:
+                description = "No recent price"
+
+            result = results[coin] = InlineResult(
+                coin.pair,
+                coin.tag,
+                description,
+                self.crypto.format_stats(coin, data),
+            )
+        return result
+
+    def answer(self, text: str, limit: int = INLINE_RESULTS) -> list[InlineResult]:
+        """Inline results for a query, see search."""
+        return [self.result(coin) for coin in self.search(text, limit)]
@@ -12,6 +12,14 @@ tests = """
 /c eth
 /chart
 /c btc
+/c btc 1h ema20 rsi
+/p btc rsi ema50 4h
+/alert btc > 70000
+/alert
+/alert del 1
+/w add btc eth sol avax link
+/w
+/w del eth
 /help
 /start
 /""".split(
@@ -0,0 +1,201 @@
+"""Background refreshed 24h ticker table for every listed pair."""
+
+import asyncio
+import threading
+import time
+from logging import debug, warning
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class TickerSnapshot:
+    """
+    In memory copy of the all symbols 24h ticker endpoint.
+
+    One upstream call refreshes every pair, lookups afterwards are a dict probe
+    and a row read from a float64 array.
+    """
+
+    COLUMNS = [
+        "lastPrice",
+        "openPrice",
+        "highPrice",
+        "lowPrice",
+        "volume",
+        "quoteVolume",
+    ]
+
+    def __init__(
+        self,
+        fetch: Callable[[], list],
+        vs_currency: str,
+        interval: float = 5,
+        max_age: float = 30,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        fetch : Callable[[], list]
+            Returns the raw 24h ticker of every pair.
+
+        vs_currency : str
+            Quote currency, pairs quoted in anything else are dropped.
+
+        interval : float
+            Seconds between refreshes.
+
+        max_age : float
+            Seconds after which the snapshot is considered stale and not served.
+        """
+        self.fetch = fetch
+        self.vs_currency = vs_currency
+        self.interval = interval
+        self.max_age = max_age
+
+        self.table = pd.DataFrame(columns=self.COLUMNS, dtype=float)
+        self.updated = 0.0
+        self._state = ({}, self.table.to_numpy())
+        self.listeners = []
+
+        self._thread = None
+        self._stop = threading.Event()
+
+    def refresh(self) -> None:
+        """Replaces the snapshot with a fresh copy of the 24h ticker."""
+        self.load(self.fetch())
+
+    def load(self, data: list) -> None:
+        """Replaces the snapshot with raw 24h ticker data."""
+        if not data:
+            warning("24h ticker returned no data, keeping previous snapshot.")
+            return
+
+        df = pd.DataFrame(data)
+        df = df[df["symbol"].str.endswith(self.vs_currency)]
+        df.index = df["symbol"].str[: -len(self.vs_currency)].rename("baseCurrency")
+        df = df[self.COLUMNS].astype(float)
+
+        positions = {base: i for i, base in enumerate(df.index)}
+        values = df.to_numpy()
+
+        self._state = (positions, values)
+        self.table = df
+        self.updated = time.time()
+
+        debug(f"Ticker snapshot refreshed with {len(df)} pairs.")
+
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                warning(f"Ticker snapshot listener failed: {e}")
+
+    def subscribe(self, listener: Callable[["TickerSnapshot"], None]) -> None:
+        """Calls listener(snapshot) after every refresh."""
+        self.listeners.append(listener)
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.updated
+
+    def get(self, symbol: str) -> Optional[dict]:
+        """Returns the latest 24h ticker for a base currency.
+
+        Parameters
+        ----------
+        symbol : str
+            Base currency. ie BTC
+
+        Returns
+        -------
+        Optional[dict]
+            COLUMNS mapped to floats, None if the pair is unknown or the snapshot is stale.
+        """
+        if self.age > self.max_age:
+            return None
+
+        positions, values = self._state
+        if (pos := positions.get(symbol)) is None:
+            return None
+
+        return dict(zip(self.COLUMNS, values[pos].tolist()))
+
+    def value(self, symbol: str, column: str) -> Optional[float]:
+        """Returns one COLUMNS value of a base currency without building a dict.
+
+        Returns
+        -------
+        Optional[float]
+            None if the pair is unknown or the snapshot is stale.
+        """
+        if self.age > self.max_age:
+            return None
+
+        positions, values = self._state
+        if (pos := positions.get(symbol)) is None:
+            return None
+
+        return float(values[pos, self.COLUMNS.index(column)])
+
+    def rows(self, symbols: list) -> Optional[np.ndarray]:
+        """Returns the COLUMNS of many base currencies with one array lookup.
+
+        Parameters
+        ----------
+        symbols : list
+            Base currencies. ie ["BTC", "ETH"]
+
+        Returns
+        -------
+        Optional[np.ndarray]
+            One float64 row per symbol, NaN for unknown pairs. None if the
+            snapshot is stale.
+        """
+        if self.age > self.max_age:
+            return None
+
+        positions, values = self._state
+        index = np.array([positions.get(s, -1) for s in symbols], dtype=np.intp)
+        out = np.full((len(index), len(self.COLUMNS)), np.nan)
+        found = index >= 0
+        out[found] = values[index[found]]
+        return out
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                warning(f"Ticker snapshot refresh failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        """Starts refreshing the snapshot in a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="ticker-snapshot", daemon=True
+            )
+            self._thread.start()
+
+    async def _arun(self, fetch: Callable[[], Awaitable[list]]) -> None:
+        while not self._stop.is_set():
+            try:
+                self.load(await fetch())
+            except Exception as e:
+                warning(f"Ticker snapshot refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start_async(self, fetch: Callable[[], Awaitable[list]]) -> asyncio.Task:
+        """Starts refreshing the snapshot in a task on the running event loop.
+
+        Parameters
+        ----------
+        fetch : Callable[[], Awaitable[list]]
+            Coroutine function returning the raw 24h ticker of every pair.
+        """
+        return asyncio.create_task(self._arun(fetch))
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,245 @@
+"""Shared HTTP layer for every exchange the bot talks to.
+
+Each provider gets one pooled keep-alive session, a token bucket sized from
+the exchanges published limits and per endpoint latency stats. Only GETs are
+retried, with jittered exponential backoff.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from logging import warning
+from typing import NamedTuple, Optional
+
+import requests as r
+from requests.adapters import HTTPAdapter
+
+from metrics import upstream_errors, upstream_seconds
+
+
+class Provider(NamedTuple):
+    base_url: str
+    rate: float  # Request weight refilled per second
+    burst: float  # Bucket capacity
+    weights: dict  # path or path prefix ending in / -> weight, others weigh 1
+
+
+PROVIDERS = {
+    # Public spot endpoints are limited per IP to 50 requests per second. The
+    # spot v1 limits count requests, every public endpoint costs one.
+    "bybit": Provider(
+        os.environ.get("BYBIT_ENDPOINT", "https://api.bybit.com"),
+        rate=50,
+        burst=50,
+        weights={
+            "/spot/v1/symbols": 1,
+            "/spot/v1/time": 1,
+            "/spot/quote/v1/kline": 1,
+            "/spot/quote/v1/ticker/24hr": 1,
+        },
+    ),
+    # The free API allows 10-50 calls a minute depending on load, plan for the
+    # low end. Every call counts once against that, whatever the endpoint.
+    "coingecko": Provider(
+        "https://api.coingecko.com/api/v3",
+        rate=10 / 60,
+        burst=10,
+        weights={"/ping": 1, "/coins/": 1, "/simple/price": 1},
+    ),
+}
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. Callers reserve tokens up front and are told how
+    long to wait for them, so waiting never happens while holding the lock.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, weight: float = 1) -> float:
+        """Takes weight tokens and returns the seconds to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= weight
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, weight: float = 1) -> None:
+        if delay := self.reserve(weight):
+            time.sleep(delay)
+
+    async def aacquire(self, weight: float = 1) -> None:
+        if delay := self.reserve(weight):
+            await asyncio.sleep(delay)
+
+
+class EndpointStats:
+    __slots__ = ("calls", "errors", "latencies")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=1000)
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def backoff(attempt: int, base: float = 0.25, cap: float = 8) -> float:
+    """Full jitter exponential backoff in seconds for a zero based retry attempt."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class Upstream:
+    """
+    Entry point for outgoing exchange requests.
+    """
+
+    def __init__(self, providers: dict = PROVIDERS, pool_size: int = 20) -> None:
+        """
+        Parameters
+        ----------
+        providers : dict
+            Provider name to Provider config.
+
+        pool_size : int
+            Keep-alive connections kept per provider.
+        """
+        self.providers = providers
+        self.limiters = {
+            name: TokenBucket(p.rate, p.burst) for name, p in providers.items()
+        }
+        self.stats = {}
+
+        self._sessions = {}
+        self._pool_size = pool_size
+        self._lock = threading.Lock()
+
+    def session(self, provider: str) -> r.Session:
+        with self._lock:
+            if (session := self._sessions.get(provider)) is None:
+                session = self._sessions[provider] = r.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+            return session
+
+    def weight(self, provider: str, path: str) -> float:
+        weights = self.providers[provider].weights
+        if (weight := weights.get(path)) is not None:
+            return weight
+        # Paths with ids in them, ie /coins/bitcoin/ohlc, match by prefix.
+        for prefix, weight in weights.items():
+            if prefix.endswith("/") and path.startswith(prefix):
+                return weight
+        return 1
+
+    def url(self, provider: str, path: str) -> str:
+        return self.providers[provider].base_url + path
+
+    def record(self, provider: str, path: str, elapsed: float, ok: bool) -> None:
+        """Adds one call to the endpoints latency stats."""
+        key = (provider, path)
+        if (stats := self.stats.get(key)) is None:
+            with self._lock:
+                stats = self.stats.setdefault(key, EndpointStats())
+        stats.calls += 1
+        stats.latencies.append(elapsed)
+        upstream_seconds.observe(elapsed, provider, path)
+        if not ok:
+            stats.errors += 1
+            upstream_errors.inc(provider, path)
+
+    def get(
+        self,
+        provider: str,
+        path: str,
+        params: Optional[dict] = None,
+        timeout: float = 10,
+        retries: int = 3,
+    ) -> r.Response:
+        """Rate limited GET, retried on connection errors, 429 and 5xx responses.
+
+        Parameters
+        ----------
+        provider : str
+            Key of PROVIDERS. ie bybit
+
+        path : str
+            Endpoint path appended to the providers base url.
+
+        params : Optional[dict]
+            Query string.
+
+        timeout : float
+            Seconds per attempt.
+
+        retries : int
+            Additional attempts after the first one.
+
+        Returns
+        -------
+        r.Response
+            Last response received, status is not checked.
+
+        Raises
+        ------
+        r.exceptions.RequestException
+            If the last attempt failed without a response.
+        """
+        session = self.session(provider)
+        limiter = self.limiters[provider]
+        weight = self.weight(provider, path)
+
+        for attempt in range(retries + 1):
+            limiter.acquire(weight)
+            start = time.perf_counter()
+            try:
+                resp = session.get(
+                    self.url(provider, path), params=params, timeout=timeout
+                )
+            except (r.exceptions.ConnectionError, r.exceptions.Timeout) as e:
+                self.record(provider, path, time.perf_counter() - start, False)
+                if attempt == retries:
+                    raise
+                warning(f"{provider} {path} failed ({e}), retrying.")
+            else:
+                self.record(
+                    provider, path, time.perf_counter() - start, resp.status_code < 400
+                )
+                if resp.status_code not in RETRY_STATUS or attempt == retries:
+                    return resp
+                warning(f"{provider} {path} returned {resp.status_code}, retrying.")
+
+            time.sleep(backoff(attempt))
+
+    def summary(self) -> str:
+        """Human readable latency and error counts per endpoint."""
+        lines = []
+        for (provider, path), stats in sorted(self.stats.items()):
+            lines.append(
+                f"{provider} {path}: {stats.calls} calls, {stats.errors} errors, "
+                f"p50 {stats.percentile(0.5) * 1000:.0f}ms, "
+                f"p95 {stats.percentile(0.95) * 1000:.0f}ms"
+            )
+        return "\n        ".join(lines) or "No upstream calls yet."
+
+
+upstream = Upstream()
@@ -0,0 +1,222 @@
+"""Per chat watchlists, quoted together from the ticker snapshot.
+
+A watchlist is stored as small integer symbol ids. The ids index a symbol
+table file that is only ever appended to. Lists change through an append
+only file of fixed size records like the alert store, and a whole list is
+quoted from one bulk ticker lookup, so its length never adds upstream
+requests.
+"""
+
+import fcntl
+import os
+from contextlib import contextmanager
+from logging import info
+from typing import Iterable
+
+import numpy as np
+
+WATCHLIST_STORE = os.environ.get(
+    "WATCHLIST_STORE",
+    os.path.join(os.environ.get("DATA_DIR", "data"), "watchlists.bin"),
+)
+MAX_WATCHLIST = int(os.environ.get("MAX_WATCHLIST", 50))
+
+RECORD = np.dtype(
+    [
+        ("chat", "<i8"),
+        ("symbol", "<u4"),  # Line of the symbol table
+        ("live", "?"),  # False when the symbol was removed from the list
+    ]
+)
+
+
+def _price(price: float) -> str:
+    if price >= 1:
+        return f"{price:,.2f}"
+    return f"{price:.8f}".rstrip("0").rstrip(".")
+
+
+def _volume(volume: float) -> str:
+    for size, suffix in ((1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if volume >= size:
+            return f"{volume / size:.1f}{suffix}"
+    return f"{volume:.0f}"
+
+
+def render(symbols: list[str], rows: np.ndarray) -> str:
+    """Formats a watchlist as one monospaced Markdown table.
+
+    Parameters
+    ----------
+    symbols : list[str]
+        Base currencies in watchlist order.
+
+    rows : np.ndarray
+        TickerSnapshot.COLUMNS of each symbol, NaN for pairs without a ticker.
+
+    Returns
+    -------
+    str
+        Price, 24h change and 24h quote volume per symbol.
+    """
+    last, open_price, quote_volume = rows[:, 0], rows[:, 1], rows[:, 5]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = (last / open_price - 1) * 100
+    known = ~np.isnan(last)
+
+    width = max(map(len, symbols), default=0)
+    lines = [f"{'':<{width}} {'Price':>12} {'24h':>8} {'Volume':>7}"]
+    for symbol, ok, price, pct, volume in zip(
+        symbols, known.tolist(), last.tolist(), change.tolist(), quote_volume.tolist()
+    ):
+        if not ok:
+            lines.append(f"{symbol:<{width}} {'-':>12}")
+            continue
+        pct = f"{pct:+.2f}%" if np.isfinite(pct) else "-"
+        lines.append(
+            f"{symbol:<{width}} {_price(price):>12} {pct:>8} {_volume(volume):>7}"
+        )
+    return "```\n" + "\n".join(lines) + "\n```"
+
+
+class Watchlists:
+    """
+    Symbols each chat follows, in the order they were added.
+    """
+
+    def __init__(
+        self, path: str = WATCHLIST_STORE, max_symbols: int = MAX_WATCHLIST
+    ) -> None:
+        """Loads the stored watchlists.
+
+        Parameters
+        ----------
+        path : str
+            List records, the symbol table is kept next to it.
+
+        max_symbols : int
+            Most symbols on one watchlist.
+        """
+        self.path = path
+        self.max_symbols = max_symbols
+
+        self._names = []  # Symbol table, id -> symbol
+        self._ids = {}
+        self._lists = {}  # chat -> [symbol id]
+        self.load()
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_names(self) -> None:
+        try:
+            with open(self.path + ".symbols", encoding="utf-8") as f:
+                names = f.read().split()
+        except OSError:
+            names = []
+        self._names = names
+        self._ids = {name: i for i, name in enumerate(names)}
+
+    def _read(self) -> np.ndarray:
+        try:
+            count = os.path.getsize(self.path) // RECORD.itemsize
+        except OSError:
+            count = 0
+        if count == 0:
+            return np.empty(0, dtype=RECORD)
+
+        records = np.fromfile(self.path, dtype=RECORD, count=count)
+        # The newest record of each (chat, symbol) says whether it is listed.
+        newest = records[::-1]
+        _, first = np.unique(newest[["chat", "symbol"]], return_index=True)
+        records = newest[np.sort(first)][::-1]
+        return records[records["live"]]
+
+    def load(self) -> None:
+        """Compacts the stored records and replaces the lists in memory."""
+        with self._locked():
+            self._read_names()
+            records = self._read()
+            with open(self.path + ".tmp", "wb") as f:
+                f.write(records.tobytes())
+            os.replace(self.path + ".tmp", self.path)
+
+        lists = {}
+        for chat, symbol, _ in records.tolist():
+            lists.setdefault(chat, []).append(symbol)
+        self._lists = lists
+        info(f"Loaded {len(lists)} watchlists.")
+
+    def _symbol_ids(self, symbols: Iterable[str]) -> list[int]:
+        """Symbol table ids, symbols not in it yet are appended."""
+        if missing := [s for s in symbols if s not in self._ids]:
+            # Another process may have added symbols since the table was read.
+            self._read_names()
+            if missing := [s for s in dict.fromkeys(missing) if s not in self._ids]:
+                with open(self.path + ".symbols", "a", encoding="utf-8") as f:
+                    f.write("".join(name + "\n" for name in missing))
+                self._read_names()
+        return [self._ids[s] for s in symbols]
+
+    def _append(self, chat: int, ids: list[int], live: bool) -> None:
+        out = np.empty(len(ids), dtype=RECORD)
+        out["chat"], out["symbol"], out["live"] = chat, ids, live
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, out.tobytes())
+        finally:
+            os.close(fd)
+
+    def get(self, chat: int) -> list[str]:
+        """Symbols on a chats watchlist, oldest first."""
+        return [self._names[i] for i in self._lists.get(chat, ())]
+
+    def add(self, chat: int, symbols: list[str]) -> list[str]:
+        """Adds symbols to a watchlist until it has max_symbols.
+
+        Parameters
+        ----------
+        chat : int
+            Chat the watchlist belongs to.
+
+        symbols : list[str]
+            Base currencies. ie ["BTC", "ETH"]
+
+        Returns
+        -------
+        list[str]
+            Symbols that were added, ones already listed are skipped.
+        """
+        with self._locked():
+            ids = self._symbol_ids(symbols)
+            listed = self._lists.get(chat, [])
+            new = [i for i in dict.fromkeys(ids) if i not in listed]
+            new = new[: max(self.max_symbols - len(listed), 0)]
+            if new:
+                self._lists[chat] = listed + new
+                self._append(chat, new, True)
+        return [self._names[i] for i in new]
+
+    def remove(self, chat: int, symbols: list[str]) -> list[str]:
+        """Removes symbols from a watchlist, returns the ones that were on it."""
+        listed = self._lists.get(chat, [])
+        gone = [i for i in dict.fromkeys(map(self._ids.get, symbols)) if i in listed]
+        if gone:
+            with self._locked():
+                if kept := [i for i in listed if i not in gone]:
+                    self._lists[chat] = kept
+                else:
+                    del self._lists[chat]
+                self._append(chat, gone, False)
+        return [self._names[i] for i in gone]
+
+    def stats(self) -> str:
+        """Human readable count of watchlists."""
+        return f"Watchlists: {len(self._lists)} chats."
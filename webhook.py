@@ -0,0 +1,225 @@
+"""Webhook execution mode for the bot.
+
+A threaded HTTP server receives updates from Telegram, checks the secret
+token and hands each update to one of several worker processes. Updates of
+the same chat always go to the same worker, so a chat is answered in order
+while different chats are spread over every core. Each worker runs the
+handlers from bot.py through its own Dispatcher. Workers share one SQLite
+cache unless CACHE_BACKEND says otherwise, so the ticker and symbol polling
+of every worker is served by a single upstream call per refresh.
+
+    python webhook.py                       # serve
+    python webhook.py post update.json ...  # send recorded updates locally
+"""
+
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import info, warning
+from typing import Optional
+
+import metrics
+
+# Set before the workers import the cache backend. With a memory cache each
+# worker would poll the exchange on its own.
+os.environ.setdefault("CACHE_BACKEND", "sqlite")
+
+TELEGRAM_TOKEN = os.environ["TELEGRAM"]
+TELEGRAM_ENDPOINT = os.environ.get("TELEGRAM_ENDPOINT", "https://api.telegram.org")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # Public URL, registered with Telegram
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8443))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", os.cpu_count() or 2))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+
+received = metrics.registry.counter(
+    "webhook_updates_total", "Updates received by the webhook.", ("result",)
+)
+
+
+def route_key(update: dict) -> int:
+    """Chat id of an update, or the sender for updates without a chat."""
+    for value in update.values():
+        if isinstance(value, dict):
+            if "chat" in value:
+                return value["chat"]["id"]
+            if "from" in value:
+                return value["from"]["id"]
+    return update.get("update_id", 0)
+
+
+def _worker(index: int, workers: int, queue: multiprocessing.Queue) -> None:
+    """Runs the bots handlers on updates read from queue until None arrives."""
+    from telegram import Bot, Update
+    from telegram.ext import Dispatcher
+
+    # The bot module builds its router, caches and chart pool in setup.
+    import bot as handlers
+
+    handlers.setup()
+    tg = Bot(TELEGRAM_TOKEN, base_url=f"{TELEGRAM_ENDPOINT}/bot")
+    dp = Dispatcher(tg, None, workers=4)
+    handlers.register_handlers(dp)
+    handlers.register_metrics(queue.qsize)
+    if metrics.METRICS_PORT:
+        metrics.serve(metrics.METRICS_PORT + 1 + index)
+    handlers.renderer.warm()
+    # Each worker checks the alerts of the chats routed to it.
+    handlers.start_alerts(tg, lambda chat: chat % workers == index)
+
+    info(f"Webhook worker {index} ready.")
+    while (data := queue.get()) is not None:
+        try:
+            dp.process_update(Update.de_json(json.loads(data), tg))
+        except Exception:
+            logging.exception(f"Worker {index} failed to process an update")
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, queues: list, secret: str) -> None:
+        """
+        Parameters
+        ----------
+        address : tuple
+            (host, port) to listen on.
+
+        queues : list
+            One multiprocessing queue per worker.
+
+        secret : str
+            Expected value of the secret token header, empty accepts any request.
+        """
+        super().__init__(address, _Handler)
+        self.queues = queues
+        self.secret = secret
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: WebhookServer
+
+    def _reply(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        secret = self.headers.get(SECRET_HEADER, "")
+        if self.server.secret and not hmac.compare_digest(secret, self.server.secret):
+            received.inc("forbidden")
+            self._reply(403)
+            return
+
+        try:
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            update = json.loads(data)
+            queue = self.server.queues[route_key(update) % len(self.server.queues)]
+        except (ValueError, TypeError, KeyError, AttributeError):
+            received.inc("invalid")
+            self._reply(400)
+            return
+
+        # Telegram only needs to know the update arrived, handlers answer later.
+        queue.put(data)
+        received.inc("accepted")
+        self._reply(200)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(
+    host: str = WEBHOOK_HOST,
+    port: int = WEBHOOK_PORT,
+    workers: int = WEBHOOK_WORKERS,
+    url: Optional[str] = WEBHOOK_URL,
+    secret: str = WEBHOOK_SECRET,
+) -> None:
+    """Starts the workers, registers the webhook and serves until interrupted."""
+    if url and not secret:
+        sys.exit("WEBHOOK_SECRET must be set when WEBHOOK_URL is registered.")
+
+    # forkserver children do not inherit the servers threads or sockets.
+    ctx = multiprocessing.get_context("forkserver")
+    queues = [ctx.Queue() for _ in range(workers)]
+    processes = [
+        ctx.Process(
+            target=_worker, args=(i, workers, q), name=f"webhook-{i}", daemon=True
+        )
+        for i, q in enumerate(queues)
+    ]
+    for p in processes:
+        p.start()
+
+    for i, q in enumerate(queues):
+        metrics.registry.gauge(
+            f"webhook_worker_{i}_backlog",
+            f"Updates waiting for webhook worker {i}.",
+            q.qsize,
+        )
+    metrics.serve()
+
+    if url:
+        from telegram import Bot
+
+        Bot(TELEGRAM_TOKEN, base_url=f"{TELEGRAM_ENDPOINT}/bot").set_webhook(
+            url,
+            allowed_updates=["message", "inline_query"],
+            api_kwargs={"secret_token": secret},
+        )
+        info(f"Webhook registered at {url}")
+
+    server = WebhookServer((host, port), queues, secret)
+    info(f"Webhook listening on {host}:{port} with {workers} workers.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for q in queues:
+            q.put(None)
+        for p in processes:
+            p.join(timeout=10)
+
+
+def post(paths: list, url: str = None, secret: str = WEBHOOK_SECRET) -> None:
+    """POSTs recorded update JSON files to a running webhook server."""
+    url = url or f"http://127.0.0.1:{WEBHOOK_PORT}/"
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        request = urllib.request.Request(
+            url,
+            data=data,
+            headers={"Content-Type": "application/json", SECRET_HEADER: secret},
+        )
+        try:
+            with urllib.request.urlopen(request) as resp:
+                print(f"{path}: {resp.status}")
+        except urllib.error.HTTPError as e:
+            warning(f"{path}: {e.code}")
+
+
+def main():
+    if sys.argv[1:2] == ["post"]:
+        post(sys.argv[2:])
+    else:
+        serve()
+
+
+if __name__ == "__main__":
+    main()